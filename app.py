@@ -2,17 +2,26 @@
 # Imports
 #----------------------------------------------------------------------------#
 from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
 import datetime as dt
+import functools
+import hashlib
 import json
+import re
+import sys
+import os
+import time
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import click
+from flask.cli import AppGroup
+from flask import (Flask, Blueprint, render_template, request, Response, flash,
+                   redirect, url_for, abort, jsonify, session, make_response,
+                   current_app, g)
 from flask_migrate import Migrate
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.ext.hybrid import hybrid_property
-import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 
@@ -21,23 +30,268 @@ from models import (db, ArtistsGenresJunction,
                     Venues,
                     Areas,
                     Artists,
-                    Genres,
-                    Shows)
+                    Shows,
+                    ChangeCounters,
+                    BULK_LOADS,
+                    sort_name,
+                    bump_versions,
+                    entity_version_name,
+                    table_versions)
                       # importing db is new
+from search_index import (venue_names, artist_names, genre_names,
+                          rebuild_search_indexes)
+from page_cache import page_cache, venue_page_key, artist_page_key
+from show_counters import roll_over_show_counters, verify_show_counters
+from reference_data import reference_data
+from bulk_import import import_file
+import snapshots
+from config import profile
+import cache_sync
+import instrumentation
+import metrics
+import profiling
+import slow_queries
+import logging_setup
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-#db = SQLAlchemy(app)
-db.init_app(app)
-migrate = Migrate(app, db)
+# Views and commands live on the views blueprint; create_app() builds an
+# app around them for a config profile. The module level app is created
+# on first access (import app; app.app, or FLASK_APP=app), so importing
+# this module for create_app() does not build a second one.
+
+views = Blueprint('fyyur', __name__, cli_group=None)
+moment = Moment()
+migrate = Migrate()
+
+def instance_secret_key(app):
+  """
+  Return the secret key kept in the app's instance folder, creating it
+  on first use, so that all workers and restarts share one key.
+  """
+  path = os.path.join(app.instance_path, 'secret_key')
+  os.makedirs(app.instance_path, exist_ok=True)
+  if not os.path.exists(path):
+      temp_path = f'{path}.{os.getpid()}'
+      fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+      with os.fdopen(fd, 'w') as f:
+          f.write(os.urandom(32).hex())
+      try:
+          # atomic, a key written by another process in the meantime wins
+          os.link(temp_path, path)
+      except FileExistsError:
+          pass
+      finally:
+          os.remove(temp_path)
+  with open(path) as f:
+      return f.read().strip()
+
+def create_app(config=None):
+  """
+  Create the Fyyur app.
+
+  Parameters:
+  config: name of a config.py profile, FYYUR_CONFIG or 'dev' by default;
+          or a dict or object of settings applied over that profile
+
+  Returns:
+  app (Flask): the configured app
+  """
+  app = Flask(__name__)
+  app.config.from_object('config')
+  if config is None or isinstance(config, str):
+      app.config.from_mapping(profile(config))
+  else:
+      app.config.from_mapping(profile())
+      if isinstance(config, dict):
+          app.config.from_mapping(config)
+      else:
+          app.config.from_object(config)
+  if not app.config.get('SECRET_KEY'):
+      app.config['SECRET_KEY'] = instance_secret_key(app)
+
+  moment.init_app(app)
+  db.init_app(app)
+  migrate.init_app(app, db)
+  page_cache.init_app(app)
+  cache_sync.init_app(app)
+  instrumentation.init_app(app)
+  metrics.init_app(app)
+  profiling.init_app(app)
+  slow_queries.init_app(app)
+  logging_setup.init_app(app)
+  app.register_blueprint(views)
+  return app
+
+def __getattr__(name):
+  # the module level app, see above
+  global app
+  if name == 'app':
+      app = create_app()
+      return app
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # DONE: connect to a local postgresql database
 
+def warm_caches(app):
+  """
+  Build this process's search indexes and genre and area registry now
+  rather than on the first request, e.g. in the master of a pre-fork
+  server so that all workers share them, see gunicorn.conf.py.
+  """
+  with app.app_context():
+      rebuild_search_indexes()
+      reference_data.warm()
+  app.extensions['fyyur_caches_warm'] = True
+
+@views.before_app_first_request
+def build_search_indexes():
+  if not current_app.extensions.get('fyyur_caches_warm'):
+      rebuild_search_indexes()
+      reference_data.warm()
+
+@views.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+  """Resync the in-memory venue, artist and genre name indexes from the database."""
+  # bumping the counters makes running servers rebuild theirs as well
+  bump_versions(db.session, ['Venues', 'Artists', 'Genres'])
+  db.session.commit()
+  num_venues, num_artists, num_genres = rebuild_search_indexes()
+  print(f'indexed {num_venues} venues, {num_artists} artists '
+        f'and {num_genres} genres')
+
+@views.cli.command('roll-over-show-counters')
+@click.option('--every', type=int, default=None,
+              help='Keep running, rolling over every this many seconds.')
+def roll_over_show_counters_command(every):
+  """Move started shows from the upcoming to the past show counters."""
+  while True:
+      try:
+          rolled = roll_over_show_counters()
+          print(f'rolled over {rolled} shows', flush=True)
+      except SQLAlchemyError as error:
+          # e.g. the database restarting, the next run retries
+          db.session.rollback()
+          if every is None:
+              raise
+          print(f'roll-over failed: {error}', file=sys.stderr, flush=True)
+      if every is None:
+          return
+      time.sleep(every)
+
+@views.cli.command('verify-show-counters')
+@click.option('--fix', is_flag=True, help='Overwrite drifted counters.')
+def verify_show_counters_command(fix):
+  """Recompute the show counters and report any drift."""
+  drift = verify_show_counters(fix=fix)
+  for table_name, id_, stored, actual in drift:
+      print(f'{table_name} {id_}: stored upcoming/past {stored[0]}/{stored[1]}, '
+            f'actual {actual[0]}/{actual[1]}')
+  print(f'{len(drift)} drifted rows' + (' fixed' if fix else ''))
+  if drift and not fix:
+      sys.exit(1)
+
+@views.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('paths', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              default=None, help='File format, by default from the extension.')
+@click.option('--batch-size', default=10000, help='Rows per transaction.')
+@click.option('--show-errors', default=50, help='Number of row errors to print.')
+def import_command(kind, paths, fmt, batch_size, show_errors):
+  """
+  Bulk load CSV or NDJSON files of venues, artists or shows.
+
+  Venues and artists keep the ids of an id column, rows whose id exists
+  already are rejected; shows refer to them by venue_id and artist_id.
+  """
+  reference_data.warm()
+  num_errors = 0
+  for path in paths:
+      report = import_file(kind, path, fmt, batch_size)
+      for line, message in sorted(report.errors)[:show_errors]:
+          print(f'{path}:{line}: {message}')
+      num_errors += len(report.errors)
+      print(f'{path}: loaded {report.loaded} {kind} in {report.seconds:.1f}s '
+            f'({report.rows_per_second:,.0f} rows/s), '
+            f'{len(report.errors)} rows rejected')
+
+  # the loaders bypass the ORM events
+  if kind == 'shows':
+      drift = verify_show_counters(fix=True)
+      print(f'fixed show counters of {len(drift)} venues and artists')
+  forget_cached_data()
+  if num_errors:
+      sys.exit(1)
+
+def forget_cached_data():
+  """drop this process's caches after the tables changed underneath them"""
+  page_cache.clear()
+  rebuild_search_indexes()
+  reference_data.warm()
+
+@views.cli.command('reset-db')
+@click.confirmation_option(prompt='Delete all venues, artists, shows, genres '
+                                  'and areas?')
+def reset_db_command():
+  """Empty the Fyyur tables with a single TRUNCATE."""
+  snapshots.reset_tables()
+  forget_cached_data()
+  print('all venues, artists, shows, genres and areas deleted')
+
+snapshot_cli = AppGroup('snapshot', help='Save and restore the whole database.')
+views.cli.add_command(snapshot_cli)
+
+method_option = click.option(
+    '--method', type=click.Choice(['template', 'dump', 'file']), default=None,
+    help='template database or COPY dump (postgres) or file copy (sqlite).')
+
+@snapshot_cli.command('create')
+@click.argument('name')
+@method_option
+def snapshot_create_command(name, method):
+  """Save the database as snapshot NAME."""
+  snapshots.create_snapshot(name, method, current_app.config.get('SNAPSHOT_DIR'))
+  print(f'snapshot {name} created')
+
+@snapshot_cli.command('restore')
+@click.argument('name')
+@method_option
+def snapshot_restore_command(name, method):
+  """Replace the database with snapshot NAME."""
+  snapshots.restore_snapshot(name, method, current_app.config.get('SNAPSHOT_DIR'))
+  forget_cached_data()
+  print(f'snapshot {name} restored')
+
+@snapshot_cli.command('list')
+def snapshot_list_command():
+  """List the saved snapshots."""
+  for name, method in snapshots.list_snapshots(current_app.config.get('SNAPSHOT_DIR')):
+      print(f'{name} ({method})')
+
+@snapshot_cli.command('drop')
+@click.argument('name')
+@method_option
+def snapshot_drop_command(name, method):
+  """Delete snapshot NAME."""
+  snapshots.drop_snapshot(name, method, current_app.config.get('SNAPSHOT_DIR'))
+  print(f'snapshot {name} dropped')
+
+@views.cli.command('profile-report')
+@click.option('--dir', 'directory', default=None,
+              help='Directory with .pstats files, PROFILE_DIR by default.')
+@click.option('--endpoint', default=None, help='Only profiles of this endpoint.')
+@click.option('--top', default=20, help='Number of functions to list.')
+@click.option('--sort', default='cumulative', help='pstats sort key.')
+def profile_report_command(directory, endpoint, top, sort):
+  """Aggregate captured request profiles into a hot function report."""
+  directory = directory or current_app.config.get('PROFILE_DIR', 'profiles')
+  report = profiling.profile_report(directory, endpoint, top, sort)
+  print(report or f'no profiles in {directory}')
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
@@ -50,76 +304,375 @@ def format_datetime(value, format='medium'):
       format="EE MM, dd, y h:mma"
   return babel.dates.format_datetime(date, format)
 
-app.jinja_env.filters['datetime'] = format_datetime
+views.add_app_template_filter(format_datetime, 'datetime')
+
+#----------------------------------------------------------------------------#
+# Pagination.
+#----------------------------------------------------------------------------#
+
+# Listings are paginated on a (sort key, id) keyset rather than with
+# OFFSET, so every page is an index range scan wherever it starts.
+
+def encode_cursor(key, row_id):
+  if isinstance(key, dt.datetime):
+      key = key.isoformat()
+  return f'{key}_{row_id}'
+
+def decode_cursor(cursor, key_type=str):
+  key, _, row_id = cursor.rpartition('_')
+  try:
+      if key_type is dt.datetime:
+          key = dt.datetime.fromisoformat(key)
+      return key, int(row_id)
+  except ValueError:
+      abort(400)
+
+def keyset_page(query, key, page_size, before=None, after=None):
+  """
+  Return one page of query ordered on the key columns.
+
+  Parameters:
+  query (Query): query selecting the key columns as its first two columns
+  key (tuple): (sort column, id column)
+  page_size (int): number of rows per page
+  before (tuple): key values the page ends before, pages backwards
+  after (tuple): key values the page starts after
+
+  Returns:
+  page (tuple): (rows, earlier_cursor, later_cursor), a cursor is None
+                when there is no page in its direction
+  """
+  key_tuple = db.tuple_(*key)
+  if before is not None:
+      rows = query.filter(key_tuple < before).\
+          order_by(*[column.desc() for column in key]).\
+          limit(page_size + 1).all()
+      has_earlier, has_later = len(rows) > page_size, True
+      rows = rows[:page_size][::-1]
+  else:
+      if after is not None:
+          query = query.filter(key_tuple > after)
+      rows = query.order_by(*key).limit(page_size + 1).all()
+      has_earlier, has_later = after is not None, len(rows) > page_size
+      rows = rows[:page_size]
+
+  if rows:
+      earlier_cursor = encode_cursor(rows[0][0], rows[0][1])
+      later_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+  elif before or after:
+      earlier_cursor = later_cursor = encode_cursor(*(before or after))
+  else:
+      return rows, None, None
+
+  return (rows,
+          earlier_cursor if has_earlier else None,
+          later_cursor if has_later else None)
+
+def name_cursor(name, row_id):
+  # cursor of a /venues or /artists row, on the key of sort_name()
+  return encode_cursor((name or '').lower(), row_id)
+
+def name_page_bounds():
+  # ?before= / ?after= cursors of a listing sorted by sort_name(), ?letter=
+  # jumps to the first name starting with that letter in either case
+  before = request.args.get('before')
+  after = request.args.get('after')
+  letter = request.args.get('letter')
+  if before:
+      return decode_cursor(before), None
+  if after:
+      return None, decode_cursor(after)
+  if letter:
+      return None, (letter[:1].lower(), 0)
+  return None, None
+
+# table name -> (change counter, letter index) of this process
+letter_indexes = {}
+
+def letter_index(name_column):
+  # first letters of all names with their counts, in one grouped query
+  # over the whole table; kept until the table's change counter moves,
+  # which conditional() has read for the page already
+  table_name = name_column.table.name
+  versions = g.get('table_versions')
+  if versions is None or table_name not in versions:
+      versions = table_versions([table_name])
+  version = versions.get(table_name)
+  cached = letter_indexes.get(table_name)
+  if cached is not None and cached[0] == version:
+      return cached[1]
+
+  letter = db.func.upper(db.func.substr(name_column, 1, 1))
+  letters = db.session.query(letter, db.func.count()).\
+      filter(name_column != None).\
+      group_by(letter).order_by(letter).all()
+  letter_indexes[table_name] = (version, letters)
+  return letters
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+def search_ids(model, name_index, search_term):
+  """
+  Return ids of model rows matching search_term, best match first.
+
+  On postgres the words of the term are matched as prefixes against the
+  full-text search_vector (name, genres, city and state) and ranked with
+  ts_rank; the in-memory name index answers when that finds nothing or
+  the database has no full-text search.
+  """
+  limit = current_app.config.get('SEARCH_MAX_RESULTS', 50)
+  words = re.findall(r'\w+', search_term)
+  if words and db.engine.dialect.name == 'postgresql':
+      ts_query = db.func.to_tsquery('english',
+                                    ' & '.join(f'{word}:*' for word in words))
+      ranked_qry = db.session.query(model.id).\
+          filter(model.search_vector.op('@@')(ts_query)).\
+          order_by(db.func.ts_rank(model.search_vector, ts_query).desc(),
+                   model.id).\
+          limit(limit)
+      ids = [id_ for id_, in ranked_qry]
+      if ids:
+          return ids
+  return name_index.search(search_term, limit)
+
+#----------------------------------------------------------------------------#
+# Page cache.
+#----------------------------------------------------------------------------#
+
+def page_cacheable():
+  # pages carrying flashed messages belong to one visitor only
+  return '_flashes' not in session
+
+#----------------------------------------------------------------------------#
+# Conditional requests.
+#----------------------------------------------------------------------------#
+
+def page_version(tables, entity=None):
+  """
+  Return the ETag and Last-Modified of the current page from the change
+  counters of the tables it is built from and the start time of the
+  latest show that already began, which moves shows from upcoming to past.
+  Costs a single query of primary key and index lookups.
+
+  Parameters:
+  tables (tuple): names of the change counters the page depends on
+  entity (tuple): (model, owner column of Shows, id) of the venue or
+                  artist the page shows; its own change counter is used and
+                  only its shows count for the latest start time
+
+  Returns:
+  version (tuple): (etag, last_modified, versions), versions maps the
+                   names to their (version, updated_at) or None
+  """
+  now = dt.datetime.utcnow()
+  latest_show = db.select([db.func.max(Shows.start_time)]).\
+      where(Shows.start_time <= now)
+  names = list(tables)
+  if entity is not None:
+      model, owner_column, entity_id = entity
+      latest_show = latest_show.where(owner_column == entity_id)
+      names.append(entity_version_name(model.__tablename__, entity_id))
+  counters = []
+  for name in names:
+      for column in (ChangeCounters.version, ChangeCounters.updated_at):
+          counters.append(db.select([column]).
+                          where(ChangeCounters.name == name).as_scalar())
+  stamp = db.session.query(latest_show.as_scalar(), *counters).one()
+
+  times = [time for time in (stamp[0],) + tuple(stamp[2::2])
+           if time is not None]
+  last_modified = max(times) if times else None
+  etag = hashlib.sha1(repr((request.full_path, tuple(stamp))).encode()).\
+      hexdigest()
+  versions = {name: None if stamp[1 + 2 * i] is None
+              else (stamp[1 + 2 * i], stamp[2 + 2 * i])
+              for i, name in enumerate(names)}
+  return etag, last_modified, versions
+
+def conditional(*tables, owner=None):
+  """
+  Answer GETs of the decorated view with a bodyless 304 when the client's
+  If-None-Match or If-Modified-Since still matches the tables' versions,
+  without running the view. owner is (model, name) of the venue or artist
+  the page shows, name being both the view argument with its id and the
+  column of Shows referencing it.
+  """
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+      if request.method != 'GET' or not page_cacheable():
+          return view(*args, **kwargs)
+
+      entity = None
+      if owner is not None:
+          model, name = owner
+          entity = (model, getattr(Shows, name), kwargs[name])
+      etag, last_modified, g.table_versions = page_version(tables, entity)
+      # versions the page cache keys, see page_cache.py
+      g.page_etag = etag
+      if request.if_none_match:
+          not_modified = request.if_none_match.contains(etag)
+      else:
+          since = request.if_modified_since
+          if since is not None and since.tzinfo is not None:
+              since = since.astimezone(dt.timezone.utc).replace(tzinfo=None)
+          not_modified = (since is not None and last_modified is not None and
+                          last_modified.replace(microsecond=0) <= since)
+
+      if not_modified:
+          response = Response(status=304)
+      else:
+          response = make_response(view(*args, **kwargs))
+      response.set_etag(etag)
+      # HTTP dates have whole seconds, a later write within the second of
+      # the last one would not move them; such pages rely on the ETag
+      if last_modified is not None and \
+              dt.datetime.utcnow() - last_modified >= dt.timedelta(seconds=1):
+          response.last_modified = last_modified
+      response.cache_control.no_cache = True
+      return response
+    return wrapper
+  return decorator
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@views.route('/')
 def index():
   return render_template('pages/home.html')
 
 
+#  Search suggestions
+#  ----------------------------------------------------------------
+
+@views.route('/search/suggest')
+def search_suggest():
+  # typeahead names for a prefix, answered from the in-memory indexes,
+  # which cache_sync.py keeps current in the background
+  prefix = request.args.get('q', '')
+  limit = min(request.args.get('k', current_app.config.get('SUGGEST_MAX_RESULTS', 5),
+                               type=int), 20)
+  return jsonify({
+      'venues': [{'id': venue_id, 'name': name}
+                 for venue_id, name in venue_names.suggest(prefix, limit)],
+      'artists': [{'id': artist_id, 'name': name}
+                  for artist_id, name in artist_names.suggest(prefix, limit)],
+      'genres': [name for _, name in genre_names.suggest(prefix, limit)]})
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@views.route('/venues')
+@conditional('Venues', 'Areas', 'Shows', 'ShowCountersState')
 def venues():
   # DONE: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
 
-  data = Areas.query.all()
-  return render_template('pages/venues.html', areas=data);
-
-@app.route('/venues/search', methods=['POST'])
+  # one page of venues by name with their areas and upcoming show counts,
+  # grouped by area for display
+  before, after = name_page_bounds()
+  venue_key = sort_name(Venues.name)
+  venues_qry = db.session.query(venue_key, Venues.id, Venues.name, Areas.id,
+                                Areas.city, Areas.state,
+                                Venues.upcoming_shows_count).\
+      join(Areas, Venues.area_id == Areas.id)
+  page, earlier_cursor, later_cursor = keyset_page(
+      venues_qry, (venue_key, Venues.id),
+      current_app.config.get('VENUES_PER_PAGE', 50), before=before, after=after)
+
+  areas = {}
+  for _, venue_id, venue_name, area_id, city, state, venue_num_shows in page:
+      area = areas.setdefault(area_id, {'id': area_id,
+                                        'city': city,
+                                        'state': state,
+                                        'venues': []})
+      area['venues'].append({'id': venue_id,
+                             'name': venue_name,
+                             'num_upcoming_shows': venue_num_shows})
+  data = sorted(areas.values(), key=lambda area: (area['city'] or '',
+                                                  area['state'] or ''))
+
+  return render_template('pages/venues.html', areas=data,
+                         letters=letter_index(Venues.name),
+                         earlier_cursor=earlier_cursor,
+                         later_cursor=later_cursor)
+
+@views.route('/venues/search', methods=['POST'])
 def search_venues():
   # DONE: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
 
+  # matching ids come ranked from full-text search or the name index
   search_term=request.form.get('search_term', '')
-  qr = Venues.query.filter(Venues.name.ilike(f'%{search_term}%'))
-  cnt = qr.count()
-  data = qr.all()
-
-  response = {'count': cnt,
+  venue_ids = search_ids(Venues, venue_names, search_term)
+  data = []
+  if venue_ids:
+      venues_by_id = {venue.id: venue for venue in
+                      db.session.query(Venues.id, Venues.name).
+                      filter(Venues.id.in_(venue_ids))}
+      data = [venues_by_id[venue_id] for venue_id in venue_ids
+              if venue_id in venues_by_id]
+
+  response = {'count': len(data),
               'data': data}
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/venues/<int:venue_id>')
+@views.route('/venues/<int:venue_id>')
+@conditional(BULK_LOADS, owner=(Venues, 'venue_id'))
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # DONE: replace with real venue data from the venues table, using venue_id
 
-    venue = Venues.query.get(venue_id)
+    # conditional() only versions cacheable GETs
+    version = g.get('page_etag')
+    cacheable = version is not None
+    if cacheable:
+        page = page_cache.get(venue_page_key(venue_id, version))
+        if page is not None:
+            return page
+
+    # venue with its area and genres in one query, all shows with artist
+    # columns in a second one; split into past/upcoming against a single now
+    venue = Venues.query.options(db.joinedload(Venues.area),
+                                 db.joinedload(Venues.genres)).\
+        filter(Venues.id == venue_id).first()
+    if venue is None:
+        abort(404)
 
     venue_genre_names = []
     for genre in venue.genres:
         venue_genre_names.append(genre.name)
 
-    venue_all_shows = Shows.query.filter_by(venue_id=venue.id)
-    venue_past_shows = venue_all_shows.filter(Shows.start_time<dt.datetime.utcnow())
-    venue_upcoming_shows = venue_all_shows.filter(Shows.start_time>dt.datetime.utcnow())
-
-    past_shows_count = venue_past_shows.count()
-    upcoming_shows_count = venue_upcoming_shows.count()
+    venue_all_shows = db.session.query(Shows.start_time,
+                                       Artists.id,
+                                       Artists.name,
+                                       Artists.image_link).\
+        join(Artists, Shows.artist_id == Artists.id).\
+        filter(Shows.venue_id == venue_id).\
+        order_by(Shows.start_time)
 
+    now = dt.datetime.utcnow()
+    next_show_time = None
     past_shows_data_list = []
-    for past_show in venue_past_shows:
-        past_show_dic = {'artist_id': past_show.artist.id,
-                        'artist_name': past_show.artist.name,
-                        'artist_image_link': past_show.artist.image_link,
-                        'start_time': str(past_show.start_time)}
-        past_shows_data_list.append(past_show_dic)
-
     upcoming_shows_data_list = []
-    for upcoming_show in venue_upcoming_shows:
-        upcoming_show_dic = {'artist_id': upcoming_show.artist.id,
-                        'artist_name': upcoming_show.artist.name,
-                        'artist_image_link': upcoming_show.artist.image_link,
-                        'start_time': str(upcoming_show.start_time)}
-        upcoming_shows_data_list.append(upcoming_show_dic)
+    for start_time, artist_id, artist_name, artist_image_link in venue_all_shows:
+        show_dic = {'artist_id': artist_id,
+                    'artist_name': artist_name,
+                    'artist_image_link': artist_image_link,
+                    'start_time': str(start_time)}
+        if start_time > now:
+            next_show_time = next_show_time or start_time
+            upcoming_shows_data_list.append(show_dic)
+        else:
+            past_shows_data_list.append(show_dic)
+
+    past_shows_count = len(past_shows_data_list)
+    upcoming_shows_count = len(upcoming_shows_data_list)
 
     venue_data = {'id': venue.id,
         'name': venue.name,
@@ -138,16 +691,20 @@ def show_venue(venue_id):
         'past_shows_count': past_shows_count,
         'upcoming_shows_count': upcoming_shows_count}
 
-    return render_template('pages/show_venue.html', venue=venue_data)
+    # cached until the next upcoming show turns into a past one at the latest
+    page = render_template('pages/show_venue.html', venue=venue_data)
+    if cacheable:
+        page_cache.set(venue_page_key(venue_id, version), page, expires_at=next_show_time)
+    return page
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@views.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@views.route('/venues/create', methods=['POST'])
 def create_venue_submission():
     # DONE: insert form data as a new Venue record in the db, instead
   # DONE: modify data to be the data object returned from db insertion
@@ -158,38 +715,16 @@ def create_venue_submission():
   # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
 
-    area_exist = not (Areas.query.filter(Areas.state.ilike(request.form['state'])
-                    , Areas.city.ilike(request.form['city'])).count() == 0)
-
-
-    if not area_exist:
-        # adding the area to session if entered area is not in database
-        add_area = Areas(city=request.form['city'].title(),
-                         state=request.form['state'].upper())
-        db.session.add(add_area)
-
-
-    genre_exist = not (Genres.query.filter(Genres.name.ilike(\
-                       request.form['genres'])).count() == 0)
-
-    if not genre_exist:
-        # adding the genre to session if entered genre is not in database
-        add_genre = Genres(name=request.form['genres'].title())
-        db.session.add(add_genre)
-
-    new_venue_area = Areas.query.filter(Areas.city.ilike(request.form['city']),\
-                                Areas.state.ilike(request.form['state'])).first()
-
-    new_venue_genre = Genres.query.filter(Genres.name.ilike(request.form['genres'])).all()
-
     error = False
     try:
+        # the area and genre are added if they are not in the database yet
         add_venue = Venues(name=request.form['name'],
                            address=request.form['address'],
                            phone=request.form['phone'],
                            facebook_link=request.form['facebook_link'],
-                           genres=new_venue_genre,
-                           area=new_venue_area
+                           genres=[reference_data.genre(request.form['genres'])],
+                           area=reference_data.area(request.form['city'],
+                                                    request.form['state'])
                            )
         db.session.add(add_venue)
         db.session.commit()
@@ -205,7 +740,7 @@ def create_venue_submission():
 
     return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@views.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
     # DONE: Complete this endpoint for taking a venue_id, and using
     # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
@@ -223,67 +758,99 @@ def delete_venue(venue_id):
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@views.route('/artists')
+@conditional('Artists')
 def artists():
   # DONE: replace with real data returned from querying the database
-  data = Artists.query.all()
-  return render_template('pages/artists.html', artists=data)
-
-@app.route('/artists/search', methods=['POST'])
+  before, after = name_page_bounds()
+  artist_key = sort_name(Artists.name)
+  artists_qry = db.session.query(artist_key, Artists.id, Artists.name)
+  data, earlier_cursor, later_cursor = keyset_page(
+      artists_qry, (artist_key, Artists.id),
+      current_app.config.get('ARTISTS_PER_PAGE', 50), before=before, after=after)
+
+  return render_template('pages/artists.html', artists=data,
+                         letters=letter_index(Artists.name),
+                         earlier_cursor=earlier_cursor,
+                         later_cursor=later_cursor)
+
+@views.route('/artists/search', methods=['POST'])
 def search_artists():
     # DONE: implement search on artists with partial string search. Ensure it is case-insensitive.
     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
     # search for "band" should return "The Wild Sax Band".
-    search_term = request.form.get("search_term")
-    artist_query = Artists.query.filter(
-                    Artists.name.ilike(f'%{search_term}%'))
-    results_count = artist_query.count()
+    search_term = request.form.get('search_term', '')
+    artist_ids = search_ids(Artists, artist_names, search_term)
 
+    # matching artists with their upcoming show counts in one query,
+    # kept in the ranking order of the search
     artist_data = []
-    for artist in artist_query.all():
-        artist_num_upcoming_shows = db.session.query(Shows).\
-        filter(Shows.artist_id==artist.id).\
-        filter(Shows.start_time>dt.datetime.utcnow()).count()
-        artist_dict = {'id': artist.id,
-                       'name': artist.name,
-                       'num_upcoming_shows': artist_num_upcoming_shows
-                       }
-        artist_data.append(artist_dict)
-
-    response = {'count': results_count,
+    if artist_ids:
+        artist_query = db.session.query(Artists.id,
+                                        Artists.name,
+                                        Artists.upcoming_shows_count).\
+            filter(Artists.id.in_(artist_ids))
+
+        artists_by_id = {}
+        for artist_id, artist_name, artist_num_upcoming_shows in artist_query:
+            artists_by_id[artist_id] = {'id': artist_id,
+                                        'name': artist_name,
+                                        'num_upcoming_shows': artist_num_upcoming_shows
+                                        }
+        artist_data = [artists_by_id[artist_id] for artist_id in artist_ids
+                       if artist_id in artists_by_id]
+
+    response = {'count': len(artist_data),
                 'data': artist_data}
 
     return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
-@app.route('/artists/<int:artist_id>')
+@views.route('/artists/<int:artist_id>')
+@conditional(BULK_LOADS, owner=(Artists, 'artist_id'))
 def show_artist(artist_id):
     # shows the artist page with the given artist_id
     # DONE: replace with real artist data from the artist table, using artist_id
 
-    artist = Artists.query.filter_by(id=artist_id).first()
-    all_shows_qry = db.session.query(Shows).filter(Shows.artist_id==artist_id)
-
-    upcoming_shows_qry = all_shows_qry.filter(Shows.start_time>dt.datetime.utcnow())
-    past_shows_qry = all_shows_qry.filter(Shows.start_time<dt.datetime.utcnow())
-
-    upcoming_shows_count = upcoming_shows_qry.count()
-    past_shows_count = past_shows_qry.count()
-
+    # conditional() only versions cacheable GETs
+    version = g.get('page_etag')
+    cacheable = version is not None
+    if cacheable:
+        page = page_cache.get(artist_page_key(artist_id, version))
+        if page is not None:
+            return page
+
+    # artist with genres in one query, all shows with venue columns in a
+    # second one; split into past/upcoming against a single now
+    artist = Artists.query.options(db.joinedload(Artists.genres)).\
+        filter(Artists.id == artist_id).first()
+    if artist is None:
+        abort(404)
+
+    all_shows_qry = db.session.query(Shows.start_time,
+                                     Venues.id,
+                                     Venues.name,
+                                     Venues.image_link).\
+        join(Venues, Shows.venue_id == Venues.id).\
+        filter(Shows.artist_id == artist_id).\
+        order_by(Shows.start_time)
+
+    now = dt.datetime.utcnow()
+    next_show_time = None
     data_upcoming_shows = []
-    for upcoming_show in upcoming_shows_qry.all():
-        upcoming_show_dict = {'venue_id': upcoming_show.venue_id,
-                              'venue_name': upcoming_show.venue.name,
-                              'venue_image_link': upcoming_show.venue.image_link,
-                              'start_time': str(upcoming_show.start_time)}
-        data_upcoming_shows.append(upcoming_show_dict)
-
     data_past_shows = []
-    for past_show in past_shows_qry.all():
-        past_show_dict = {'venue_id': past_show.venue_id,
-                              'venue_name': past_show.venue.name,
-                              'venue_image_link': past_show.venue.image_link,
-                              'start_time': str(past_show.start_time)}
-        data_past_shows.append(past_show_dict)
+    for start_time, venue_id, venue_name, venue_image_link in all_shows_qry:
+        show_dict = {'venue_id': venue_id,
+                     'venue_name': venue_name,
+                     'venue_image_link': venue_image_link,
+                     'start_time': str(start_time)}
+        if start_time > now:
+            next_show_time = next_show_time or start_time
+            data_upcoming_shows.append(show_dict)
+        else:
+            data_past_shows.append(show_dict)
+
+    upcoming_shows_count = len(data_upcoming_shows)
+    past_shows_count = len(data_past_shows)
 
     genres_names = []
     for genre in artist.genres:
@@ -305,11 +872,14 @@ def show_artist(artist_id):
             'upcoming_shows_count': upcoming_shows_count
             }
 
-    return render_template('pages/show_artist.html', artist=data)
+    page = render_template('pages/show_artist.html', artist=data)
+    if cacheable:
+        page_cache.set(artist_page_key(artist_id, version), page, expires_at=next_show_time)
+    return page
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@views.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
     form = ArtistForm()
     artist_fake={
@@ -332,25 +902,18 @@ def edit_artist(artist_id):
     # DONE: populate form with fields from artist with ID <artist_id>
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@views.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
     # DONE: take values from the form submitted, and update existing
     # artist record with ID <artist_id> using the new attributes
     artist = Artists.query.get(artist_id)
 
-
-    genre_exist = not (Genres.query.filter(Genres.name.ilike(\
-                     request.form['genres'])).count() == 0)
-
-    if not genre_exist:
-        # adding the genre to session if entered genre is not in database
-        add_genre = Genres(name=request.form['genres'].title())
-        db.session.add(add_genre)
-
     artist.name = request.form['name']
     artist.city = request.form['city']
     artist.state = request.form['state']
     artist.phone = request.form['phone']
+    # the genre is added if it is not in the database yet
+    artist.genres = [reference_data.genre(request.form['genres'])]
 
     try:
         db.session.commit()
@@ -360,9 +923,9 @@ def edit_artist_submission(artist_id):
     finally:
         db.session.close()
 
-    return redirect(url_for('show_artist', artist_id=artist_id))
+    return redirect(url_for('fyyur.show_artist', artist_id=artist_id))
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@views.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
     form = VenueForm()
 
@@ -371,39 +934,19 @@ def edit_venue(venue_id):
     # DONE: populate form with values from venue with ID <venue_id>
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@views.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
     # DONE: take values from the form submitted, and update existing
     # venue record with ID <venue_id> using the new attributes
 
-    area_exist = not (Areas.query.filter(Areas.state.ilike(request.form['state'])
-                        , Areas.city.ilike(request.form['city'])).count() == 0)
-
-    if not area_exist:
-        # adding the area to session if entered area is not in database
-        add_area = Areas(city=request.form['city'].title(),
-                         state=request.form['state'].upper())
-        db.session.add(add_area)
-
-    genre_exist = not (Genres.query.filter(Genres.name.ilike(\
-                       request.form['genres'])).count() == 0)
-
-    if not genre_exist:
-        # adding the genre to session if entered genre is not in database
-        add_genre = Genres(name=request.form['genres'].title())
-        db.session.add(add_genre)
-
     venue = Venues.query.get(venue_id)
     venue.name = request.form['name']
     venue.address = request.form['address']
     venue.phone = request.form['phone']
-    genre = Genres.query.filter_by(name = request.form['genres']).first()
-    venue.genres = [genre]
-
-    areaa = Areas.query.filter(Areas.state.ilike(request.form['state'])
-                        , Areas.city.ilike(request.form['city'])).first()
-
-    venue.area = areaa
+    # the area and genre are added if they are not in the database yet
+    venue.genres = [reference_data.genre(request.form['genres'])]
+    venue.area = reference_data.area(request.form['city'],
+                                     request.form['state'])
     venue.facebook_link = request.form['facebook_link']
 
     try:
@@ -413,41 +956,31 @@ def edit_venue_submission(venue_id):
         flash('Something went wrong')
     finally:
         db.session.close()
-    return redirect(url_for('show_venue', venue_id=venue_id))
+    return redirect(url_for('fyyur.show_venue', venue_id=venue_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@views.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@views.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     # called upon submitting the new artist listing form
     # DONE: insert form data as a new Artist record in the db, instead
     # DONE: modify data to be the data object returned from db insertion
 
-    genre_exist = not (Genres.query.filter(Genres.name.ilike(\
-                       request.form['genres'])).count() == 0)
-
-    if not genre_exist:
-        # adding the genre to session if entered genre is not in database
-        add_genre = Genres(name=request.form['genres'].title())
-        db.session.add(add_genre)
-
-    new_artist = Artists(name=request.form['name'],
-                         city=request.form['city'],
-                         state=request.form['state'],
-                         phone=request.form['phone'],
-                         facebook_link=request.form['facebook_link'])
-
-    genres = Genres.query.filter_by(name = request.form['genres']).all()
-    new_artist.genres = genres
-
     error = False
     try:
+        new_artist = Artists(name=request.form['name'],
+                             city=request.form['city'],
+                             state=request.form['state'],
+                             phone=request.form['phone'],
+                             facebook_link=request.form['facebook_link'])
+        # the genre is added if it is not in the database yet
+        new_artist.genres = [reference_data.genre(request.form['genres'])]
         db.session.add(new_artist)
         db.session.commit()
         db.session.refresh(new_artist)
@@ -470,40 +1003,65 @@ def create_artist_submission():
     if error:
         return render_template('pages/home.html')
     else:
-        return redirect(url_for('show_artist', artist_id=new_artist.id))
+        return redirect(url_for('fyyur.show_artist', artist_id=new_artist.id))
 
 
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@views.route('/shows')
+@conditional('Shows', 'Venues', 'Artists')
 def shows():
   # displays list of shows at /shows
   # DONE: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
 
-  all_shows = Shows.query.all()
+  # starts at upcoming shows, ?after= pages forward and ?before= pages
+  # back into history
+  before = request.args.get('before')
+  after = request.args.get('after')
+  if before:
+      before = decode_cursor(before, dt.datetime)
+  elif after:
+      after = decode_cursor(after, dt.datetime)
+  else:
+      after = (dt.datetime.utcnow(), 0)
+
+  shows_qry = db.session.query(Shows.start_time,
+                               Shows.id,
+                               Venues.id,
+                               Venues.name,
+                               Artists.id,
+                               Artists.name,
+                               Artists.image_link).\
+      join(Venues, Shows.venue_id == Venues.id).\
+      join(Artists, Shows.artist_id == Artists.id)
+  page, earlier_cursor, later_cursor = keyset_page(
+      shows_qry, (Shows.start_time, Shows.id),
+      current_app.config.get('SHOWS_PER_PAGE', 30), before=before, after=after)
 
   data = []
-  for show in all_shows:
-      show_dict = {'venue_id': show.venue_id,
-                   'venue_name': show.venue.name,
-                   'artist_id': show.artist_id,
-                   'artist_name': show.artist.name,
-                   'artist_image_link': show.artist.image_link,
-                   'start_time': str(show.start_time)}
+  for start_time, show_id, venue_id, venue_name, artist_id, artist_name, \
+          artist_image_link in page:
+      show_dict = {'venue_id': venue_id,
+                   'venue_name': venue_name,
+                   'artist_id': artist_id,
+                   'artist_name': artist_name,
+                   'artist_image_link': artist_image_link,
+                   'start_time': str(start_time)}
       data.append(show_dict)
 
+  return render_template('pages/shows.html', shows=data,
+                         earlier_cursor=earlier_cursor,
+                         later_cursor=later_cursor)
 
-  return render_template('pages/shows.html', shows=data)
-
-@app.route('/shows/create')
+@views.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@views.route('/shows/create', methods=['POST'])
 def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
     # DONE: insert form data as a new Show record in the db, instead
@@ -513,7 +1071,7 @@ def create_show_submission():
     try:
         show = Shows(artist_id = request.form['artist_id'],
                      venue_id = request.form['venue_id'],
-                     start_time = request.form['start_time'])
+                     start_time = dateutil.parser.parse(request.form['start_time']))
         db.session.add(show)
         db.session.commit()
     except:
@@ -533,36 +1091,19 @@ def create_show_submission():
     # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
     return render_template('pages/home.html')
 
-@app.errorhandler(404)
+@views.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@views.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
-# Default port:
-if __name__ == '__main__':
-    app.run()
-
-# Or specify port manually:
-'''
+# Development server, see wsgi.py and gunicorn.conf.py for production:
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
-'''
+    create_app().run(port=int(os.environ.get('PORT', 5000)))
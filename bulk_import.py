@@ -0,0 +1,468 @@
+import csv
+import datetime as dt
+import io
+import itertools
+import json
+
+import dateutil.parser
+
+from models import (db, Venues, Artists, Shows, VenuesGenresJunction,
+                    ArtistsGenresJunction, BULK_LOADS, bump_versions)
+from reference_data import reference_data, genre_key, area_key
+
+#----------------------------------------------------------------------------#
+# Bulk import of venues, artists and shows.
+#----------------------------------------------------------------------------#
+
+# Files are streamed in batches. Every batch resolves its areas and genres
+# through reference_data in one statement each, checks the venue and
+# artist ids of shows with one query per table, and is written with COPY
+# on postgres or a batched executemany elsewhere, then committed. Rows
+# that fail validation are skipped and reported with their line number.
+# Venues and artists keep the ids of an id column, so that a shows file
+# can refer to them; rows without an id get a new one, rows whose id is
+# taken are rejected.
+# The search vectors of loaded venues and artists are computed while
+# they are inserted from a temporary table, from the genres and areas
+# the batch resolved, instead of by the row triggers. Most of the time
+# left on postgres goes to the per row foreign key checks of junction
+# and show rows, which the import keeps. COPY bypasses the ORM, so the
+# caller has to recompute the show counters and rebuild the in-process
+# search indexes afterwards, see import_command() in app.py.
+
+# CSV files list genres in a single column separated by GENRE_SEPARATOR,
+# NDJSON files may use a list instead
+GENRE_SEPARATOR = ';'
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', ''}
+
+VENUE_COLUMNS = ('id', 'name', 'address', 'area_id', 'phone', 'website',
+                 'facebook_link', 'seeking_talent', 'seeking_description',
+                 'image_link')
+ARTIST_COLUMNS = ('id', 'name', 'city', 'state', 'phone', 'website',
+                  'facebook_link', 'seeking_venue', 'seeking_description',
+                  'image_link')
+SHOW_COLUMNS = ('venue_id', 'artist_id', 'start_time')
+
+
+class ImportReport:
+    """Rows loaded and rejected by an import."""
+
+    def __init__(self, kind, path):
+        self.kind = kind
+        self.path = path
+        self.loaded = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    @property
+    def rows_per_second(self):
+        return self.loaded / self.seconds if self.seconds else 0.0
+
+
+def read_rows(path, fmt=None):
+    """
+    Yield (line number, row dict) of a CSV file with a header line or
+    of an NDJSON file; fmt defaults to the file extension.
+    """
+    fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl'))
+                  else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line, text in enumerate(f, 1):
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                except ValueError as exc:
+                    yield line, exc
+                    continue
+                yield line, row if isinstance(row, dict) else \
+                    ValueError('not a JSON object')
+
+
+def text(row, column, required=False):
+    value = row.get(column)
+    if value is None or value == '':
+        if required:
+            raise ValueError(f'{column} is required')
+        return None
+    return str(value).strip()
+
+
+def boolean(row, column):
+    value = row.get(column)
+    if isinstance(value, bool):
+        return value
+    value = '' if value is None else str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'{column}: {value!r} is not a boolean')
+
+
+def integer(row, column):
+    value = row.get(column)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{column}: {value!r} is not an integer')
+
+
+def timestamp(row, column):
+    value = text(row, column, required=True)
+    try:
+        return dt.datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        return dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        raise ValueError(f'{column}: {value!r} is not a date')
+
+
+def genre_list(row):
+    value = row.get('genres')
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(GENRE_SEPARATOR)
+    return [name for name in (str(name).strip() for name in value) if name]
+
+
+def optional_integer(row, column):
+    return None if text(row, column) is None else integer(row, column)
+
+
+def allocate_ids(connection, table, count, after=0):
+    """
+    Reserve count ids for table above after, from its sequence on
+    postgres and after the current maximum elsewhere. The sequence is
+    moved past after even if count is 0, so that later inserts do not
+    take ids kept from the source file.
+    """
+    if connection.dialect.name == 'postgresql':
+        sequence = "pg_get_serial_sequence(:table, 'id')"
+        if after:
+            connection.execute(
+                db.text(f'SELECT setval({sequence}, '
+                        f'greatest(nextval({sequence}), :after))'),
+                table=f'"{table.name}"', after=after)
+        if not count:
+            return []
+        rows = connection.execute(
+            db.text(f'SELECT nextval({sequence}) '
+                    f'FROM generate_series(1, :count)'),
+            table=f'"{table.name}"', count=count)
+        return [id_ for id_, in rows]
+    start = connection.execute(
+        db.select([db.func.coalesce(db.func.max(table.c.id), 0)])).scalar()
+    start = max(start, after)
+    return list(range(start + 1, start + count + 1))
+
+
+def assign_ids(connection, model, parsed, report):
+    """
+    Give the parsed (line, id, ...) rows of a batch their ids: the one
+    of the source file if set, else a new one. Rows whose id exists
+    already, or was taken by an earlier row, are rejected.
+
+    Returns:
+    rows (list): (id, ...) of the accepted rows
+    """
+    if not parsed:
+        return []
+    kind = model.__tablename__[:-1].lower()
+    taken = existing_ids(connection, model,
+                         {row[1] for row in parsed if row[1] is not None})
+    accepted = []
+    for row in parsed:
+        line, id_ = row[:2]
+        if id_ is not None:
+            if id_ in taken:
+                report.error(line, f'{kind} {id_} already exists')
+                continue
+            taken.add(id_)
+        accepted.append(row[1:])
+    kept = [row[0] for row in accepted if row[0] is not None]
+    new_ids = iter(allocate_ids(connection, model.__table__,
+                                len(accepted) - len(kept),
+                                after=max(kept, default=0)))
+    return [(next(new_ids) if row[0] is None else row[0],) + row[1:]
+            for row in accepted]
+
+
+def copy_expert(connection, table_name, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f'COPY "{table_name}" ({column_list}) '
+                           f'FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+
+def copy_rows(connection, table, columns, rows):
+    """
+    Write rows (tuples in columns order) to table with COPY on postgres
+    and a single executemany elsewhere.
+    """
+    if not rows:
+        return
+    if connection.dialect.name == 'postgresql':
+        copy_expert(connection, table.name, columns, rows)
+    else:
+        connection.execute(table.insert(),
+                           [dict(zip(columns, row)) for row in rows])
+
+
+def copy_searchable_rows(connection, model, columns, rows, documents):
+    """
+    Write venue or artist rows like copy_rows() together with their
+    search vectors. On postgres the rows are copied to a temporary table
+    and inserted from there with search_document() of their name and
+    the genres and area text in documents, so every row is written once
+    instead of being updated again by the search vector triggers of its
+    junction rows.
+
+    Parameters:
+    connection (Connection): connection of the batch's transaction
+    model (Model): Venues or Artists
+    columns (tuple): names of the columns of rows, starting with 'name'
+                     or containing it
+    rows (list): tuples in columns order
+    documents (list): (genres, area) text of every row
+    """
+    if not rows:
+        return
+    table = model.__table__
+    if connection.dialect.name != 'postgresql':
+        copy_rows(connection, table, columns, rows)
+        return
+    staging = f'bulk_{table.name.lower()}'
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    connection.execute(
+        f'CREATE TEMPORARY TABLE "{staging}" ON COMMIT DROP AS '
+        f'SELECT {column_list}, NULL::text AS genres_document, '
+        f'NULL::text AS area_document FROM "{table.name}" WITH NO DATA')
+    copy_expert(connection, staging,
+                columns + ('genres_document', 'area_document'),
+                [row + document for row, document in zip(rows, documents)])
+    connection.execute(
+        f'INSERT INTO "{table.name}" ({column_list}, search_vector) '
+        f'SELECT {column_list}, '
+        f'search_document(name, genres_document, area_document) '
+        f'FROM "{staging}"')
+    connection.execute(f'DROP TABLE "{staging}"')
+
+
+def existing_ids(connection, model, ids):
+    if not ids:
+        return set()
+    # one array or expanding parameter instead of a bind object per id
+    if connection.dialect.name == 'postgresql':
+        condition = model.id == db.func.any(db.bindparam('ids'))
+    else:
+        condition = model.id.in_(db.bindparam('ids', expanding=True))
+    qry = db.select([model.id]).where(condition)
+    return {id_ for id_, in connection.execute(qry, ids=list(ids))}
+
+
+def resolve_genres(names):
+    """
+    map every distinct genre name spelling of a batch to its
+    (id, stored name)
+    """
+    entries = reference_data.genres(names)
+    return {name: entries[genre_key(name)] for name in names}
+
+
+def resolve_areas(pairs):
+    """
+    map every distinct (city, state) spelling of a batch to its
+    (id, stored city, stored state)
+    """
+    entries = reference_data.areas(pairs)
+    return {pair: entries[area_key(*pair)] for pair in pairs}
+
+
+def genre_document(genres, names):
+    """
+    the genres part of a search vector, in the order string_agg() reads
+    the junction rows copied sorted by genre id
+    """
+    return ' '.join(name for _, name in sorted({genres[name]
+                                               for name in names}))
+
+
+def load_venues(connection, batch, report):
+    parsed = []
+    for line, row in batch:
+        try:
+            name = text(row, 'name', required=True)
+            city = text(row, 'city', required=True)
+            state = text(row, 'state', required=True)
+            id_ = optional_integer(row, 'id')
+            values = (name, text(row, 'address'), (city, state),
+                      text(row, 'phone'), text(row, 'website'),
+                      text(row, 'facebook_link'),
+                      boolean(row, 'seeking_talent'),
+                      text(row, 'seeking_description'),
+                      text(row, 'image_link'))
+            parsed.append((line, id_, values, genre_list(row)))
+        except ValueError as exc:
+            report.error(line, str(exc))
+    parsed = assign_ids(connection, Venues, parsed, report)
+    if not parsed:
+        return
+
+    areas = resolve_areas({values[2] for _, values, _ in parsed})
+    genres = resolve_genres({name for _, _, names in parsed
+                             for name in names})
+    venue_rows = []
+    documents = []
+    genre_rows = set()
+    for id_, values, names in parsed:
+        area_id, city, state = areas[values[2]]
+        venue_rows.append((id_,) + values[:2] + (area_id,) + values[3:])
+        documents.append((genre_document(genres, names), f'{city} {state}'))
+        genre_rows.update((id_, genres[name][0]) for name in names)
+    copy_searchable_rows(connection, Venues, VENUE_COLUMNS, venue_rows,
+                         documents)
+    copy_rows(connection, VenuesGenresJunction, ('venue_id', 'genre_id'),
+              sorted(genre_rows))
+    report.loaded += len(venue_rows)
+
+
+def load_artists(connection, batch, report):
+    parsed = []
+    for line, row in batch:
+        try:
+            id_ = optional_integer(row, 'id')
+            values = (text(row, 'name', required=True), text(row, 'city'),
+                      text(row, 'state'), text(row, 'phone'),
+                      text(row, 'website'), text(row, 'facebook_link'),
+                      boolean(row, 'seeking_venue'),
+                      text(row, 'seeking_description'),
+                      text(row, 'image_link'))
+            parsed.append((line, id_, values, genre_list(row)))
+        except ValueError as exc:
+            report.error(line, str(exc))
+    parsed = assign_ids(connection, Artists, parsed, report)
+    if not parsed:
+        return
+
+    genres = resolve_genres({name for _, _, names in parsed
+                             for name in names})
+    artist_rows = []
+    documents = []
+    genre_rows = set()
+    for id_, values, names in parsed:
+        artist_rows.append((id_,) + values)
+        documents.append((genre_document(genres, names),
+                          ' '.join(filter(None, values[1:3]))))
+        genre_rows.update((id_, genres[name][0]) for name in names)
+    copy_searchable_rows(connection, Artists, ARTIST_COLUMNS, artist_rows,
+                         documents)
+    copy_rows(connection, ArtistsGenresJunction, ('artist_id', 'genre_id'),
+              sorted(genre_rows))
+    report.loaded += len(artist_rows)
+
+
+def load_shows(connection, batch, report):
+    parsed = []
+    for line, row in batch:
+        try:
+            parsed.append((line, (integer(row, 'venue_id'),
+                                  integer(row, 'artist_id'),
+                                  timestamp(row, 'start_time'))))
+        except ValueError as exc:
+            report.error(line, str(exc))
+
+    venue_ids = existing_ids(connection, Venues,
+                             {values[0] for _, values in parsed})
+    artist_ids = existing_ids(connection, Artists,
+                              {values[1] for _, values in parsed})
+    show_rows = []
+    for line, values in parsed:
+        if values[0] not in venue_ids:
+            report.error(line, f'venue {values[0]} does not exist')
+        elif values[1] not in artist_ids:
+            report.error(line, f'artist {values[1]} does not exist')
+        else:
+            show_rows.append(values)
+    copy_rows(connection, Shows.__table__, SHOW_COLUMNS, show_rows)
+    report.loaded += len(show_rows)
+
+
+# loader, table and whether loaded rows change existing venue and artist
+# pages; new venues and artists only get pages of their own
+LOADERS = {
+    'venues': (load_venues, 'Venues', False),
+    'artists': (load_artists, 'Artists', False),
+    'shows': (load_shows, 'Shows', True),
+}
+
+
+def import_file(kind, path, fmt=None, batch_size=10000):
+    """
+    Load a CSV or NDJSON file of venues, artists or shows, committing
+    every batch_size rows.
+
+    Venue rows need name, city and state, artist rows a name; both take
+    the other columns of their table and a genres column. Their id is
+    kept if given, rows with an id that exists already are rejected.
+    Show rows need venue_id, artist_id and start_time.
+
+    Parameters:
+    kind (String): 'venues', 'artists' or 'shows'
+    path (String): file to load
+    fmt (String): 'csv' or 'ndjson', by default from the file extension
+    batch_size (int): rows per batch and transaction
+
+    Returns:
+    report (ImportReport): number of loaded rows and per-row errors
+    """
+    load, table_name, changes_pages = LOADERS[kind]
+    report = ImportReport(kind, path)
+    start = dt.datetime.now()
+    rows = read_rows(path, fmt)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        valid = []
+        for line, row in batch:
+            if isinstance(row, Exception):
+                report.error(line, str(row))
+            else:
+                valid.append((line, row))
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql':
+            # skip the per row search vector triggers, the vectors are
+            # written by copy_searchable_rows()
+            connection.execute("SET LOCAL fyyur.bulk_load = 'on'")
+        loaded = report.loaded
+        load(connection, valid, report)
+        # genres and areas inserted by reference_data
+        changed = db.session.info.pop('changed_tables', set())
+        if report.loaded > loaded:
+            changed.add(table_name)
+            if changes_pages:
+                changed.add(BULK_LOADS)
+        bump_versions(connection, changed)
+        db.session.commit()
+    report.seconds = (dt.datetime.now() - start).total_seconds()
+    return report
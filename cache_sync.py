@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+from reference_data import reference_data
+from search_index import sync_search_indexes
+
+#----------------------------------------------------------------------------#
+# Background sync of the in-process caches.
+#----------------------------------------------------------------------------#
+
+# Every worker process keeps in-memory copies of tables: the name indexes
+# of search_index.py and the genre and area registry of reference_data.py.
+# Writes of the process update its own copies; a daemon thread per process
+# compares the change counters every CACHE_SYNC_INTERVAL seconds and
+# rebuilds the copies another process, e.g. a sibling worker or a bulk
+# import, changed. Requests never wait for the check or the rebuild. The
+# thread is started by the first request of a process, so servers forking
+# workers get one per worker.
+
+_lock = threading.Lock()
+# pid of the process the thread runs in
+_started_in = None
+
+
+def sync_caches():
+    """
+    Rebuild the in-process caches whose tables changed.
+    """
+    sync_search_indexes()
+    reference_data.sync()
+
+
+def _run(app, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            with app.app_context():
+                sync_caches()
+        except Exception:
+            # e.g. the database restarting, the next round retries
+            app.logger.exception('cache sync failed')
+
+
+def start(app):
+    """
+    Start the sync thread of this process unless it runs already.
+    """
+    global _started_in
+    interval = app.config.get('CACHE_SYNC_INTERVAL', 5)
+    if not interval or _started_in == os.getpid():
+        return
+    with _lock:
+        if _started_in == os.getpid():
+            return
+        threading.Thread(target=_run, args=(app, interval),
+                         name='cache-sync', daemon=True).start()
+        _started_in = os.getpid()
+
+
+def init_app(app):
+    """
+    Keep the caches of every process serving app in sync.
+
+    Config:
+    CACHE_SYNC_INTERVAL (float): seconds between two checks of the change
+                                 counters, 0 disables the thread
+    """
+
+    @app.before_request
+    def start_sync_thread():
+        start(app)
@@ -0,0 +1,88 @@
+import datetime as dt
+import statistics
+import sys
+import time
+sys.path.append('..')
+
+from app import app, Venues, Artists, Shows, db
+from instrumentation import count_queries
+from page_cache import page_cache
+from reference_data import reference_data
+
+
+def seed_artist_history(num_shows, num_venues=50):
+    """
+    Create a single artist with num_shows shows spread over num_venues
+    venues, half of them in the past and half upcoming.
+
+    Parameters:
+    num_shows (int): number of shows of the artist
+    num_venues (int): number of venues the shows are spread over
+
+    Returns:
+    artist_id (int): id of the created artist
+    """
+    # shared by all sizes, the area is unique per city and state
+    area = reference_data.area('Bench City', 'BC')
+    artist = Artists(name=f'Touring band {num_shows}',
+                     image_link='image_link: touring band')
+    db.session.add(artist)
+    db.session.flush()
+
+    db.session.bulk_insert_mappings(Venues, [
+        {'name': f'Bench venue {i}', 'area_id': area.id,
+         'image_link': f'image_link: bench venue {i}'}
+        for i in range(num_venues)])
+    venue_ids = [venue_id for venue_id, in db.session.query(Venues.id).
+                 filter(Venues.area_id == area.id)]
+
+    now = dt.datetime.utcnow()
+    db.session.bulk_insert_mappings(Shows, [
+        {'artist_id': artist.id,
+         'venue_id': venue_ids[i % num_venues],
+         'start_time': now + dt.timedelta(hours=i - num_shows // 2)}
+        for i in range(num_shows)])
+    db.session.commit()
+    return artist.id
+
+
+def bench_show_artist(sizes=(10, 100, 1000, 10000), repeat=20):
+    """
+    Time GET /artists/<id> and count its queries for artists
+    with a growing number of shows.
+
+    Parameters:
+    sizes (tuple): numbers of shows to benchmark
+    repeat (int): number of requests per size
+
+    Returns:
+    results (list): a list of (num_shows, queries, median_ms) tuples
+    """
+    client = app.test_client()
+    results = []
+    for num_shows in sizes:
+        artist_id = seed_artist_history(num_shows)
+        timings = []
+        for _ in range(repeat):
+            with count_queries() as stats:
+                start = time.perf_counter()
+                response = client.get(f'/artists/{artist_id}')
+                timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 200
+        results.append((num_shows, stats.count,
+                        statistics.median(timings)))
+
+    return results
+
+
+if __name__ == '__main__':
+    # runs against a throwaway in-memory database, not the configured one,
+    # and renders every request instead of serving cached pages
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['PAGE_CACHE_BACKEND'] = 'null'
+    page_cache.init_app(app)
+    with app.app_context():
+        db.create_all()
+        print(f'{"shows":>8} {"queries":>8} {"median ms":>10}')
+        for num_shows, queries, median_ms in bench_show_artist():
+            print(f'{num_shows:>8} {queries:>8} {median_ms:>10.2f}')
@@ -0,0 +1,601 @@
+import argparse
+import datetime as dt
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.append('..')
+
+from werkzeug.serving import make_server
+
+from app import app, encode_cursor, name_cursor, Venues, Artists, Shows, db
+from models import Genres
+from instrumentation import count_queries
+from page_cache import page_cache
+from reference_data import reference_data
+from search_index import rebuild_search_indexes
+import snapshots
+import generate_data
+
+# Latency, throughput, queries and memory of every GET and POST route.
+#
+# Every dataset size is generated once with generate_data.py and saved as
+# snapshot 'bench-<size>'; later runs restore the snapshot, so every run
+# starts from the same rows. Each route is then driven with varying ids,
+# search terms and cursors, first sequentially through the Flask test
+# client (which also counts the queries per request) and then over HTTP
+# by CONCURRENCY client threads, against a threaded server in this
+# process or the server given with --url. Peak RSS is that of this
+# process, reset before every route where the kernel allows it; it
+# includes the client threads and is not recorded for --url.
+#
+# The benchmark replaces the contents of the database it runs on. It
+# refuses to start unless that is the bench profile's (FYYUR_CONFIG=bench,
+# sqlite bench.db, with no DATABASE_URL overriding it), one given with
+# --database, or --yes confirms wiping the configured one.
+#
+# Results are written as JSON. With --baseline the run is compared to an
+# earlier result file and exits with status 1 when a route got slower,
+# lost throughput, grew in memory beyond the tolerance or issued more
+# queries.
+
+# number of shows of every dataset, with one venue and one artist per ten
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+
+SNAPSHOT_PREFIX = 'bench-'
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                           'benchmark-results')
+
+# routes are benchmarked in this order, the ones writing to the database
+# last so they do not disturb the caches of the others
+ROUTES = []
+
+
+def route(name, method='GET'):
+    """register a function (context, i) -> (path, form data) as route name"""
+    def register(make_request):
+        ROUTES.append((name, method, make_request))
+        return make_request
+    return register
+
+
+class Context:
+    """Ids, names and cursors the requests of a dataset pick from."""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.venue_ids = [id_ for id_, in
+                          db.session.query(Venues.id).order_by(Venues.id)]
+        self.artist_ids = [id_ for id_, in
+                           db.session.query(Artists.id).order_by(Artists.id)]
+        self.genres = [name for name, in
+                       db.session.query(Genres.name).order_by(Genres.name)]
+        self.venues = self.sample(Venues)
+        self.artists = self.sample(Artists)
+        self.shows = db.session.query(Shows.start_time, Shows.id).\
+            filter(Shows.id.in_(self.rng.sample(
+                range(1, self.max_id(Shows) + 1),
+                min(100, self.max_id(Shows))))).all()
+        db.session.rollback()
+
+    def max_id(self, model):
+        return db.session.query(
+            db.func.coalesce(db.func.max(model.id), 0)).scalar()
+
+    def sample(self, model):
+        """
+        up to 100 rows of model as dicts, chosen with the context's rng;
+        the views close the session, so no model objects are kept
+        """
+        ids = self.venue_ids if model is Venues else self.artist_ids
+        chosen = self.rng.sample(ids, min(100, len(ids)))
+        rows = []
+        for row in db.session.query(model).filter(model.id.in_(chosen)).\
+                order_by(model.id):
+            area = row.area if model is Venues else row
+            rows.append({'id': row.id, 'name': row.name,
+                         'address': getattr(row, 'address', None) or '',
+                         'city': area.city or '', 'state': area.state or '',
+                         'phone': row.phone or '',
+                         'facebook_link': row.facebook_link or '',
+                         'genre': row.genres[0].name if row.genres
+                         else self.genres[0]})
+        return rows
+
+    def term(self, rows, length=None):
+        """a word of a name, or a prefix of it of the given length"""
+        words = self.rng.choice(rows)['name'].split()
+        word = self.rng.choice(words) if words else ''
+        return word[:length] if length else word
+
+
+@route('GET /')
+def index_request(ctx, i):
+    return '/', None
+
+
+@route('GET /search/suggest')
+def suggest_request(ctx, i):
+    rows = ctx.venues if i % 2 else ctx.artists
+    return f'/search/suggest?q={urllib.parse.quote(ctx.term(rows, 3))}', None
+
+
+@route('GET /venues')
+def venues_request(ctx, i):
+    if i % 2:
+        return '/venues', None
+    venue = ctx.rng.choice(ctx.venues)
+    cursor = urllib.parse.quote(name_cursor(venue['name'], venue['id']))
+    return f'/venues?after={cursor}', None
+
+
+@route('GET /venues/<id>')
+def venue_request(ctx, i):
+    return f'/venues/{ctx.rng.choice(ctx.venue_ids)}', None
+
+
+@route('GET /venues/<id>/edit')
+def edit_venue_request(ctx, i):
+    return f'/venues/{ctx.rng.choice(ctx.venue_ids)}/edit', None
+
+
+@route('GET /venues/create')
+def create_venue_form_request(ctx, i):
+    return '/venues/create', None
+
+
+@route('GET /artists')
+def artists_request(ctx, i):
+    if i % 2:
+        return '/artists', None
+    artist = ctx.rng.choice(ctx.artists)
+    cursor = urllib.parse.quote(name_cursor(artist['name'], artist['id']))
+    return f'/artists?after={cursor}', None
+
+
+@route('GET /artists/<id>')
+def artist_request(ctx, i):
+    return f'/artists/{ctx.rng.choice(ctx.artist_ids)}', None
+
+
+@route('GET /artists/<id>/edit')
+def edit_artist_request(ctx, i):
+    return f'/artists/{ctx.rng.choice(ctx.artist_ids)}/edit', None
+
+
+@route('GET /artists/create')
+def create_artist_form_request(ctx, i):
+    return '/artists/create', None
+
+
+@route('GET /shows')
+def shows_request(ctx, i):
+    if i % 2 or not ctx.shows:
+        return '/shows', None
+    start_time, show_id = ctx.rng.choice(ctx.shows)
+    cursor = urllib.parse.quote(encode_cursor(start_time, show_id))
+    return f'/shows?{ctx.rng.choice(["before", "after"])}={cursor}', None
+
+
+@route('GET /shows/create')
+def create_show_form_request(ctx, i):
+    return '/shows/create', None
+
+
+@route('POST /venues/search', 'POST')
+def search_venues_request(ctx, i):
+    return '/venues/search', {'search_term': ctx.term(ctx.venues)}
+
+
+@route('POST /artists/search', 'POST')
+def search_artists_request(ctx, i):
+    return '/artists/search', {'search_term': ctx.term(ctx.artists)}
+
+
+@route('POST /venues/<id>/edit', 'POST')
+def edit_venue_submission_request(ctx, i):
+    # writes the venue's own values back
+    venue = ctx.rng.choice(ctx.venues)
+    return f'/venues/{venue["id"]}/edit', {
+        'name': venue['name'], 'address': venue['address'],
+        'city': venue['city'], 'state': venue['state'],
+        'phone': venue['phone'], 'facebook_link': venue['facebook_link'],
+        'genres': venue['genre']}
+
+
+@route('POST /artists/<id>/edit', 'POST')
+def edit_artist_submission_request(ctx, i):
+    artist = ctx.rng.choice(ctx.artists)
+    return f'/artists/{artist["id"]}/edit', {
+        'name': artist['name'], 'city': artist['city'],
+        'state': artist['state'], 'phone': artist['phone'],
+        'genres': artist['genre']}
+
+
+@route('POST /venues/create', 'POST')
+def create_venue_request(ctx, i):
+    venue = ctx.rng.choice(ctx.venues)
+    return '/venues/create', {
+        'name': f'Benchmark Venue {i}', 'address': f'{i} Main Street',
+        'city': venue['city'], 'state': venue['state'],
+        'phone': '555-555-5555', 'facebook_link': '',
+        'genres': ctx.rng.choice(ctx.genres)}
+
+
+@route('POST /artists/create', 'POST')
+def create_artist_request(ctx, i):
+    artist = ctx.rng.choice(ctx.artists)
+    return '/artists/create', {
+        'name': f'Benchmark Artist {i}', 'city': artist['city'],
+        'state': artist['state'], 'phone': '555-555-5555',
+        'facebook_link': '', 'genres': ctx.rng.choice(ctx.genres)}
+
+
+@route('POST /shows/create', 'POST')
+def create_show_request(ctx, i):
+    start_time = dt.datetime.now() + dt.timedelta(
+        days=ctx.rng.randint(1, 365), hours=ctx.rng.randint(0, 23))
+    return '/shows/create', {
+        'venue_id': str(ctx.rng.choice(ctx.venue_ids)),
+        'artist_id': str(ctx.rng.choice(ctx.artist_ids)),
+        'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def reset_peak_rss():
+    """restart the peak RSS measurement of this process, linux only"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """peak resident set size of this process in KiB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # kilobytes on linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def percentile(sorted_values, q):
+    """nearest rank percentile q (0-100) of sorted_values"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(q / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summary(size, name, mode, latencies, seconds, errors, queries=None,
+            rss=None):
+    latencies = sorted(latencies)
+    milliseconds = lambda value: round(value * 1000, 3)
+    return {'size': size, 'route': name, 'mode': mode,
+            'requests': len(latencies), 'errors': errors,
+            'p50_ms': milliseconds(percentile(latencies, 50)),
+            'p95_ms': milliseconds(percentile(latencies, 95)),
+            'p99_ms': milliseconds(percentile(latencies, 99)),
+            'throughput_rps': round(len(latencies) / seconds, 1)
+            if seconds else None,
+            'queries_per_request': round(queries / len(latencies), 2)
+            if queries is not None else None,
+            'peak_rss_kb': rss}
+
+
+def bench_client(client, size, name, method, make_request, ctx, requests,
+                 warmup):
+    """run route name sequentially through the test client"""
+    for i in range(warmup):
+        path, data = make_request(ctx, i)
+        client.open(path, method=method, data=data)
+    reset_peak_rss()
+    latencies = []
+    errors = queries = 0
+    start = time.perf_counter()
+    for i in range(warmup, warmup + requests):
+        path, data = make_request(ctx, i)
+        with count_queries() as stats:
+            sent = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            latencies.append(time.perf_counter() - sent)
+        queries += stats.count
+        errors += response.status_code >= 400
+    seconds = time.perf_counter() - start
+    return summary(size, name, 'client', latencies, seconds, errors, queries,
+                   peak_rss())
+
+
+def send(url, method, path, data):
+    """one HTTP request on a new connection; return the status"""
+    connection = http.client.HTTPConnection(url.hostname, url.port,
+                                            timeout=60)
+    try:
+        headers = {}
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection.request(method, url.path.rstrip('/') + path, body,
+                           headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    finally:
+        connection.close()
+
+
+def bench_http(url, size, name, method, make_request, ctx, requests, warmup,
+               concurrency, measure_rss):
+    """run route name over HTTP from concurrency threads"""
+    # the requests are built up front, ctx is not thread safe
+    jobs = [make_request(ctx, i) for i in range(warmup + requests)]
+    latencies = []
+    statuses = []
+
+    def timed(job):
+        sent = time.perf_counter()
+        status = send(url, method, *job)
+        return time.perf_counter() - sent, status
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(timed, jobs[:warmup]))
+        reset_peak_rss()
+        start = time.perf_counter()
+        for latency, status in executor.map(timed, jobs[warmup:]):
+            latencies.append(latency)
+            statuses.append(status)
+        seconds = time.perf_counter() - start
+    errors = sum(status >= 400 for status in statuses)
+    return summary(size, name, 'http', latencies, seconds, errors,
+                   rss=peak_rss() if measure_rss else None)
+
+
+def prepare_dataset(size, seed, workers):
+    """restore snapshot bench-<size>, generating it first if needed"""
+    name = SNAPSHOT_PREFIX + size
+    method = snapshots.default_method()
+    snapshot_dir = app.config.get('SNAPSHOT_DIR')
+    if (name, method) in snapshots.list_snapshots(snapshot_dir):
+        print(f'restoring snapshot {name}')
+        snapshots.restore_snapshot(name, method, snapshot_dir)
+    else:
+        print(f'generating dataset {size}')
+        snapshots.reset_tables()
+        reference_data.warm()
+        num_shows = SIZES[size]
+        plan = generate_data.make_plan(seed, max(num_shows // 10, 10),
+                                       max(num_shows // 10, 10), num_shows)
+        generate_data.run(plan, workers)
+        snapshots.create_snapshot(name, method, snapshot_dir)
+    page_cache.clear()
+    rebuild_search_indexes()
+    reference_data.warm()
+
+
+def start_server():
+    """serve app from a thread of this process, return (server, url)"""
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def run(sizes, modes, requests=200, warmup=10, concurrency=8, url=None,
+        seed=1, workers=1):
+    """
+    Benchmark every route on every dataset size.
+
+    Parameters:
+    sizes (list): keys of SIZES
+    modes (list): 'client' and/or 'http'
+    requests (int): measured requests per route and mode
+    warmup (int): unmeasured requests sent before them
+    concurrency (int): client threads of the http mode
+    url (String): server of the http mode, one in this process by default
+    seed (int): seed of the generated data and of the requests
+    workers (int): processes generating a missing dataset
+
+    Returns:
+    results (list): one dict per size, route and mode
+    """
+    results = []
+    server = None
+    if 'http' in modes and url is None:
+        server, url = start_server()
+    try:
+        for size in sizes:
+            prepare_dataset(size, seed, workers)
+            ctx = Context(seed)
+            client = app.test_client()
+            for name, method, make_request in ROUTES:
+                for mode in modes:
+                    if mode == 'client':
+                        result = bench_client(client, size, name, method,
+                                              make_request, ctx, requests,
+                                              warmup)
+                    else:
+                        result = bench_http(urllib.parse.urlsplit(url), size,
+                                            name, method, make_request, ctx,
+                                            requests, warmup, concurrency,
+                                            server is not None)
+                    print(format_result(result))
+                    results.append(result)
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+def format_result(result):
+    queries = result['queries_per_request']
+    return (f'{result["size"]:>5} {result["route"]:<28} {result["mode"]:<6} '
+            f'p50 {result["p50_ms"]:8.2f}ms p95 {result["p95_ms"]:8.2f}ms '
+            f'p99 {result["p99_ms"]:8.2f}ms {result["throughput_rps"]:8.1f}/s'
+            + (f' {queries:5.1f}q' if queries is not None else '')
+            + (f' {result["errors"]} errors' if result['errors'] else ''))
+
+
+def compare(results, baseline, tolerance=0.2, min_delta_ms=2.0):
+    """
+    Return the regressions of results against the baseline results.
+
+    Latencies count as regressed when they grew by more than tolerance
+    (a fraction) and by at least min_delta_ms, throughput when it fell by
+    more than tolerance, peak RSS when it grew by more than tolerance,
+    and queries per request whenever they grew.
+    """
+    previous = {(entry['size'], entry['route'], entry['mode']): entry
+                for entry in baseline}
+    regressions = []
+    for result in results:
+        key = (result['size'], result['route'], result['mode'])
+        before = previous.get(key)
+        if before is None:
+            continue
+        label = ' '.join(key)
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if result[metric] > before[metric] * (1 + tolerance) and \
+                    result[metric] - before[metric] >= min_delta_ms:
+                regressions.append(f'{label}: {metric} {before[metric]} -> '
+                                   f'{result[metric]}')
+        if before['throughput_rps'] and result['throughput_rps'] < \
+                before['throughput_rps'] / (1 + tolerance):
+            regressions.append(f'{label}: throughput_rps '
+                               f'{before["throughput_rps"]} -> '
+                               f'{result["throughput_rps"]}')
+        if before['peak_rss_kb'] and result['peak_rss_kb'] and \
+                result['peak_rss_kb'] > before['peak_rss_kb'] * (1 + tolerance):
+            regressions.append(f'{label}: peak_rss_kb {before["peak_rss_kb"]}'
+                               f' -> {result["peak_rss_kb"]}')
+        if before['queries_per_request'] is not None and \
+                result['queries_per_request'] is not None and \
+                result['queries_per_request'] > before['queries_per_request']:
+            regressions.append(f'{label}: queries_per_request '
+                               f'{before["queries_per_request"]} -> '
+                               f'{result["queries_per_request"]}')
+        if result['errors'] > before['errors']:
+            regressions.append(f'{label}: errors {before["errors"]} -> '
+                               f'{result["errors"]}')
+    return regressions
+
+
+def wipe_refusal(database=None, yes=False, environ=os.environ):
+    """
+    Return why the benchmark must not replace the contents of the
+    configured database, or None when it may: with a database of its
+    own, confirmed with yes, or on the bench profile's database.
+    """
+    if database or yes:
+        return None
+    if environ.get('FYYUR_CONFIG') != 'bench':
+        return ('the benchmark replaces the contents of the configured '
+                'database; run it with FYYUR_CONFIG=bench, pass --database '
+                'URL or confirm with --yes')
+    if environ.get('DATABASE_URL'):
+        # config.profile() lets it override the bench profile's bench.db
+        return ('DATABASE_URL overrides the database of the bench profile '
+                'and would be replaced by the benchmark; unset it, pass '
+                '--database URL or confirm with --yes')
+    return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark every GET and POST route on generated '
+                    'datasets of the configured database.')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES),
+                        default=['1k'])
+    parser.add_argument('--modes', nargs='+', choices=['client', 'http'],
+                        default=['client', 'http'])
+    parser.add_argument('--requests', type=int, default=200,
+                        help='measured requests per route and mode')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='client threads of the http mode')
+    parser.add_argument('--url', default=None,
+                        help='server of the http mode, e.g. '
+                             'http://127.0.0.1:5000, by default one in '
+                             'this process')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes generating a missing dataset')
+    parser.add_argument('--output', default=None,
+                        help='result file, by default in benchmark-results/')
+    parser.add_argument('--baseline', default=None,
+                        help='result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown, 0.2 for 20%%')
+    parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                        help='latency changes below this are noise')
+    parser.add_argument('--database', default=None,
+                        help='database URL to run on instead of the '
+                             'configured one; its contents are replaced')
+    parser.add_argument('--yes', action='store_true',
+                        help='replace the contents of the configured '
+                             'database outside the bench profile')
+    args = parser.parse_args()
+
+    refusal = wipe_refusal(args.database, args.yes)
+    if refusal:
+        parser.error(refusal)
+    if args.database:
+        app.config['SQLALCHEMY_DATABASE_URI'] = args.database
+
+    started = dt.datetime.now()
+    with app.app_context():
+        database = db.engine.dialect.name
+        results = run(args.sizes, args.modes, args.requests, args.warmup,
+                      args.concurrency, args.url, args.seed, args.workers)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f'{started:%Y%m%d-%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'started': started.isoformat(timespec='seconds'),
+                   'commit': git_commit(), 'database': database,
+                   'python': platform.python_version(),
+                   'settings': {'requests': args.requests,
+                                'warmup': args.warmup,
+                                'concurrency': args.concurrency,
+                                'url': args.url, 'seed': args.seed},
+                   'results': results}, f, indent=2)
+    print(f'results written to {output}')
+
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            print(f'no baseline {args.baseline}, nothing compared')
+            sys.exit(0)
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance,
+                              args.min_delta_ms)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        print(f'{len(regressions)} regressions against {args.baseline}')
+        if regressions:
+            sys.exit(1)
@@ -2,8 +2,10 @@ import datetime as dt
 import random
 import sys
 sys.path.append('..')
-from app import (Areas, Venues, Artists, Genres, Shows, VenuesGenresJunction,
+from app import (Areas, Venues, Artists, Shows, VenuesGenresJunction,
                 ArtistsGenresJunction, db)
+from models import BULK_LOADS, Genres, bump_versions
+from snapshots import reset_tables
 
 from data_lists import areas_list, genres_list, adj_list, \
                         place_suffix_list, related_genres_list, noun_list
@@ -84,30 +86,21 @@ def create_genres(genres_list=genres_list):
 
 def clear_table(model):
     """
-    clear the table of the given model
+    clear the table of the given model with a single DELETE; rows of
+    other tables referencing it have to be cleared first
     """
-    for itm in db.session.query(model).all():
-        db.session.delete(itm)
+    table = getattr(model, '__table__', model)
+    db.session.execute(table.delete())
+    bump_versions(db.session, [BULK_LOADS, table.name])
     db.session.commit()
-
-    if hasattr(model, '__tablename__'):
-        print(f'{model.__tablename__} cleared')
-    elif hasattr(model, 'name'):
-        print(f'{model.name} cleared')
-    else:
-        print('something went wrong')
+    print(f'{table.name} cleared')
 
 def clear_all_tables():
     """
-    clear all given tables
+    clear all given tables, see snapshots.reset_tables()
     """
-    clear_table(Genres)
-    clear_table(Shows)
-    clear_table(VenuesGenresJunction)
-    clear_table(ArtistsGenresJunction)
-    clear_table(Artists)
-    clear_table(Venues)
-    clear_table(Areas)
+    reset_tables()
+    print('all tables cleared')
 
 def create_areas(areas_list=areas_list):
 
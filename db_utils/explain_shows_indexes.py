@@ -0,0 +1,94 @@
+import sys
+sys.path.append('..')
+from sqlalchemy import event
+
+from app import app, Venues, Artists, Shows, db, encode_cursor
+
+SHOWS_INDEXES = ('ix_Shows_venue_id_start_time',
+                 'ix_Shows_artist_id_start_time',
+                 'ix_Shows_start_time')
+
+
+def capture_statements(method, url, **kwargs):
+    """
+    Request url through the test client and return the
+    statements it issued against the Shows table.
+
+    Parameters:
+    method (String): 'get' or 'post'
+    url (String): url to request
+
+    Returns:
+    statements (list): list of (statement, parameters) tuples
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, many):
+        if '"Shows"' in statement:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        getattr(app.test_client(), method)(url, **kwargs)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+    return statements
+
+
+def explain(statement, parameters):
+    """
+    Return the query plan of a statement as a single string.
+    Sequential scans are disabled on postgres so that the plan shows
+    whether an index can serve the query even on a small dataset.
+    """
+    with db.engine.connect() as conn:
+        if db.engine.dialect.name == 'postgresql':
+            conn.execute('SET enable_seqscan = off')
+            rows = conn.execute('EXPLAIN ' + statement, parameters)
+        else:
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return '\n'.join(' '.join(str(col) for col in row) for row in rows)
+
+
+def check_shows_indexes():
+    """
+    Run EXPLAIN for every Shows query issued by the venue, artist and
+    show views and report whether one of the Shows indexes is used; the
+    /shows timeline pages have to use ix_Shows_start_time.
+
+    Returns:
+    ok (bool): True if every captured statement uses a Shows index
+    """
+    venue = Venues.query.first()
+    artist = Artists.query.first()
+    show = Shows.query.order_by(Shows.start_time, Shows.id).first()
+    # (method, url, request arguments, index the plan has to use)
+    requests = [('get', '/shows', {}, 'ix_Shows_start_time')]
+    if venue is not None:
+        requests.append(('get', f'/venues/{venue.id}', {}, None))
+    if artist is not None:
+        requests.append(('get', f'/artists/{artist.id}', {}, None))
+    if show is not None:
+        cursor = encode_cursor(show.start_time, show.id)
+        requests += [('get', f'/shows?{direction}={cursor}', {},
+                      'ix_Shows_start_time')
+                     for direction in ('after', 'before')]
+
+    ok = True
+    for method, url, kwargs, required in requests:
+        for statement, parameters in capture_statements(method, url, **kwargs):
+            plan = explain(statement, parameters)
+            used = [index for index in SHOWS_INDEXES if index in plan]
+            if required is not None and required not in used:
+                used = []
+            ok = ok and bool(used)
+            missing = f'{required} NOT USED' if required else 'NO INDEX'
+            print(f'{method.upper()} {url}: {", ".join(used) or missing}')
+            if not used:
+                print(plan)
+    return ok
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        sys.exit(0 if check_shows_indexes() else 1)
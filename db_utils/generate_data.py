@@ -0,0 +1,418 @@
+import argparse
+import datetime as dt
+import itertools
+import math
+import multiprocessing
+import random
+import sys
+import time
+sys.path.append('..')
+
+from app import app, Venues, Artists, Shows, db
+from bulk_import import copy_rows, copy_searchable_rows, VENUE_COLUMNS, \
+    ARTIST_COLUMNS, SHOW_COLUMNS
+from models import (VenuesGenresJunction, ArtistsGenresJunction, BULK_LOADS,
+                    bump_versions)
+from reference_data import reference_data, genre_key, area_key
+from show_counters import verify_show_counters
+
+from data_lists import areas_list, genres_list, adj_list, noun_list, \
+    place_suffix_list, related_genres_list
+
+# Synthetic venues, artists and shows in realistic volumes.
+#
+# Every batch draws from its own random.Random seeded with
+# (seed, kind, batch number), so the same seed gives the same rows no
+# matter how many worker processes share the batches. Venues, artists
+# and areas are ranked by popularity and drawn with Zipf weights
+# (weight of rank r = 1 / r ** zipf), and the rank to id mapping is a
+# fixed stride permutation so the popular rows are spread over the id
+# range. A batch draws every column at once with random.choices(k=...)
+# and only zips the columns into rows, which are written with COPY on
+# postgres (executemany elsewhere) through bulk_import.py, venues and
+# artists through its staging table together with their search vectors.
+# Meant for an otherwise idle development or benchmark database: ids are
+# assigned after the current maximum.
+
+# default range of the show start times; fixed rather than around today
+# so that a seed gives the same rows on every day, with past and upcoming
+# shows for years to come
+SHOWS_START = dt.datetime(2024, 1, 1)
+SHOWS_END = dt.datetime(2032, 1, 1)
+
+CITY_SUFFIXES = ['City', 'Springs', 'Falls', 'Heights', 'Valley', 'Harbor',
+                 'Park', 'Ridge']
+STATES = ['AL', 'AZ', 'CA', 'CO', 'FL', 'GA', 'IL', 'MA', 'MI', 'MN', 'NC',
+          'NJ', 'NY', 'OH', 'OR', 'PA', 'TN', 'TX', 'VA', 'WA']
+EXTRA_GENRES = ['Funk', 'Soul', 'Hip Hop', 'Folk', 'Country', 'Reggae',
+                'Punk', 'Electronic', 'Classical', 'R&B', 'Indie', 'Latin']
+
+# chance that a venue or artist also gets each genre related to its
+# primary one
+RELATED_GENRE_CHANCE = 0.5
+
+# set in every worker process by init_worker()
+_plan = None
+
+
+def zipf_cum_weights(n, exponent):
+    """
+    Return the cumulative Zipf weights of ranks 1..n,
+    for random.choices(cum_weights=...).
+    """
+    return list(itertools.accumulate(1 / rank ** exponent
+                                     for rank in range(1, n + 1)))
+
+
+def stride(n):
+    """return a step coprime with n, so rank * step % n permutes range(n)"""
+    step = int(n * 0.618) or 1
+    while math.gcd(step, n) != 1:
+        step += 1
+    return step
+
+
+class Plan:
+    """
+    What to generate, plus the lookup tables derived from it; rebuilt
+    identically in every worker process.
+    """
+
+    def __init__(self, seed, num_venues, num_artists, num_shows, area_ids,
+                 area_names, genre_ids, genre_names, related, first_venue_id,
+                 first_artist_id, start, end, zipf, batch_size):
+        self.seed = seed
+        self.num_venues = num_venues
+        self.num_artists = num_artists
+        self.num_shows = num_shows
+        self.area_ids = area_ids
+        # 'city state' and genre name by id, for the search vectors
+        self.area_names = area_names
+        self.genre_ids = genre_ids
+        self.genre_names = genre_names
+        self.related = related
+        self.first_venue_id = first_venue_id
+        self.first_artist_id = first_artist_id
+        self.start = start
+        self.end = end
+        self.zipf = zipf
+        self.batch_size = batch_size
+        self.prepare()
+
+    def prepare(self):
+        self.area_weights = zipf_cum_weights(len(self.area_ids), self.zipf)
+        self.genre_weights = zipf_cum_weights(len(self.genre_ids), self.zipf)
+        if self.num_shows:
+            self.venue_weights = zipf_cum_weights(self.num_venues, self.zipf)
+            self.artist_weights = zipf_cum_weights(self.num_artists, self.zipf)
+        self.venue_stride = stride(self.num_venues)
+        self.artist_stride = stride(self.num_artists)
+
+    def __getstate__(self):
+        # the weights are cheaper to recompute than to pickle
+        state = dict(self.__dict__)
+        for name in ('area_weights', 'genre_weights', 'venue_weights',
+                     'artist_weights'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.prepare()
+
+    def rng(self, kind, batch):
+        return random.Random(f'{self.seed}-{kind}-{batch}')
+
+    def batches(self, total):
+        return range(math.ceil(total / self.batch_size))
+
+    def batch_range(self, total, batch):
+        start = batch * self.batch_size
+        return range(start, min(start + self.batch_size, total))
+
+    def genre_mixes(self, rng, count):
+        """
+        Return the sorted genre ids of count rows: a primary genre drawn
+        by popularity plus some of the genres related to it.
+        """
+        primaries = rng.choices(range(len(self.genre_ids)),
+                                cum_weights=self.genre_weights, k=count)
+        mixes = [{self.genre_ids[primary]} for primary in primaries]
+        candidates = [(mix, other) for mix, primary in zip(mixes, primaries)
+                      for other in self.related.get(primary, ())]
+        picks = chances(rng, RELATED_GENRE_CHANCE, len(candidates))
+        for (mix, other), picked in zip(candidates, picks):
+            if picked:
+                mix.add(self.genre_ids[other])
+        return [sorted(mix) for mix in mixes]
+
+    def genres_document(self, mix):
+        """genres part of a search vector, in junction row order"""
+        return ' '.join(self.genre_names[genre_id] for genre_id in mix)
+
+
+def chances(rng, chance, count):
+    """count booleans, each True with probability chance"""
+    return rng.choices((True, False), cum_weights=(chance, 1), k=count)
+
+
+def phones(rng, indexes):
+    prefixes = rng.choices(range(200, 1000), k=len(indexes))
+    return [f'{prefix}-555-{i % 10000:04}'
+            for prefix, i in zip(prefixes, indexes)]
+
+
+def generate_venues(plan, batch):
+    """
+    Return the venue rows, their (genres, area) search documents and the
+    junction rows of a batch.
+    """
+    rng = plan.rng('venues', batch)
+    indexes = plan.batch_range(plan.num_venues, batch)
+    count = len(indexes)
+    names = [f'{adjective} {noun} {suffix} {i + 1}'
+             for adjective, noun, suffix, i in zip(
+                 rng.choices(adj_list, k=count),
+                 rng.choices(noun_list, k=count),
+                 rng.choices(place_suffix_list, k=count), indexes)]
+    ids = [plan.first_venue_id + i for i in indexes]
+    area_ids = rng.choices(plan.area_ids, cum_weights=plan.area_weights,
+                           k=count)
+    addresses = [f'{number} Main Street'
+                 for number in rng.choices(range(1, 10000), k=count)]
+    mixes = plan.genre_mixes(rng, count)
+    venues = [(id_, name, address, area_id, phone, None, None, seeking, None,
+               f'image_link: {name}')
+              for id_, name, address, area_id, phone, seeking in zip(
+                  ids, names, addresses, area_ids, phones(rng, indexes),
+                  chances(rng, 0.3, count))]
+    documents = [(plan.genres_document(mix), plan.area_names[area_id])
+                 for mix, area_id in zip(mixes, area_ids)]
+    genres = [(id_, genre_id) for id_, mix in zip(ids, mixes)
+              for genre_id in mix]
+    return venues, documents, genres
+
+
+def generate_artists(plan, batch):
+    """
+    Return the artist rows, their (genres, area) search documents and the
+    junction rows of a batch.
+    """
+    rng = plan.rng('artists', batch)
+    indexes = plan.batch_range(plan.num_artists, batch)
+    count = len(indexes)
+    names = [f'{adjective} {noun} {i + 1}'
+             for adjective, noun, i in zip(rng.choices(adj_list, k=count),
+                                           rng.choices(noun_list, k=count),
+                                           indexes)]
+    ids = [plan.first_artist_id + i for i in indexes]
+    cities = [f'{noun} {suffix}'
+              for noun, suffix in zip(rng.choices(noun_list, k=count),
+                                      rng.choices(CITY_SUFFIXES, k=count))]
+    states = rng.choices(STATES, k=count)
+    mixes = plan.genre_mixes(rng, count)
+    artists = [(id_, name, city, state, phone, None, None, seeking, None,
+                f'image_link: {name}')
+               for id_, name, city, state, phone, seeking in zip(
+                   ids, names, cities, states, phones(rng, indexes),
+                   chances(rng, 0.3, count))]
+    documents = [(plan.genres_document(mix), f'{city} {state}')
+                 for mix, city, state in zip(mixes, cities, states)]
+    genres = [(id_, genre_id) for id_, mix in zip(ids, mixes)
+              for genre_id in mix]
+    return artists, documents, genres
+
+
+def generate_shows(plan, batch):
+    rng = plan.rng('shows', batch)
+    count = len(plan.batch_range(plan.num_shows, batch))
+    venue_ranks = rng.choices(range(plan.num_venues),
+                              cum_weights=plan.venue_weights, k=count)
+    artist_ranks = rng.choices(range(plan.num_artists),
+                               cum_weights=plan.artist_weights, k=count)
+    days = rng.choices(range((plan.end - plan.start).days), k=count)
+    hours = rng.choices(range(18, 24), k=count)
+    minutes = rng.choices((0, 30), k=count)
+    return [(plan.first_venue_id +
+             venue_rank * plan.venue_stride % plan.num_venues,
+             plan.first_artist_id +
+             artist_rank * plan.artist_stride % plan.num_artists,
+             plan.start + dt.timedelta(days=day, hours=hour, minutes=minute))
+            for venue_rank, artist_rank, day, hour, minute in zip(
+                venue_ranks, artist_ranks, days, hours, minutes)]
+
+
+def load_batch(kind, batch):
+    """generate and load one batch in its own transaction"""
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.execute("SET LOCAL fyyur.bulk_load = 'on'")
+    if kind == 'venues':
+        rows, documents, genres = generate_venues(_plan, batch)
+        copy_searchable_rows(connection, Venues, VENUE_COLUMNS, rows,
+                             documents)
+        copy_rows(connection, VenuesGenresJunction, ('venue_id', 'genre_id'),
+                  genres)
+    elif kind == 'artists':
+        rows, documents, genres = generate_artists(_plan, batch)
+        copy_searchable_rows(connection, Artists, ARTIST_COLUMNS, rows,
+                             documents)
+        copy_rows(connection, ArtistsGenresJunction, ('artist_id', 'genre_id'),
+                  genres)
+    else:
+        rows = generate_shows(_plan, batch)
+        copy_rows(connection, Shows.__table__, SHOW_COLUMNS, rows)
+    db.session.commit()
+    return len(rows)
+
+
+def init_worker(plan):
+    global _plan
+    _plan = plan
+    app.app_context().push()
+    # connections inherited from the parent must not be shared
+    db.engine.dispose()
+
+
+def load_batches(pool, kind, total):
+    start = time.perf_counter()
+    jobs = [(kind, batch) for batch in _plan.batches(total)]
+    if pool is None:
+        loaded = sum(load_batch(*job) for job in jobs)
+    else:
+        loaded = sum(pool.starmap(load_batch, jobs))
+    seconds = time.perf_counter() - start
+    print(f'{loaded} {kind} in {seconds:.1f}s '
+          f'({loaded / seconds if seconds else 0:,.0f} rows/s)')
+
+
+def make_areas(num_areas):
+    areas = list(areas_list)
+    for city, state in itertools.product(
+            (f'{noun} {suffix}' for suffix in CITY_SUFFIXES
+             for noun in noun_list + adj_list), STATES):
+        if len(areas) >= num_areas:
+            break
+        areas.append((city, state))
+    return areas[:num_areas]
+
+
+def next_id(model):
+    return db.session.query(
+        db.func.coalesce(db.func.max(model.id), 0)).scalar() + 1
+
+
+def make_plan(seed=1, num_venues=1000, num_artists=1000, num_shows=10000,
+              num_areas=100, num_genres=None, start=None, end=None,
+              zipf=1.0, batch_size=10000):
+    """
+    Create the areas and genres and reserve the id ranges of a run.
+
+    Parameters:
+    seed (int): seed making the run reproducible
+    num_venues, num_artists, num_shows (int): rows to generate
+    num_areas (int): number of areas the venues are spread over
+    num_genres (int): number of genres, all known ones by default
+    start, end (datetime): range of the show start times, SHOWS_START
+                           to SHOWS_END by default
+    zipf (float): Zipf exponent of the popularity of venues, artists,
+                  areas and genres, 0 for uniform
+    batch_size (int): rows per batch and transaction
+
+    Returns:
+    plan (Plan): the plan to pass to run()
+    """
+    start = start or SHOWS_START
+    end = end or SHOWS_END
+    names = genres_list + EXTRA_GENRES
+    names = names[:num_genres or len(names)]
+
+    areas = make_areas(num_areas)
+    area_entries = reference_data.areas(areas)
+    area_entries = [area_entries[area_key(*area)] for area in areas]
+    genre_entries = reference_data.genres(names)
+    genre_entries = [genre_entries[genre_key(name)] for name in names]
+    genre_ids = [id_ for id_, _ in genre_entries]
+    index = {name: i for i, name in enumerate(names)}
+    related = {}
+    for group in related_genres_list:
+        members = [index[name] for name in group if name in index]
+        for member in members:
+            related[member] = [other for other in members if other != member]
+
+    plan = Plan(seed, num_venues, num_artists, num_shows,
+                [id_ for id_, _, _ in area_entries],
+                {id_: f'{city} {state}' for id_, city, state in area_entries},
+                genre_ids, dict(genre_entries), related,
+                next_id(Venues), next_id(Artists), start, end, zipf,
+                batch_size)
+    db.session.commit()
+    return plan
+
+
+def run(plan, workers=1):
+    """
+    Generate and load the planned rows, then bring the id sequences,
+    change counters and show counters up to date.
+
+    Parameters:
+    plan (Plan): plan from make_plan()
+    workers (int): number of processes loading batches in parallel
+    """
+    global _plan
+    _plan = plan
+    pool = None
+    if workers > 1:
+        db.session.remove()
+        db.engine.dispose()
+        pool = multiprocessing.Pool(workers, init_worker, (plan,))
+    try:
+        load_batches(pool, 'venues', plan.num_venues)
+        load_batches(pool, 'artists', plan.num_artists)
+        load_batches(pool, 'shows', plan.num_shows)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        for table in ('Venues', 'Artists'):
+            connection.execute(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                f"(SELECT max(id) FROM \"{table}\"))")
+    bump_versions(connection, [BULK_LOADS, 'Venues', 'Artists', 'Shows'])
+    db.session.commit()
+    start = time.perf_counter()
+    verify_show_counters(fix=True)
+    print(f'show counters updated in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load synthetic venues, artists and shows into the '
+                    'configured database.')
+    parser.add_argument('--venues', type=int, default=1000)
+    parser.add_argument('--artists', type=int, default=1000)
+    parser.add_argument('--shows', type=int, default=10000)
+    parser.add_argument('--areas', type=int, default=100)
+    parser.add_argument('--genres', type=int, default=None)
+    parser.add_argument('--start', type=dt.datetime.fromisoformat,
+                        help='earliest show start, ISO date, '
+                             f'{SHOWS_START:%Y-%m-%d} by default')
+    parser.add_argument('--end', type=dt.datetime.fromisoformat,
+                        help='latest show start, ISO date, '
+                             f'{SHOWS_END:%Y-%m-%d} by default')
+    parser.add_argument('--zipf', type=float, default=1.0,
+                        help='popularity skew, 0 for uniform')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    with app.app_context():
+        reference_data.warm()
+        plan = make_plan(args.seed, args.venues, args.artists, args.shows,
+                         args.areas, args.genres, args.start, args.end,
+                         args.zipf, args.batch_size)
+        run(plan, args.workers)
@@ -5,11 +5,21 @@ from fabric.contrib.console import confirm
 
 
 def test():
+    # a failing test aborts the task
+    local("python -m pytest -q tests/")
+
+
+def benchmark():
+    # endpoint benchmarks on the 1k shows dataset in the sqlite bench.db
+    # of the bench profile, failing on regressions against
+    # benchmark-results/baseline.json when there is one
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "export FYYUR_CONFIG=bench FLASK_APP=app && flask db upgrade && "
+            "cd db_utils && python benchmark.py --sizes 1k "
+            "--baseline ../benchmark-results/baseline.json", capture=True
         )
-    if result.failed and not confirm("Tests failed. Continue?"):
+    if result.failed and not confirm("Benchmarks regressed. Continue?"):
         abort("Aborted at user request.")
 
 
@@ -24,6 +34,7 @@ def push():
 
 def prepare():
     test()
+    benchmark()
     commit()
     push()
 
@@ -39,14 +50,15 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    # the benchmarks would wipe the production data, only check that the
+    # deployed app imports
+    local("heroku run python -c 'import app'")
 
 
 def deploy():
     pull()
     test()
+    benchmark()
     commit()
     heroku()
     heroku_test()
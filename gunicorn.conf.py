@@ -0,0 +1,63 @@
+import itertools
+import multiprocessing
+import os
+
+#----------------------------------------------------------------------------#
+# Production server settings.
+#----------------------------------------------------------------------------#
+
+# Pre-fork gunicorn serving wsgi.py:
+#   $ gunicorn -c gunicorn.conf.py wsgi:app
+# The app is loaded once in the master (preload_app) and builds its
+# search indexes and genre and area registry there, so the forked workers
+# share those pages copy-on-write; workers rebuild them when the change
+# counters show that the tables moved on, including workers forked later
+# to replace others. The master then closes its database connections,
+# and every worker disposes the engine once more after the fork so no
+# connection is shared between processes, and restarts the log listener
+# thread, which does not survive the fork. Workers are numbered from 1,
+# a replacement taking the number of the worker it replaces, and write
+# log files of their own under that number (access.1.log, ...).
+#
+# WEB_CONCURRENCY worker processes (two per core plus one by default)
+# run WEB_THREADS threads each. Threads mostly wait on postgres and on
+# the client; keep WEB_THREADS within the connection pool of an engine
+# (5 plus 10 overflow) or raise it with SQLALCHEMY_ENGINE_OPTIONS.
+
+bind = f'0.0.0.0:{os.environ.get("PORT", 5000)}'
+workers = int(os.environ.get('WEB_CONCURRENCY',
+                             multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = True
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+# restart workers now and then to cap the growth of their caches, 0 never
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    # runs in the master after the app was preloaded, before any fork
+    from app import warm_caches
+    from models import db
+    from wsgi import app
+    warm_caches(app)
+    with app.app_context():
+        db.engine.dispose()
+
+
+def pre_fork(server, worker):
+    # runs in the master, server.WORKERS only holds the live workers
+    taken = {getattr(other, 'number', None)
+             for other in server.WORKERS.values()}
+    worker.number = next(number for number in itertools.count(1)
+                         if number not in taken)
+
+
+def post_fork(server, worker):
+    import logging_setup
+    from models import db
+    from wsgi import app
+    with app.app_context():
+        db.engine.dispose()
+    logging_setup.start_listener(worker.number)
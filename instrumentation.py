@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+
+from models import db
+
+#----------------------------------------------------------------------------#
+# Per-request SQL instrumentation.
+#----------------------------------------------------------------------------#
+
+# Statements executed on the models.db engine are counted and timed for
+# every active collector of the current thread: one per request, plus any
+# opened by count_queries() / assert_max_queries(). A statement text seen
+# N_PLUS_ONE_THRESHOLD times within one request is logged as a probable
+# N+1 pattern together with the route that issued it.
+
+_local = threading.local()
+
+
+class QueryStats:
+    """Queries issued while the collector was active."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def repeated(self, threshold):
+        """
+        Return (statement, times) of statements issued at least
+        threshold times, most repeated first.
+        """
+        return [(statement, times) for statement, times
+                in self.statements.most_common() if times >= threshold]
+
+
+def _collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    duration = time.perf_counter() - conn.info['query_start_time'].pop()
+    for stats in _collectors():
+        stats.count += 1
+        stats.duration += duration
+        stats.statements[statement] += 1
+
+
+def instrument_engine(engine):
+    """attach the counting listeners to engine once"""
+    # asked of the engine itself, the id of a dropped engine can be reused
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+@contextmanager
+def count_queries():
+    """
+    Collect the queries issued inside the with block.
+
+        with count_queries() as stats:
+            client.get('/venues')
+        print(stats.count, stats.duration)
+    """
+    instrument_engine(db.engine)
+    stats = QueryStats()
+    _collectors().append(stats)
+    try:
+        yield stats
+    finally:
+        _collectors().remove(stats)
+
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """
+    Fail with AssertionError when the with block issues more than
+    max_queries queries, listing the statements it issued.
+
+        with assert_max_queries(2):
+            client.get(f'/venues/{venue_id}')
+    """
+    with count_queries() as stats:
+        yield stats
+    if stats.count > max_queries:
+        issued = '\n'.join(f'{times}x {statement}' for statement, times
+                           in stats.statements.most_common())
+        raise AssertionError(f'{stats.count} queries issued, expected at '
+                             f'most {max_queries}:\n{issued}')
+
+
+def init_app(app):
+    """
+    Collect query stats for every request into g.query_stats and log
+    probable N+1 patterns.
+
+    Config:
+    N_PLUS_ONE_THRESHOLD (int): repetitions of one statement within a
+                                request that get logged, 0 disables
+    """
+    threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 5)
+
+    @app.before_request
+    def start_query_stats():
+        instrument_engine(db.engine)
+        g.query_stats = QueryStats()
+        _collectors().append(g.query_stats)
+
+    @app.after_request
+    def report_n_plus_one(response):
+        stats = g.get('query_stats')
+        if stats is not None and threshold:
+            for statement, times in stats.repeated(threshold):
+                app.logger.warning(
+                    f'probable N+1 in {request.endpoint} '
+                    f'({request.method} {request.path}): {times}x '
+                    f'{" ".join(statement.split())[:300]}')
+        return response
+
+    @app.teardown_request
+    def stop_query_stats(exc):
+        stats = g.get('query_stats')
+        if stats is not None and stats in _collectors():
+            _collectors().remove(stats)
@@ -0,0 +1,195 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, request
+
+#----------------------------------------------------------------------------#
+# Non-blocking logging.
+#----------------------------------------------------------------------------#
+
+# Request threads only put log records on a bounded queue; a listener
+# thread writes them to size-rotated files. Records of the
+# 'fyyur.access' logger go to ACCESS_LOG, those of 'fyyur.slow_queries'
+# to SLOW_QUERY_LOG and everything logged by the app to ERROR_LOG. When
+# the queue is full records are dropped and counted instead of blocking
+# the request; /metrics reports them as fyyur_log_records_dropped_total.
+# The workers of a pre-fork server each write numbered files, e.g.
+# access.1.log, as only one process may rotate a file.
+
+access_logger = logging.getLogger('fyyur.access')
+
+_queue_handler = None
+_handlers = ()
+_listener = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of waiting on a full queue."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LoggerFilter(logging.Filter):
+    """Pass the records of the given loggers, or all others with exclude."""
+
+    def __init__(self, *names, exclude=False):
+        super().__init__()
+        self.names = names
+        self.exclude = exclude
+
+    def filter(self, record):
+        matches = any(record.name == name or record.name.startswith(name + '.')
+                      for name in self.names)
+        return matches != self.exclude
+
+
+def rotating_handler(path, fmt, max_bytes, backup_count):
+    handler = RotatingFileHandler(path, maxBytes=max_bytes,
+                                  backupCount=backup_count, delay=True)
+    handler.setFormatter(logging.Formatter(fmt))
+    handler.base_path = handler.baseFilename
+    return handler
+
+
+def numbered_path(path, number):
+    """return path with number before its extension, e.g. access.2.log"""
+    root, ext = os.path.splitext(path)
+    return f'{root}.{number}{ext}'
+
+
+def start_listener(worker_number=None):
+    """
+    Start the listener thread on a new queue. Threads do not survive a
+    fork, so a forked worker has to call this again, with its number so
+    that it writes and rotates files of its own.
+
+    Parameters:
+    worker_number (int): number put in the file names, None keeps them
+    """
+    global _listener
+    if _queue_handler is None:
+        return
+    for handler in _handlers:
+        # closed files are reopened under baseFilename by the next record
+        handler.close()
+        handler.baseFilename = handler.base_path if worker_number is None \
+            else numbered_path(handler.base_path, worker_number)
+    _queue_handler.queue = queue.Queue(_queue_handler.queue.maxsize)
+    _listener = QueueListener(_queue_handler.queue, *_handlers)
+    _listener.start()
+
+
+def stop_listener():
+    """write out the queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def init_app(app):
+    """
+    Route the app's log records through a queue to rotating files and
+    write a JSON access log line for every request.
+
+    Config:
+    ERROR_LOG (String): file of the app logger records, only written
+                        when not in debug mode
+    ACCESS_LOG (String): file of the access log, None disables it
+    SLOW_QUERY_LOG (String): file of the slow query log records
+    LOG_MAX_BYTES (int): size at which a log file is rotated
+    LOG_BACKUP_COUNT (int): number of rotated files kept per log
+    LOG_QUEUE_SIZE (int): records queued at most before dropping
+    """
+    global _queue_handler, _handlers
+    # an app created before in this process hands the loggers over
+    if _queue_handler is not None:
+        stop_listener()
+        # apps share the logger named after them with their predecessors
+        for logger in (access_logger, logging.getLogger('fyyur.slow_queries'),
+                       app.logger):
+            logger.removeHandler(_queue_handler)
+        _queue_handler = None
+    max_bytes = app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024)
+    backup_count = app.config.get('LOG_BACKUP_COUNT', 5)
+    access_log = app.config.get('ACCESS_LOG')
+    slow_query_log = app.config.get('SLOW_QUERY_LOG')
+    error_log = None if app.debug else app.config.get('ERROR_LOG')
+
+    handlers = []
+    if error_log:
+        handler = rotating_handler(
+            error_log,
+            '%(asctime)s %(levelname)s: %(message)s '
+            '[in %(pathname)s:%(lineno)d]',
+            max_bytes, backup_count)
+        handler.addFilter(LoggerFilter('fyyur.access', 'fyyur.slow_queries',
+                                       exclude=True))
+        handlers.append(handler)
+    if access_log:
+        handler = rotating_handler(access_log, '%(message)s', max_bytes,
+                                   backup_count)
+        handler.addFilter(LoggerFilter('fyyur.access'))
+        handlers.append(handler)
+    if slow_query_log:
+        handler = rotating_handler(slow_query_log, '%(message)s', max_bytes,
+                                   backup_count)
+        handler.addFilter(LoggerFilter('fyyur.slow_queries'))
+        handlers.append(handler)
+    if not handlers:
+        return
+
+    _handlers = tuple(handlers)
+    _queue_handler = DroppingQueueHandler(
+        queue.Queue(app.config.get('LOG_QUEUE_SIZE', 10000)))
+    app.extensions['log_queue_handler'] = _queue_handler
+
+    if error_log:
+        app.logger.setLevel(logging.INFO)
+        app.logger.addHandler(_queue_handler)
+    for logger in (access_logger, logging.getLogger('fyyur.slow_queries')):
+        logger.setLevel(logging.INFO)
+        logger.addHandler(_queue_handler)
+        logger.propagate = False
+
+    start_listener()
+    atexit.register(stop_listener)
+
+    if not access_log:
+        return
+
+    @app.before_request
+    def start_access_timer():
+        g.access_start_time = time.perf_counter()
+
+    @app.after_request
+    def log_access(response):
+        start = g.get('access_start_time')
+        if start is None:
+            return response
+        stats = g.get('query_stats')
+        access_logger.info(json.dumps({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()),
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 2),
+            'queries': stats.count if stats is not None else None,
+            'size': response.calculate_content_length(),
+            'remote_addr': request.remote_addr,
+        }))
+        return response
@@ -0,0 +1,299 @@
+import hmac
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, abort, g, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+#----------------------------------------------------------------------------#
+# Request metrics in the Prometheus text exposition format.
+#----------------------------------------------------------------------------#
+
+# Metrics are kept per worker process; with several workers every one of
+# them has to be scraped (or the numbers summed up) to get the total.
+# /metrics answers scrapers sending METRICS_TOKEN as a bearer token and
+# is not found without it, or when no token is configured.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"'
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f'{self.name}{labels} {value:g}')
+        return lines
+
+
+class Gauge:
+    """Value read from a function whenever the metrics are exposed."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, help_text, read=None):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} {self.type_name}']
+        value = self.read() if self.read is not None else None
+        if value is not None:
+            lines.append(f'{self.name} {value:g}')
+        return lines
+
+
+class CounterFunction(Gauge):
+    """Counter kept elsewhere, read whenever the metrics are exposed."""
+
+    type_name = 'counter'
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, label_names=(),
+                 buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} histogram']
+        names = self.label_names + ('le',)
+        with self._lock:
+            for label_values, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = format_labels(names, label_values + (f'{bound:g}',))
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = format_labels(names, label_values + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {series[-2]}')
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f'{self.name}_sum{labels} {series[-1]:g}')
+                lines.append(f'{self.name}_count{labels} {series[-2]}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'fyyur_request_duration_seconds', 'Request latency per endpoint.',
+    ('endpoint',))
+REQUESTS = Counter(
+    'fyyur_requests_total', 'Requests per endpoint, method and status.',
+    ('endpoint', 'method', 'status'))
+DB_DURATION = Histogram(
+    'fyyur_request_db_seconds', 'Time spent in SQL statements per request.',
+    ('endpoint',))
+DB_QUERIES = Counter(
+    'fyyur_db_queries_total', 'SQL statements issued per endpoint.',
+    ('endpoint',))
+RENDER_DURATION = Histogram(
+    'fyyur_request_render_seconds', 'Time spent rendering templates per request.',
+    ('endpoint',))
+POOL_WAIT = Histogram(
+    'fyyur_pool_checkout_wait_seconds',
+    'Time to get a connection from the pool, waiting or connecting.')
+POOL_HOLD = Histogram(
+    'fyyur_pool_connection_held_seconds',
+    'Time a connection stays checked out of the pool.')
+POOL_CHECKED_OUT = Gauge(
+    'fyyur_pool_checked_out', 'Connections checked out of the pool.')
+POOL_SIZE = Gauge(
+    'fyyur_pool_size', 'Connections the pool keeps open.')
+LOG_RECORDS_DROPPED = CounterFunction(
+    'fyyur_log_records_dropped_total',
+    'Log records dropped because the log queue was full.')
+
+ALL_METRICS = (REQUEST_DURATION, REQUESTS, DB_DURATION, DB_QUERIES,
+               RENDER_DURATION, POOL_WAIT, POOL_HOLD, POOL_CHECKED_OUT,
+               POOL_SIZE, LOG_RECORDS_DROPPED)
+
+
+class TimedTemplate(Template):
+    """Template adding its render time to g.render_time."""
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            if g:
+                g.render_time = g.get('render_time', 0.0) + \
+                    time.perf_counter() - start
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool timing every checkout into POOL_WAIT and adding it to
+    g.pool_wait. The checkout event only fires once a connection was
+    obtained, so the wait is timed around connect() itself.
+    """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            wait = time.perf_counter() - start
+            POOL_WAIT.observe(wait)
+            if g:
+                g.pool_wait = g.get('pool_wait', 0.0) + wait
+
+
+def use_timed_pool(app):
+    """
+    Have the engine of app pool its connections in a TimedQueuePool,
+    unless SQLALCHEMY_ENGINE_OPTIONS sets a poolclass of its own.
+    """
+    # sqlite connects on every checkout (NullPool) or shares a single
+    # in-memory connection (StaticPool), nothing waits for a connection
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        return
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    options.setdefault('poolclass', TimedQueuePool)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def _start_hold(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info['pool_checkout_time'] = time.perf_counter()
+
+
+def _end_hold(dbapi_connection, connection_record):
+    start = connection_record.info.pop('pool_checkout_time', None) \
+        if connection_record is not None else None
+    if start is not None:
+        POOL_HOLD.observe(time.perf_counter() - start)
+
+
+def instrument_pool(pool):
+    """
+    Time how long connections of pool stay checked out into POOL_HOLD and
+    read the pool's size and checked out connections into the gauges.
+    A pool that is always busy, with checkouts held as long as requests
+    take, is one requests wait for.
+    """
+    if event.contains(pool, 'checkout', _start_hold):
+        return
+    event.listen(pool, 'checkout', _start_hold)
+    event.listen(pool, 'checkin', _end_hold)
+    # the other pools, e.g. those of sqlite, have no such numbers
+    if isinstance(pool, QueuePool):
+        POOL_CHECKED_OUT.read = pool.checkedout
+        POOL_SIZE.read = pool.size
+
+
+def metrics_allowed(app):
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        return False
+    given = request.headers.get('Authorization', '')
+    return hmac.compare_digest(given, f'Bearer {token}')
+
+
+def init_app(app):
+    """
+    Record metrics of every request, add a Server-Timing header with the
+    db, pool wait, render and total time and expose the metrics at
+    /metrics.
+    Needs instrumentation.init_app(app) for the db numbers.
+
+    Config:
+    METRICS_TOKEN (String): bearer token scrapers of /metrics have to
+                            send, unset disables /metrics
+    """
+    app.jinja_env.template_class = TimedTemplate
+    use_timed_pool(app)
+    # the queue handler of logging_setup.py, if any log file is written
+    LOG_RECORDS_DROPPED.read = lambda: getattr(
+        app.extensions.get('log_queue_handler'), 'dropped', None)
+
+    @app.before_request
+    def start_request_timer():
+        instrument_pool(db.engine.pool)
+        g.request_start_time = time.perf_counter()
+        g.render_time = 0.0
+        g.pool_wait = 0.0
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get('request_start_time')
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        endpoint = request.endpoint or 'unmatched'
+        stats = g.get('query_stats')
+        db_time = stats.duration if stats is not None else 0.0
+        render_time = g.get('render_time', 0.0)
+        pool_wait = g.get('pool_wait', 0.0)
+
+        REQUEST_DURATION.observe(total, endpoint)
+        REQUESTS.inc(endpoint, request.method, response.status_code)
+        DB_DURATION.observe(db_time, endpoint)
+        RENDER_DURATION.observe(render_time, endpoint)
+        if stats is not None:
+            DB_QUERIES.inc(endpoint, amount=stats.count)
+
+        queries = stats.count if stats is not None else 0
+        response.headers['Server-Timing'] = (
+            f'db;dur={db_time * 1000:.2f};desc="{queries} queries", '
+            f'pool;dur={pool_wait * 1000:.2f};desc="checkout wait", '
+            f'render;dur={render_time * 1000:.2f}, '
+            f'total;dur={total * 1000:.2f}')
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if not metrics_allowed(app):
+            abort(404)
+        lines = []
+        for metric in ALL_METRICS:
+            lines.extend(metric.expose())
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,64 @@
+"""unique case-insensitive Genres and Areas names
+
+Revision ID: 7e25c1b9d046
+Revises: b93e05d7a4c6
+Create Date: 2026-10-18 19:02:41.517302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e25c1b9d046'
+down_revision = 'b93e05d7a4c6'
+branch_labels = None
+depends_on = None
+
+
+# genres and areas differing in case only are merged into the one with
+# the lowest id before the unique indexes are created; areas missing a
+# city or state are matched too, = would never find their keep row
+GENRE_KEEP = '''(SELECT min(keep.id) FROM "Genres" keep
+                 WHERE lower(keep.name) = lower("Genres".name))'''
+AREA_KEEP = '''(SELECT min(keep.id) FROM "Areas" keep
+                WHERE coalesce(lower(keep.city), '') =
+                      coalesce(lower("Areas".city), '')
+                AND coalesce(lower(keep.state), '') =
+                    coalesce(lower("Areas".state), ''))'''
+
+
+def merge_genre_links(junction, owner):
+    op.execute(f'''
+        INSERT INTO "{junction}" ({owner}, genre_id)
+        SELECT DISTINCT j.{owner}, dup.keep_id
+        FROM "{junction}" j
+        JOIN (SELECT id, {GENRE_KEEP} AS keep_id FROM "Genres") dup
+          ON dup.id = j.genre_id AND dup.keep_id <> dup.id
+        WHERE NOT EXISTS (SELECT 1 FROM "{junction}" k
+                          WHERE k.{owner} = j.{owner}
+                          AND k.genre_id = dup.keep_id)''')
+    op.execute(f'''
+        DELETE FROM "{junction}" WHERE genre_id IN
+        (SELECT id FROM "Genres" WHERE id <> {GENRE_KEEP})''')
+
+
+def upgrade():
+    merge_genre_links('VenuesGenresJunction', 'venue_id')
+    merge_genre_links('ArtistsGenresJunction', 'artist_id')
+    op.execute(f'DELETE FROM "Genres" WHERE id <> {GENRE_KEEP}')
+    op.execute(f'''
+        UPDATE "Venues" SET area_id =
+        (SELECT {AREA_KEEP} FROM "Areas" WHERE "Areas".id = "Venues".area_id)''')
+    op.execute(f'DELETE FROM "Areas" WHERE id <> {AREA_KEEP}')
+
+    op.create_index('ix_Genres_lower_name', 'Genres',
+                    [sa.text('lower(name)')], unique=True)
+    op.create_index('ix_Areas_lower_city_state', 'Areas',
+                    [sa.text('lower(city)'), sa.text('lower(state)')],
+                    unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_Areas_lower_city_state', table_name='Areas')
+    op.drop_index('ix_Genres_lower_name', table_name='Genres')
@@ -0,0 +1,35 @@
+"""page the Venues and Artists listings on the lower cased name
+
+Revision ID: b5140485859a
+Revises: e5f1b2c8d9a7
+Create Date: 2026-10-18 20:41:09.502117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5140485859a'
+down_revision = 'e5f1b2c8d9a7'
+branch_labels = None
+depends_on = None
+
+# the key of sort_name() in models.py
+SORT_NAME = sa.text("lower(coalesce(name, ''))")
+
+
+def upgrade():
+    op.drop_index('ix_Venues_name_id', table_name='Venues')
+    op.drop_index('ix_Artists_name_id', table_name='Artists')
+    op.create_index('ix_Artists_sort_name_id', 'Artists', [SORT_NAME, 'id'],
+                    unique=False)
+    op.create_index('ix_Venues_sort_name_id', 'Venues', [SORT_NAME, 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Venues_sort_name_id', table_name='Venues')
+    op.drop_index('ix_Artists_sort_name_id', table_name='Artists')
+    op.create_index('ix_Artists_name_id', 'Artists', ['name', 'id'], unique=False)
+    op.create_index('ix_Venues_name_id', 'Venues', ['name', 'id'], unique=False)
@@ -0,0 +1,95 @@
+"""let bulk loads skip the per row search vector triggers
+
+Revision ID: c3a9f1d27e54
+Revises: 7e25c1b9d046
+Create Date: 2026-10-18 19:31:07.240118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9f1d27e54'
+down_revision = '7e25c1b9d046'
+branch_labels = None
+depends_on = None
+
+# A transaction that ran SET LOCAL fyyur.bulk_load = 'on' skips the row
+# triggers maintaining the search vectors; every junction row would
+# otherwise update its venue or artist once more. bulk_import.py
+# instead copies the loaded rows to a temporary staging table and
+# inserts them from there with their vectors computed by
+# search_document() from the genres and areas the batch resolved.
+trigger_sql = '''
+CREATE OR REPLACE FUNCTION venues_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  {skip}
+  NEW.search_vector := venues_search_vector(NEW.id, NEW.name, NEW.area_id);
+  RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION artists_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  {skip}
+  NEW.search_vector := artists_search_vector(NEW.id, NEW.name, NEW.city, NEW.state);
+  RETURN NEW;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION venues_genres_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  changed_id integer;
+BEGIN
+  {skip_after}
+  IF TG_OP = 'DELETE' THEN
+    changed_id := OLD.venue_id;
+  ELSE
+    changed_id := NEW.venue_id;
+  END IF;
+  UPDATE "Venues" SET search_vector = venues_search_vector(id, name, area_id)
+  WHERE id = changed_id;
+  RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION artists_genres_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  changed_id integer;
+BEGIN
+  {skip_after}
+  IF TG_OP = 'DELETE' THEN
+    changed_id := OLD.artist_id;
+  ELSE
+    changed_id := NEW.artist_id;
+  END IF;
+  UPDATE "Artists" SET search_vector = artists_search_vector(id, name, city, state)
+  WHERE id = changed_id;
+  RETURN NULL;
+END
+$$;
+'''
+
+SKIP = '''IF current_setting('fyyur.bulk_load', true) = 'on' THEN
+    RETURN NEW;
+  END IF;'''
+SKIP_AFTER = '''IF current_setting('fyyur.bulk_load', true) = 'on' THEN
+    RETURN NULL;
+  END IF;'''
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(trigger_sql.format(skip=SKIP, skip_after=SKIP_AFTER))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(trigger_sql.format(skip='', skip_after=''))
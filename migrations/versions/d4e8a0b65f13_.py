@@ -0,0 +1,177 @@
+"""add full-text search vectors to Venues and Artists
+
+Revision ID: d4e8a0b65f13
+Revises: 2f6b9a31c7d5
+Create Date: 2026-10-18 11:48:20.664015
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e8a0b65f13'
+down_revision = '2f6b9a31c7d5'
+branch_labels = None
+depends_on = None
+
+search_vector_type = sa.Text().with_variant(postgresql.TSVECTOR(), 'postgresql')
+
+# Search documents are weighted name (A), genres (B), city and state (C).
+# They depend on Areas and Genres as well, so triggers on those tables and
+# on the junction tables recompute the documents of the affected rows.
+upgrade_sql = '''
+CREATE FUNCTION venues_search_vector(integer, text, integer)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+  SELECT setweight(to_tsvector('english', coalesce($2, '')), 'A')
+      || setweight(to_tsvector('english', coalesce((
+             SELECT string_agg(g.name, ' ')
+             FROM "VenuesGenresJunction" j JOIN "Genres" g ON g.id = j.genre_id
+             WHERE j.venue_id = $1), '')), 'B')
+      || setweight(to_tsvector('english', coalesce((
+             SELECT concat_ws(' ', a.city, a.state)
+             FROM "Areas" a WHERE a.id = $3), '')), 'C')
+$$;
+
+CREATE FUNCTION artists_search_vector(integer, text, text, text)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+  SELECT setweight(to_tsvector('english', coalesce($2, '')), 'A')
+      || setweight(to_tsvector('english', coalesce((
+             SELECT string_agg(g.name, ' ')
+             FROM "ArtistsGenresJunction" j JOIN "Genres" g ON g.id = j.genre_id
+             WHERE j.artist_id = $1), '')), 'B')
+      || setweight(to_tsvector('english', concat_ws(' ', $3, $4)), 'C')
+$$;
+
+CREATE FUNCTION venues_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.search_vector := venues_search_vector(NEW.id, NEW.name, NEW.area_id);
+  RETURN NEW;
+END
+$$;
+
+CREATE FUNCTION artists_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.search_vector := artists_search_vector(NEW.id, NEW.name, NEW.city, NEW.state);
+  RETURN NEW;
+END
+$$;
+
+CREATE FUNCTION venues_genres_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  changed_id integer;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    changed_id := OLD.venue_id;
+  ELSE
+    changed_id := NEW.venue_id;
+  END IF;
+  UPDATE "Venues" SET search_vector = venues_search_vector(id, name, area_id)
+  WHERE id = changed_id;
+  RETURN NULL;
+END
+$$;
+
+CREATE FUNCTION artists_genres_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+  changed_id integer;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    changed_id := OLD.artist_id;
+  ELSE
+    changed_id := NEW.artist_id;
+  END IF;
+  UPDATE "Artists" SET search_vector = artists_search_vector(id, name, city, state)
+  WHERE id = changed_id;
+  RETURN NULL;
+END
+$$;
+
+CREATE FUNCTION areas_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  UPDATE "Venues" SET search_vector = venues_search_vector(id, name, area_id)
+  WHERE area_id = NEW.id;
+  RETURN NULL;
+END
+$$;
+
+CREATE FUNCTION genres_search_vector_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  UPDATE "Venues" SET search_vector = venues_search_vector(id, name, area_id)
+  WHERE id IN (SELECT venue_id FROM "VenuesGenresJunction" WHERE genre_id = NEW.id);
+  UPDATE "Artists" SET search_vector = artists_search_vector(id, name, city, state)
+  WHERE id IN (SELECT artist_id FROM "ArtistsGenresJunction" WHERE genre_id = NEW.id);
+  RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER venues_search_vector_update
+BEFORE INSERT OR UPDATE OF name, area_id ON "Venues"
+FOR EACH ROW EXECUTE PROCEDURE venues_search_vector_trigger();
+
+CREATE TRIGGER artists_search_vector_update
+BEFORE INSERT OR UPDATE OF name, city, state ON "Artists"
+FOR EACH ROW EXECUTE PROCEDURE artists_search_vector_trigger();
+
+CREATE TRIGGER venues_genres_search_vector_update
+AFTER INSERT OR DELETE ON "VenuesGenresJunction"
+FOR EACH ROW EXECUTE PROCEDURE venues_genres_search_vector_trigger();
+
+CREATE TRIGGER artists_genres_search_vector_update
+AFTER INSERT OR DELETE ON "ArtistsGenresJunction"
+FOR EACH ROW EXECUTE PROCEDURE artists_genres_search_vector_trigger();
+
+CREATE TRIGGER areas_search_vector_update
+AFTER UPDATE OF city, state ON "Areas"
+FOR EACH ROW EXECUTE PROCEDURE areas_search_vector_trigger();
+
+CREATE TRIGGER genres_search_vector_update
+AFTER UPDATE OF name ON "Genres"
+FOR EACH ROW EXECUTE PROCEDURE genres_search_vector_trigger();
+
+UPDATE "Venues" SET search_vector = venues_search_vector(id, name, area_id);
+UPDATE "Artists" SET search_vector = artists_search_vector(id, name, city, state);
+'''
+
+downgrade_sql = '''
+DROP TRIGGER genres_search_vector_update ON "Genres";
+DROP TRIGGER areas_search_vector_update ON "Areas";
+DROP TRIGGER artists_genres_search_vector_update ON "ArtistsGenresJunction";
+DROP TRIGGER venues_genres_search_vector_update ON "VenuesGenresJunction";
+DROP TRIGGER artists_search_vector_update ON "Artists";
+DROP TRIGGER venues_search_vector_update ON "Venues";
+DROP FUNCTION genres_search_vector_trigger();
+DROP FUNCTION areas_search_vector_trigger();
+DROP FUNCTION artists_genres_search_vector_trigger();
+DROP FUNCTION venues_genres_search_vector_trigger();
+DROP FUNCTION artists_search_vector_trigger();
+DROP FUNCTION venues_search_vector_trigger();
+DROP FUNCTION artists_search_vector(integer, text, text, text);
+DROP FUNCTION venues_search_vector(integer, text, integer);
+'''
+
+
+def upgrade():
+    op.add_column('Venues', sa.Column('search_vector', search_vector_type, nullable=True))
+    op.add_column('Artists', sa.Column('search_vector', search_vector_type, nullable=True))
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(upgrade_sql)
+    op.create_index('ix_Venues_search_vector', 'Venues', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Artists_search_vector', 'Artists', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_Artists_search_vector', table_name='Artists')
+        op.drop_index('ix_Venues_search_vector', table_name='Venues')
+        op.execute(downgrade_sql)
+    op.drop_column('Artists', 'search_vector')
+    op.drop_column('Venues', 'search_vector')
@@ -0,0 +1,88 @@
+"""build search vectors from their parts with search_document()
+
+Revision ID: e5f1b2c8d9a7
+Revises: c3a9f1d27e54
+Create Date: 2026-10-18 19:52:43.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f1b2c8d9a7'
+down_revision = 'c3a9f1d27e54'
+branch_labels = None
+depends_on = None
+
+# search_document() weights the name (A), genres (B), city and state (C)
+# of a search vector given as text. The vector functions look the parts
+# up and pass them on; bulk_import.py passes them directly while
+# inserting rows whose genres and areas it already knows.
+upgrade_sql = '''
+CREATE FUNCTION search_document(text, text, text)
+RETURNS tsvector LANGUAGE sql IMMUTABLE AS $$
+  SELECT setweight(to_tsvector('english', coalesce($1, '')), 'A')
+      || setweight(to_tsvector('english', coalesce($2, '')), 'B')
+      || setweight(to_tsvector('english', coalesce($3, '')), 'C')
+$$;
+
+CREATE OR REPLACE FUNCTION venues_search_vector(integer, text, integer)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+  SELECT search_document(
+      $2,
+      (SELECT string_agg(g.name, ' ')
+       FROM "VenuesGenresJunction" j JOIN "Genres" g ON g.id = j.genre_id
+       WHERE j.venue_id = $1),
+      (SELECT concat_ws(' ', a.city, a.state)
+       FROM "Areas" a WHERE a.id = $3))
+$$;
+
+CREATE OR REPLACE FUNCTION artists_search_vector(integer, text, text, text)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+  SELECT search_document(
+      $2,
+      (SELECT string_agg(g.name, ' ')
+       FROM "ArtistsGenresJunction" j JOIN "Genres" g ON g.id = j.genre_id
+       WHERE j.artist_id = $1),
+      concat_ws(' ', $3, $4))
+$$;
+'''
+
+downgrade_sql = '''
+CREATE OR REPLACE FUNCTION venues_search_vector(integer, text, integer)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+  SELECT setweight(to_tsvector('english', coalesce($2, '')), 'A')
+      || setweight(to_tsvector('english', coalesce((
+             SELECT string_agg(g.name, ' ')
+             FROM "VenuesGenresJunction" j JOIN "Genres" g ON g.id = j.genre_id
+             WHERE j.venue_id = $1), '')), 'B')
+      || setweight(to_tsvector('english', coalesce((
+             SELECT concat_ws(' ', a.city, a.state)
+             FROM "Areas" a WHERE a.id = $3), '')), 'C')
+$$;
+
+CREATE OR REPLACE FUNCTION artists_search_vector(integer, text, text, text)
+RETURNS tsvector LANGUAGE sql STABLE AS $$
+  SELECT setweight(to_tsvector('english', coalesce($2, '')), 'A')
+      || setweight(to_tsvector('english', coalesce((
+             SELECT string_agg(g.name, ' ')
+             FROM "ArtistsGenresJunction" j JOIN "Genres" g ON g.id = j.genre_id
+             WHERE j.artist_id = $1), '')), 'B')
+      || setweight(to_tsvector('english', concat_ws(' ', $3, $4)), 'C')
+$$;
+
+DROP FUNCTION search_document(text, text, text);
+'''
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(upgrade_sql)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute(downgrade_sql)
@@ -1,5 +1,11 @@
+import datetime as dt
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert as pg_insert
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session
 
 
 db = SQLAlchemy()
@@ -7,6 +13,18 @@ db = SQLAlchemy()
 # Models.
 #----------------------------------------------------------------------------#
 
+# full-text search document, maintained by triggers on postgres
+SearchVector = db.Text().with_variant(TSVECTOR(), 'postgresql')
+
+def sort_name(name_column):
+    """
+    Key the /venues and /artists listings sort and page on: the name
+    case-insensitively, names missing first. ix_Venues_sort_name_id and
+    ix_Artists_sort_name_id index the same expression.
+    """
+    return db.func.lower(db.func.coalesce(name_column, ''))
+
+
 ArtistsGenresJunction = db.Table('ArtistsGenresJunction',
     db.Column('artist_id', db.Integer, db.ForeignKey('Artists.id'), primary_key=True),
     db.Column('genre_id', db.Integer, db.ForeignKey('Genres.id'), primary_key=True)
@@ -20,6 +38,12 @@ VenuesGenresJunction = db.Table('VenuesGenresJunction',
 
 class Venues(db.Model):
     __tablename__ = 'Venues'
+    # the /venues listing is paginated on (sort_name(name), id)
+    __table_args__ = (
+        db.Index('ix_Venues_sort_name_id', sort_name(db.text('name')), 'id'),
+        db.Index('ix_Venues_search_vector', 'search_vector',
+                 postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -35,6 +59,13 @@ class Venues(db.Model):
     shows = db.relationship('Shows', backref='venue', lazy=True)
     genres = db.relationship('Genres', secondary=VenuesGenresJunction, lazy='subquery',
         backref=db.backref('venues', lazy=True))
+    # maintained by show_counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0,
+        server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0,
+        server_default='0')
+    # name, genres, city and state
+    search_vector = db.deferred(db.Column(SearchVector))
 
 
     @hybrid_property
@@ -55,6 +86,11 @@ class Venues(db.Model):
 
 class Areas(db.Model):
     __tablename__ = 'Areas'
+    # one row per city and state regardless of case, see reference_data.py
+    __table_args__ = (
+        db.Index('ix_Areas_lower_city_state', db.func.lower(db.text('city')),
+                 db.func.lower(db.text('state')), unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
@@ -66,6 +102,12 @@ class Areas(db.Model):
 
 class Artists(db.Model):
     __tablename__ = 'Artists'
+    # the /artists listing is paginated on (sort_name(name), id)
+    __table_args__ = (
+        db.Index('ix_Artists_sort_name_id', sort_name(db.text('name')), 'id'),
+        db.Index('ix_Artists_search_vector', 'search_vector',
+                 postgresql_using='gin'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -80,6 +122,13 @@ class Artists(db.Model):
     shows = db.relationship('Shows', backref='artist', lazy=True)
     genres = db.relationship('Genres', secondary=ArtistsGenresJunction, lazy='subquery',
         backref=db.backref('artists', lazy=True))
+    # maintained by show_counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0,
+        server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0,
+        server_default='0')
+    # name, genres, city and state
+    search_vector = db.deferred(db.Column(SearchVector))
 
     def __repr__(self):
         return self.name
@@ -91,6 +140,11 @@ class Artists(db.Model):
 
 class Genres(db.Model):
     __tablename__ = 'Genres'
+    # one row per name regardless of case, see reference_data.py
+    __table_args__ = (
+        db.Index('ix_Genres_lower_name', db.func.lower(db.text('name')),
+                 unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
 
@@ -102,12 +156,22 @@ class Genres(db.Model):
 
 class Shows(db.Model):
     __tablename__ = 'Shows'
+    # venue and artist pages filter on the owner and start_time,
+    # the /shows timeline orders on start_time alone
+    __table_args__ = (
+        db.Index('ix_Shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_Shows_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_Shows_start_time', 'start_time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime, nullable=False)
-    venue_id = db.Column(db.Integer, db.ForeignKey('Venues.id'),
-        nullable=False)
-    artist_id = db.Column(db.Integer, db.ForeignKey('Artists.id'),
-        nullable=False)
+    # the show counters need the old values of updates, which are loaded
+    # before they are overwritten even when the show was expired
+    start_time = db.column_property(db.Column(db.DateTime, nullable=False),
+        active_history=True)
+    venue_id = db.column_property(db.Column(db.Integer,
+        db.ForeignKey('Venues.id'), nullable=False), active_history=True)
+    artist_id = db.column_property(db.Column(db.Integer,
+        db.ForeignKey('Artists.id'), nullable=False), active_history=True)
 
     def __repr__(self):
         return (f'----------- Show -----------\n'
@@ -116,3 +180,223 @@ class Shows(db.Model):
                 f'Venue: {self.venue.name}\n')
 
 # DONE Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
+
+class ShowCountersState(db.Model):
+    __tablename__ = 'ShowCountersState'
+    # single row; shows starting up to rolled_over_at are counted as past
+    # in the show counters of Venues and Artists, later ones as upcoming
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_over_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'rolled over at {self.rolled_over_at}'
+
+
+class ChangeCounters(db.Model):
+    __tablename__ = 'ChangeCounters'
+    # one row per table and one per written venue or artist (named e.g.
+    # 'Venues:42', see entity_version_name()), bumped at the end of every
+    # transaction that writes to them; used as a cheap validator for
+    # conditional GETs and as the version of cached pages
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'{self.name}: {self.version}'
+
+
+# bumped by loaders that may rewrite existing venues, artists or shows
+# without the ORM; versions the venue and artist pages together with the
+# counters of the single venue or artist
+BULK_LOADS = 'BulkLoads'
+
+
+def entity_version_name(table_name, entity_id):
+    return f'{table_name}:{entity_id}'
+
+
+def bump_versions(connection, table_names):
+    """
+    Increase the change counters of the given tables. Called on every
+    commit of ORM writes, bulk loaders that bypass the ORM have to call it
+    themselves, with BULK_LOADS when they touch existing rows.
+
+    Parameters:
+    connection (Connection or Session): where to run the update
+    table_names (iterable): names of the changed tables
+
+    Returns:
+    versions (dict): table name -> (version, updated_at) after the bump;
+                     the update holds the rows' locks until the
+                     transaction ends, so version - 1 is the one before
+    """
+    table_names = sorted(set(table_names))
+    if not table_names:
+        return {}
+    counters = ChangeCounters.__table__
+    now = dt.datetime.utcnow()
+    columns = (counters.c.name, counters.c.version, counters.c.updated_at)
+    bind = connection.get_bind() if hasattr(connection, 'get_bind') \
+        else connection
+    postgres = bind.dialect.name == 'postgresql'
+
+    def bump(names):
+        update = counters.update().\
+            where(counters.c.name.in_(names)).\
+            values(version=counters.c.version + 1, updated_at=now)
+        if postgres:
+            rows = connection.execute(update.returning(*columns))
+        else:
+            connection.execute(update)
+            rows = connection.execute(db.select(columns).
+                                      where(counters.c.name.in_(names)))
+        return {name: (version, updated_at)
+                for name, version, updated_at in rows}
+
+    versions = bump(table_names)
+    missing = [name for name in table_names if name not in versions]
+    if missing:
+        # the first writes of an entity by two transactions both miss its
+        # row; the insert skips a row the other one created (postgres
+        # waits for it to commit), the update then bumps it in any case
+        if postgres:
+            insert_missing = pg_insert(counters).on_conflict_do_nothing(
+                index_elements=[counters.c.name])
+        else:
+            insert_missing = counters.insert().prefix_with(
+                'OR IGNORE', dialect='sqlite')
+        connection.execute(insert_missing, [
+            {'name': name, 'version': 0, 'updated_at': now}
+            for name in missing])
+        versions.update(bump(missing))
+    return versions
+
+
+def table_versions(table_names):
+    """
+    Return the change counters of the given tables, e.g. to tell whether
+    an in-process cache built from them went stale. Costs a single
+    primary key lookup query.
+
+    Parameters:
+    table_names (iterable): names of the tables
+
+    Returns:
+    versions (dict): table name -> (version, updated_at); the time
+                     tells apart equal versions of a database restored
+                     from a snapshot
+    """
+    counters = ChangeCounters.__table__
+    return {name: (version, updated_at) for name, version, updated_at in
+            db.session.execute(
+                db.select([counters.c.name, counters.c.version,
+                           counters.c.updated_at]).
+                where(counters.c.name.in_(sorted(table_names))))}
+
+
+def changed_entities(session, changed):
+    """
+    Return the counter names of the venues and artists whose pages show
+    the changed objects: venues and artists themselves, both owners of a
+    show (before and after an update), and the other side of the shows of
+    a renamed venue or artist.
+    """
+    names = set()
+    for obj in changed:
+        state = inspect(obj)
+        if isinstance(obj, Shows):
+            for column, table_name in (('venue_id', 'Venues'),
+                                       ('artist_id', 'Artists')):
+                names.update(entity_version_name(table_name, owner_id)
+                             for owner_id in state.attrs[column].history.sum()
+                             if owner_id is not None)
+        elif isinstance(obj, (Venues, Artists)):
+            names.add(entity_version_name(obj.__tablename__, obj.id))
+            if obj in session.new or obj in session.deleted or not any(
+                    state.attrs[attr].history.has_changes()
+                    for attr in ('name', 'image_link')):
+                continue
+            # the name and image are listed on the pages of the other side
+            if isinstance(obj, Venues):
+                owner, other, table_name = Shows.venue_id, Shows.artist_id, 'Artists'
+            else:
+                owner, other, table_name = Shows.artist_id, Shows.venue_id, 'Venues'
+            names.update(entity_version_name(table_name, other_id)
+                         for other_id, in session.execute(
+                             db.select([other]).distinct().
+                             where(owner == obj.id)))
+    return names
+
+
+def followed_versions(versions, bumped):
+    """
+    Return the versions an in-process cache built at versions is at after
+    applying the writes of a transaction that committed with the bumped
+    versions: the committed ones of the tables no other transaction
+    bumped in between, the old ones of the others.
+
+    Parameters:
+    versions (dict): table name -> (version, updated_at), as returned by
+                     table_versions()
+    bumped (dict): session.info['bumped_versions'] of the transaction
+
+    Returns:
+    versions (dict): table name -> (version, updated_at)
+    """
+    followed = dict(versions)
+    for name, (before, version) in bumped.items():
+        # tables without a counter row yet are at version 0
+        built = versions.get(name)
+        if (built[0] if built else 0) == before:
+            followed[name] = version
+    return followed
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_flushed_versions(session, flush_context):
+    changed = list(session.new) + list(session.deleted) + \
+        [obj for obj in session.dirty if session.is_modified(obj)]
+    names = {inspect(obj).mapper.local_table.name for obj in changed
+             if not isinstance(obj, ChangeCounters)}
+    names |= changed_entities(session, changed)
+    session.info.setdefault('changed_versions', set()).update(names)
+
+
+@event.listens_for(Session, 'before_commit')
+def bump_committed_versions(session):
+    # the bump is the last statement of the transaction, so its row locks
+    # on the counters, which every writer of the same table waits for,
+    # are only held while committing
+    if session.transaction.parent is not None:
+        return
+    session.flush()
+    names = session.info.pop('changed_versions', set())
+    # tables written by plain statements executed on the session
+    table_names = session.info.pop('changed_tables', set())
+    versions = bump_versions(session, names | table_names)
+    # (version before, version after) per table, e.g. for in-process
+    # caches to follow their own writes, see followed_versions(); read by
+    # after_commit listeners
+    session.info['bumped_versions'] = {
+        name: (version[0] - 1, version) for name, version in versions.items()}
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def forget_bumped_versions(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('changed_versions', None)
+        session.info.pop('bumped_versions', None)
+
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    # sqlite leaves foreign keys unchecked unless asked, and WAL lets
+    # readers run next to a writer; busy_timeout waits for the write lock
+    # instead of failing with "database is locked" right away
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys = ON')
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.execute('PRAGMA busy_timeout = 30000')
+        cursor.close()
@@ -0,0 +1,156 @@
+import datetime as dt
+import threading
+import time
+from collections import OrderedDict
+
+#----------------------------------------------------------------------------#
+# Rendered page cache.
+#----------------------------------------------------------------------------#
+
+# Venue and artist pages are cached as rendered HTML under a key per
+# entity and version: the ETag that conditional() in app.py derives from
+# the change counter of that one venue or artist, which ORM writes to it,
+# to its shows or to the names on its shows bump (see changed_entities()
+# in models.py), and from the counter of bulk loads. A write by any
+# process moves the pages it touches to new keys and leaves all others
+# cached; stale entries age out of the LRU or expire in redis.
+# Entries also expire when the next upcoming show on the page starts.
+
+
+def venue_page_key(venue_id, version):
+    return f'page:venue:{venue_id}:{version}'
+
+
+def artist_page_key(artist_id, version):
+    return f'page:artist:{artist_id}:{version}'
+
+
+class LRUBackend:
+    """
+    In-process least recently used cache with per entry expiry.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """
+    Cache shared by all worker processes, stored in redis.
+    Needs the redis package, which is not part of requirements.txt.
+    """
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(key)
+        return None if value is None else value.decode('utf-8')
+
+    def set(self, key, value, timeout):
+        self._client.set(key, value.encode('utf-8'), px=int(timeout * 1000))
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*keys)
+
+    def clear(self):
+        keys = list(self._client.scan_iter('page:*'))
+        if keys:
+            self._client.delete(*keys)
+
+
+class PageCache:
+    """
+    Front for the configured backend.
+
+    Config:
+    PAGE_CACHE_BACKEND (String): 'lru', 'redis' or 'null' to disable
+    PAGE_CACHE_URL (String): redis url for the redis backend
+    PAGE_CACHE_MAX_ENTRIES (int): size of the lru backend
+    PAGE_CACHE_TIMEOUT (int): maximal lifetime of an entry in seconds
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.timeout = 300
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('PAGE_CACHE_BACKEND', 'lru')
+        self.timeout = app.config.get('PAGE_CACHE_TIMEOUT', 300)
+        if backend == 'lru':
+            self.backend = LRUBackend(app.config.get('PAGE_CACHE_MAX_ENTRIES',
+                                                     1000))
+        elif backend == 'redis':
+            self.backend = RedisBackend(app.config['PAGE_CACHE_URL'])
+        elif backend == 'null':
+            self.backend = None
+        else:
+            raise ValueError(f'unknown PAGE_CACHE_BACKEND {backend!r}')
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        return self.backend.get(key)
+
+    def set(self, key, value, expires_at=None):
+        """
+        Store a rendered page.
+
+        Parameters:
+        key (String): cache key
+        value (String): rendered page
+        expires_at (datetime): utc time the page goes stale at the latest,
+                               e.g. the start of its next upcoming show
+        """
+        if self.backend is None:
+            return
+        timeout = self.timeout
+        if expires_at is not None:
+            timeout = min(timeout, (expires_at - dt.datetime.utcnow()).total_seconds())
+        if timeout > 0:
+            self.backend.set(key, value, timeout)
+
+    def delete(self, *keys):
+        if self.backend is not None:
+            self.backend.delete(*keys)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+page_cache = PageCache()
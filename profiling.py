@@ -0,0 +1,92 @@
+import cProfile
+import datetime as dt
+import glob
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+
+from flask import g, request
+
+#----------------------------------------------------------------------------#
+# Per-request cProfile capture.
+#----------------------------------------------------------------------------#
+
+# A request is profiled when it carries the PROFILE_TOKEN in an
+# X-Profile header, or when it is picked by the PROFILE_SAMPLE_RATE
+# sampling. The token is not taken from the query string, which ends up
+# in the access and slow query logs. Profiles are dumped to PROFILE_DIR as
+# <endpoint>-<method>-<utc timestamp>.pstats for profile_report().
+
+
+def wants_profile(app):
+    token = app.config.get('PROFILE_TOKEN')
+    if token:
+        given = request.headers.get('X-Profile')
+        if given and hmac.compare_digest(given, token):
+            return True
+    rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def profile_path(directory, endpoint, method, now=None):
+    now = now or dt.datetime.utcnow()
+    route = re.sub(r'[^A-Za-z0-9_.]+', '_', endpoint or 'unmatched')
+    return os.path.join(directory,
+                        f'{route}-{method}-{now:%Y%m%dT%H%M%S.%f}.pstats')
+
+
+def init_app(app):
+    """
+    Profile selected requests.
+
+    Config:
+    PROFILE_TOKEN (String): secret enabling on-demand profiling, unset
+                            disables it
+    PROFILE_SAMPLE_RATE (float): share of all requests to profile
+    PROFILE_DIR (String): directory the .pstats files are written to
+    """
+
+    @app.before_request
+    def start_profile():
+        if wants_profile(app):
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+
+    @app.teardown_request
+    def dump_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        directory = app.config.get('PROFILE_DIR', 'profiles')
+        os.makedirs(directory, exist_ok=True)
+        profile.dump_stats(profile_path(directory, request.endpoint,
+                                        request.method))
+
+
+def profile_report(directory='profiles', endpoint=None, top=20,
+                   sort='cumulative'):
+    """
+    Aggregate .pstats files into a hot function report.
+
+    Parameters:
+    directory (String): directory with the .pstats files
+    endpoint (String): only aggregate profiles of this endpoint
+    top (int): number of functions to list
+    sort (String): pstats sort key, e.g. 'cumulative' or 'tottime'
+
+    Returns:
+    report (String): the report, or None when no profile matched
+    """
+    pattern = f'{endpoint}-*.pstats' if endpoint else '*.pstats'
+    files = sorted(glob.glob(os.path.join(directory, pattern)))
+    if not files:
+        return None
+    out = io.StringIO()
+    out.write(f'{len(files)} profiles from {directory}\n')
+    stats = pstats.Stats(*files, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+    return out.getvalue()
@@ -0,0 +1,261 @@
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import db, table_versions, followed_versions, Areas, Genres
+from search_index import genre_names
+
+#----------------------------------------------------------------------------#
+# In-process registry of genres and areas.
+#----------------------------------------------------------------------------#
+
+# Form posts name their genre and area as free text. The registry maps
+# the case-insensitive names to ids from memory and only goes to the
+# database for names it has not seen, with a single
+# INSERT ... ON CONFLICT against the unique lower() indexes, which also
+# settles concurrent inserts of the same name (INSERT OR IGNORE and a
+# SELECT on sqlite). Names resolved that way
+# are only published to the registry once the transaction that
+# inserted them committed, new genres to the genre search index too.
+# The thread of cache_sync.py compares the change counters of Genres and
+# Areas with those the registry was loaded at and reloads it when another
+# process, e.g. flask reset-db or a snapshot restore, moved them; the
+# process's own inserts move the registry on with them instead.
+
+
+def genre_key(name):
+    return ' '.join(name.split()).lower()
+
+
+def area_key(city, state):
+    return genre_key(city), genre_key(state)
+
+
+def attach(model, **values):
+    """
+    Return the row of model with the given column values as a persistent
+    object of the session, without loading it from the database.
+    """
+    key = db.session.identity_key(model, values['id'])
+    obj = db.session.identity_map.get(key)
+    if obj is None:
+        obj = model(**values)
+        make_transient_to_detached(obj)
+        db.session.add(obj)
+    return obj
+
+
+def insert_missing(table, rows, columns):
+    """
+    Insert the rows that are not in table yet, comparing columns case
+    insensitively against its unique lower() index.
+
+    Parameters:
+    table (Table): Genres or Areas table
+    rows (list): dicts of the column values
+    columns (tuple): names of the indexed columns
+
+    Returns:
+    rows (iterable): (id, *columns) of the inserted and existing rows;
+                     may include other rows sharing a value outside
+                     postgres, the caller matches them by genre_key or
+                     area_key
+    """
+    lowered = [db.func.lower(table.c[column]) for column in columns]
+    selected = [table.c.id] + [table.c[column] for column in columns]
+    if db.engine.dialect.name == 'postgresql':
+        # the no-op update makes RETURNING include the existing rows
+        qry = insert(table).values(rows).on_conflict_do_update(
+            index_elements=lowered,
+            set_={columns[0]: table.c[columns[0]]}).returning(*selected)
+        return db.session.execute(qry)
+    # sqlite: INSERT OR IGNORE skips the existing rows, a second
+    # statement reads the ids back; other databases report a concurrent
+    # insert of the same name as an IntegrityError. The values are
+    # lowered by the database too, as sqlite's lower() of the index
+    # only folds ASCII letters and would miss e.g. 'Électro'
+    db.session.execute(table.insert().prefix_with('OR IGNORE',
+                                                  dialect='sqlite'), rows)
+    values = sorted({row[columns[0]] for row in rows})
+    return db.session.execute(
+        db.select(selected).
+        where(lowered[0].in_([db.func.lower(db.literal(value))
+                              for value in values])))
+
+
+TABLES = ('Genres', 'Areas')
+
+
+class ReferenceRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # normalized key -> (id, stored name(s))
+        self._genres = {}
+        self._areas = {}
+        # change counters of the tables when loaded, None before
+        self._versions = None
+
+    def warm(self):
+        """
+        Load all genres and areas from the database.
+
+        Returns:
+        sizes (tuple): number of genres and areas loaded
+        """
+        # read before the rows, a write in between only reloads once more
+        versions = table_versions(TABLES)
+        genres = {genre_key(name): (id_, name) for id_, name
+                  in db.session.query(Genres.id, Genres.name)}
+        areas = {area_key(city, state): (id_, city, state) for id_, city, state
+                 in db.session.query(Areas.id, Areas.city, Areas.state)}
+        with self._lock:
+            self._genres = genres
+            self._areas = areas
+            self._versions = versions
+        return len(genres), len(areas)
+
+    def sync(self):
+        """
+        Reload when the Genres or Areas change counters moved since the
+        registry was loaded. Left to the next transaction while this one
+        has names of its own to publish, which it would otherwise load
+        before they are committed.
+
+        Returns:
+        reloaded (bool): whether the registry was reloaded
+        """
+        if db.session.info.get('reference_data_pending'):
+            return False
+        if table_versions(TABLES) == self._versions:
+            return False
+        self.warm()
+        return True
+
+    def _publish_later(self, registry, key, entry, table_name):
+        pending = db.session.info.setdefault('reference_data_pending', [])
+        pending.append((registry, key, entry))
+        db.session.info.setdefault('changed_tables', set()).add(table_name)
+
+    def publish(self, pending, bumped):
+        with self._lock:
+            for registry, key, entry in pending:
+                getattr(self, registry)[key] = entry
+                if registry == '_genres':
+                    genre_names.add(*entry)
+            if self._versions is not None:
+                self._versions = followed_versions(
+                    self._versions, {name: bumped[name] for name in TABLES
+                                     if name in bumped})
+
+    def genres(self, names):
+        """
+        Resolve a batch of genre names, inserting the unknown ones with
+        a single statement.
+
+        Parameters:
+        names (iterable): genre names in any case
+
+        Returns:
+        entries (dict): genre_key(name) -> (id, stored name)
+        """
+        entries = {}
+        missing = {}
+        for name in names:
+            key = genre_key(name)
+            entry = self._genres.get(key)
+            if entry is not None:
+                entries[key] = entry
+            else:
+                missing[key] = ' '.join(name.split()).title()
+        if missing:
+            for id_, name in insert_missing(
+                    Genres.__table__, [{'name': name}
+                                       for name in missing.values()],
+                    ('name',)):
+                key = genre_key(name)
+                entries[key] = (id_, name)
+                self._publish_later('_genres', key, (id_, name), 'Genres')
+        return entries
+
+    def areas(self, pairs):
+        """
+        Resolve a batch of (city, state) pairs, inserting the unknown
+        ones with a single statement.
+
+        Parameters:
+        pairs (iterable): (city, state) tuples in any case
+
+        Returns:
+        entries (dict): area_key(city, state) -> (id, city, state)
+        """
+        entries = {}
+        missing = {}
+        for city, state in pairs:
+            key = area_key(city, state)
+            entry = self._areas.get(key)
+            if entry is not None:
+                entries[key] = entry
+            else:
+                missing[key] = {'city': ' '.join(city.split()).title(),
+                                'state': ' '.join(state.split()).upper()}
+        if missing:
+            for id_, city, state in insert_missing(
+                    Areas.__table__, list(missing.values()),
+                    ('city', 'state')):
+                key = area_key(city, state)
+                if key not in missing:
+                    continue
+                entries[key] = (id_, city, state)
+                self._publish_later('_areas', key, (id_, city, state), 'Areas')
+        return entries
+
+    def genre(self, name):
+        """
+        Return the Genres row of name, inserting it if needed, attached
+        to the session without loading it.
+
+        Parameters:
+        name (String): genre name in any case
+
+        Returns:
+        genre (Genres): the genre
+        """
+        id_, name = self.genres([name])[genre_key(name)]
+        return attach(Genres, id=id_, name=name)
+
+    def area(self, city, state):
+        """
+        Return the Areas row of city and state, inserting it if needed,
+        attached to the session without loading it.
+
+        Parameters:
+        city (String): city name in any case
+        state (String): state code in any case
+
+        Returns:
+        area (Areas): the area
+        """
+        id_, city, state = self.areas([(city, state)])[area_key(city, state)]
+        return attach(Areas, id=id_, city=city, state=state)
+
+
+reference_data = ReferenceRegistry()
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_reference_data(session):
+    pending = session.info.pop('reference_data_pending', None)
+    if pending:
+        # see bump_committed_versions() in models.py
+        reference_data.publish(pending, session.info.get('bumped_versions', {}))
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def discard_reference_data(session, transaction):
+    # names inserted by a transaction that did not commit are forgotten
+    if transaction.parent is None:
+        session.info.pop('reference_data_pending', None)
+        session.info.pop('changed_tables', None)
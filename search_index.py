@@ -0,0 +1,377 @@
+import bisect
+import math
+import threading
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import (db, table_versions, followed_versions, Venues, Artists,
+                    Genres)
+
+#----------------------------------------------------------------------------#
+# In-process search indexes for venue, artist and genre names.
+#----------------------------------------------------------------------------#
+
+# Every worker process keeps its own copy, built from the database at
+# startup. Names the process itself writes through the ORM are applied
+# once their transaction commits, and when no other process wrote to the
+# table in between, the index moves on to the version of that commit
+# rather than rebuilding. sync_search_indexes() compares the change counters of the indexed
+# tables with those the indexes were built at and rebuilds the ones
+# another process, e.g. a sibling worker or a bulk import, changed; the
+# thread of cache_sync.py runs it in the background.
+
+# minimal share of the query trigrams a name has to contain
+# to count as a typo-tolerant match
+SIMILARITY_THRESHOLD = 0.5
+
+# prefix list entries scanned per requested suggestion
+SUGGEST_SCAN_FACTOR = 4
+
+
+def trigrams(text):
+    """
+    Return the set of trigrams of a lower cased, space padded text,
+    the same way pg_trgm pads words.
+
+    Parameters:
+    text (String): text to split
+
+    Returns:
+    trigrams (set): set of three character strings
+    """
+    grams = set()
+    for word in text.lower().split():
+        padded = f'  {word} '
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def inner_trigrams(text):
+    """
+    Return the set of unpadded trigrams of the words of a lower cased
+    text, the trigrams every name containing the text as a substring has.
+
+    Parameters:
+    text (String): text to split
+
+    Returns:
+    trigrams (set): set of three character strings
+    """
+    grams = set()
+    for word in text.lower().split():
+        for i in range(len(word) - 2):
+            grams.add(word[i:i + 3])
+    return grams
+
+
+def prefix_entries(id_, name):
+    """
+    Return the (key, id) entries of the prefix list for a name, one
+    for every word start, e.g. 'the musical hop', 'musical hop', 'hop'.
+    """
+    words = name.lower().split()
+    return [(' '.join(words[i:]), id_) for i in range(len(words))]
+
+
+class NameIndex:
+    """
+    Inverted trigram index mapping ids to names.
+
+    Substring matches rank first, ordered by how much of the name the
+    term covers; names sharing at least SIMILARITY_THRESHOLD of the
+    term's trigrams follow as typo-tolerant matches.
+
+    A sorted list of (name from a word start on, id) pairs answers
+    typeahead prefix lookups with a binary search.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = {}
+        self._postings = defaultdict(set)
+        self._prefixes = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, id_, name):
+        """add or rename the entry with the given id"""
+        with self._lock:
+            self._discard(id_)
+            if not name:
+                return
+            self._names[id_] = name
+            for gram in trigrams(name):
+                self._postings[gram].add(id_)
+            for entry in prefix_entries(id_, name):
+                bisect.insort(self._prefixes, entry)
+
+    def remove(self, id_):
+        with self._lock:
+            self._discard(id_)
+
+    def _discard(self, id_):
+        name = self._names.pop(id_, None)
+        if name is None:
+            return
+        for gram in trigrams(name):
+            posting = self._postings[gram]
+            posting.discard(id_)
+            if not posting:
+                del self._postings[gram]
+        for entry in prefix_entries(id_, name):
+            i = bisect.bisect_left(self._prefixes, entry)
+            if i < len(self._prefixes) and self._prefixes[i] == entry:
+                del self._prefixes[i]
+
+    def rebuild(self, rows):
+        """
+        Replace the whole index.
+
+        Parameters:
+        rows (iterable): (id, name) tuples
+        """
+        names = {}
+        postings = defaultdict(set)
+        prefixes = []
+        for id_, name in rows:
+            if not name:
+                continue
+            names[id_] = name
+            for gram in trigrams(name):
+                postings[gram].add(id_)
+            prefixes.extend(prefix_entries(id_, name))
+        prefixes.sort()
+        with self._lock:
+            self._names, self._postings = names, postings
+            self._prefixes = prefixes
+
+    def replace(self, other):
+        """take over the entries of another index"""
+        with other._lock:
+            names, postings = other._names, other._postings
+            prefixes = other._prefixes
+        with self._lock:
+            self._names, self._postings = names, postings
+            self._prefixes = prefixes
+
+    def suggest(self, prefix, limit=5):
+        """
+        Return up to limit (id, name) tuples of names with a word starting
+        with prefix, names starting with it first.
+
+        Parameters:
+        prefix (String): typed prefix
+        limit (int): maximal number of suggestions
+
+        Returns:
+        suggestions (list): list of (id, name) tuples
+        """
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        with self._lock:
+            names, prefixes = self._names, self._prefixes
+            start = bisect.bisect_left(prefixes, (prefix,))
+            found = {}
+            # a few more than limit, so whole-name matches further down the
+            # list can still make it before word matches
+            for key, id_ in prefixes[start:start + limit * SUGGEST_SCAN_FACTOR]:
+                if not key.startswith(prefix):
+                    break
+                found.setdefault(id_, names[id_])
+        ranked = sorted(found.items(), key=lambda item: (
+            not item[1].lower().startswith(prefix), item[1].lower()))
+        return ranked[:limit]
+
+    def search(self, term, limit=None):
+        """
+        Return ids of names matching term, best match first.
+
+        Parameters:
+        term (String): search term
+        limit (int): maximal number of ids to return
+
+        Returns:
+        ids (list): list of matching ids
+        """
+        term = ' '.join(term.lower().split())
+        with self._lock:
+            names = self._names
+            if not term:
+                ranked = sorted(names, key=lambda id_: names[id_].lower())
+                return ranked[:limit]
+
+            postings = self._postings
+            inner = sorted((postings.get(gram, set())
+                            for gram in inner_trigrams(term)), key=len)
+            if inner:
+                # every name containing the term has all its inner trigrams
+                candidates = set(inner[0]).intersection(*inner[1:])
+            else:
+                # no word long enough for a trigram of its own, every name
+                # containing the term has a trigram containing its longest
+                # word
+                word = max(term.split(), key=len)
+                candidates = set()
+                for gram, posting in postings.items():
+                    if word in gram:
+                        candidates |= posting
+
+            if len(term) < 3:
+                term_postings = []
+                min_hits = 1
+            else:
+                term_postings = sorted((postings.get(gram, set())
+                                        for gram in trigrams(term)), key=len)
+                # a name sharing min_hits trigrams with the term is in at
+                # least one of the len - min_hits + 1 rarest postings
+                min_hits = max(1, math.ceil(SIMILARITY_THRESHOLD *
+                                            len(term_postings)))
+                candidates = candidates.union(
+                    *term_postings[:len(term_postings) - min_hits + 1])
+
+            scored = []
+            for id_ in candidates:
+                name = names[id_].lower()
+                if term in name:
+                    scored.append((2 + len(term) / len(name), id_))
+                elif term_postings:
+                    hits = sum(1 for posting in term_postings if id_ in posting)
+                    if hits >= min_hits:
+                        scored.append((hits / len(term_postings), id_))
+
+            scored.sort(key=lambda score: (-score[0], names[score[1]].lower()))
+        return [id_ for _, id_ in scored[:limit]]
+
+
+venue_names = NameIndex()
+artist_names = NameIndex()
+genre_names = NameIndex()
+
+_indexed = ((venue_names, Venues), (artist_names, Artists),
+            (genre_names, Genres))
+# table name -> change counter the index was built at
+_built_versions = {}
+_indexed_tables = [model.__tablename__ for _, model in _indexed]
+_table_names = {index: model.__tablename__ for index, model in _indexed}
+# held while applying commits and swapping in rebuilt indexes, which is
+# all a committing request waits for
+_sync_lock = threading.Lock()
+# held for a whole rebuild, one at a time
+_rebuild_lock = threading.Lock()
+# table name -> (changes, bumped versions) of the commits applied while
+# its index is being rebuilt, replayed on the new index
+_applied_during_rebuild = {}
+
+
+def _apply(index, id_, name):
+    if name is None:
+        index.remove(id_)
+    else:
+        index.add(id_, name)
+
+
+def _rebuild(index, model, version):
+    # the new index is built outside _sync_lock, so commits go on
+    # applying their names to the old one; they are replayed on the new
+    # one before it is swapped in. The version is read before the rows,
+    # a write of another process in between only makes the next sync
+    # rebuild once more
+    name = model.__tablename__
+    with _sync_lock:
+        _applied_during_rebuild[name] = []
+    try:
+        fresh = NameIndex()
+        fresh.rebuild(db.session.query(model.id, model.name))
+    except BaseException:
+        with _sync_lock:
+            del _applied_during_rebuild[name]
+        raise
+    with _sync_lock:
+        built = {name: version}
+        for changes, bumped in _applied_during_rebuild.pop(name):
+            for id_, new_name in changes:
+                _apply(fresh, id_, new_name)
+            if bumped is not None:
+                built = followed_versions(built, {name: bumped})
+        index.replace(fresh)
+        _built_versions[name] = built[name]
+
+
+def rebuild_search_indexes():
+    """
+    Reload the venue, artist and genre name indexes from the database.
+
+    Returns:
+    sizes (tuple): number of indexed venues, artists and genres
+    """
+    versions = table_versions(_indexed_tables)
+    with _rebuild_lock:
+        for index, model in _indexed:
+            _rebuild(index, model, versions.get(model.__tablename__))
+    return len(venue_names), len(artist_names), len(genre_names)
+
+
+def sync_search_indexes():
+    """
+    Rebuild the name indexes whose tables changed since they were built.
+    Costs a single primary key query when none did.
+
+    Returns:
+    rebuilt (bool): whether any index was rebuilt
+    """
+    versions = table_versions(_indexed_tables)
+    stale = [(index, model) for index, model in _indexed
+             if _built_versions.get(model.__tablename__, -1) !=
+             versions.get(model.__tablename__)]
+    if not stale:
+        return False
+    with _rebuild_lock:
+        for index, model in stale:
+            name = model.__tablename__
+            # another thread may have caught up while this one waited
+            if _built_versions.get(name, -1) != versions.get(name):
+                _rebuild(index, model, versions.get(name))
+    return True
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_names(session, flush_context):
+    changes = []
+    for index, model in _indexed:
+        for obj in session.new | session.dirty:
+            if isinstance(obj, model):
+                changes.append((index, obj.id, obj.name))
+        for obj in session.deleted:
+            if isinstance(obj, model):
+                changes.append((index, obj.id, None))
+    if changes:
+        session.info.setdefault('search_index_pending', []).extend(changes)
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_names(session):
+    changes = session.info.pop('search_index_pending', ())
+    # see bump_committed_versions() in models.py
+    bumped = session.info.get('bumped_versions', {})
+    with _sync_lock:
+        for index, id_, name in changes:
+            _apply(index, id_, name)
+        for table_name, applied in _applied_during_rebuild.items():
+            applied.append(([(id_, name) for index, id_, name in changes
+                             if _table_names[index] == table_name],
+                            bumped.get(table_name)))
+        _built_versions.update(followed_versions(
+            _built_versions, {name: bumped[name] for name in _built_versions
+                              if name in bumped}))
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def discard_names(session, transaction):
+    # names of a transaction that did not commit are forgotten
+    if transaction.parent is None:
+        session.info.pop('search_index_pending', None)
@@ -0,0 +1,186 @@
+import datetime as dt
+
+from sqlalchemy import event, inspect
+
+from models import (db, Venues, Artists, Shows, ShowCountersState,
+                    bump_versions)
+
+#----------------------------------------------------------------------------#
+# Denormalized upcoming/past show counters of Venues and Artists.
+#----------------------------------------------------------------------------#
+
+# A show counts as past once it started before the rolled_over_at
+# watermark in ShowCountersState and as upcoming otherwise. ORM inserts,
+# updates and deletes of shows adjust the counters in their own
+# transaction; roll_over_show_counters() moves shows that started since
+# the last run from upcoming to past and is meant to run every minute or
+# so from a scheduler, e.g. the clock process of the Procfile. Bulk loads
+# that bypass the ORM must run verify_show_counters(fix=True) afterwards.
+# The migrations create the watermark. A database created otherwise, e.g.
+# with create_all, starts without shows and without one: every show counts
+# as upcoming until the first roll-over creates it.
+# Counter changes other than those of show writes bump the change counter
+# of ShowCountersState rather than those of Venues and Artists, which
+# would invalidate the name indexes and cached pages of every process.
+
+OWNERS = ((Venues, Shows.venue_id), (Artists, Shows.artist_id))
+# watermark of a database that was never rolled over
+EPOCH = dt.datetime(1970, 1, 1)
+# postgres advisory lock key serializing roll-overs against show writes
+ROLL_OVER_LOCK = 0x5e0c0de5
+
+
+def read_watermark(connection, exclusive=False):
+    """
+    Return the rolled_over_at watermark, EPOCH when there is none yet.
+    On postgres a shared advisory lock makes show writes wait for a
+    running roll-over without locking any row, exclusive=True takes the
+    exclusive one of the roll-over itself. Both are held until the
+    transaction ends.
+    """
+    if connection.dialect.name == 'postgresql':
+        lock = 'pg_advisory_xact_lock' if exclusive else \
+            'pg_advisory_xact_lock_shared'
+        connection.execute(db.select([getattr(db.func, lock)(ROLL_OVER_LOCK)]))
+    state = ShowCountersState.__table__
+    watermark = connection.execute(
+        db.select([state.c.rolled_over_at]).where(state.c.id == 1)).scalar()
+    return watermark or EPOCH
+
+
+def counter_column(start_time, watermark):
+    if start_time > watermark:
+        return 'upcoming_shows_count'
+    return 'past_shows_count'
+
+
+def adjust_counters(connection, *changes):
+    """
+    Apply (venue_id, artist_id, start_time, delta) changes of a show
+    written by the current statement to the counters.
+    """
+    watermark = read_watermark(connection)
+    for venue_id, artist_id, start_time, delta in changes:
+        column = counter_column(start_time, watermark)
+        for model, owner_id in ((Venues, venue_id), (Artists, artist_id)):
+            table = model.__table__
+            connection.execute(table.update().
+                               where(table.c.id == owner_id).
+                               values({column: table.c[column] + delta}))
+
+
+@event.listens_for(Shows, 'after_insert')
+def count_inserted_show(mapper, connection, show):
+    adjust_counters(connection, (show.venue_id, show.artist_id,
+                                 show.start_time, 1))
+
+
+@event.listens_for(Shows, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+    adjust_counters(connection, (show.venue_id, show.artist_id,
+                                 show.start_time, -1))
+
+
+@event.listens_for(Shows, 'after_update')
+def count_updated_show(mapper, connection, show):
+    state = inspect(show)
+    old = {}
+    for name in ('venue_id', 'artist_id', 'start_time'):
+        history = state.attrs[name].history
+        old[name] = history.deleted[0] if history.deleted else \
+            getattr(show, name)
+    if old == {'venue_id': show.venue_id, 'artist_id': show.artist_id,
+               'start_time': show.start_time}:
+        return
+    adjust_counters(connection,
+                    (old['venue_id'], old['artist_id'], old['start_time'], -1),
+                    (show.venue_id, show.artist_id, show.start_time, 1))
+
+
+def roll_over_show_counters(now=None):
+    """
+    Move shows that started since the last roll-over from the upcoming
+    to the past counters of their venues and artists.
+
+    Parameters:
+    now (datetime): new watermark, utcnow by default
+
+    Returns:
+    rolled (int): number of shows moved
+    """
+    now = now or dt.datetime.utcnow()
+    connection = db.session.connection()
+    watermark = read_watermark(connection, exclusive=True)
+    state = ShowCountersState.__table__
+    if now <= watermark:
+        db.session.rollback()
+        return 0
+
+    started = db.and_(Shows.start_time > watermark, Shows.start_time <= now)
+    rolled = connection.execute(
+        db.select([db.func.count(Shows.id)]).where(started)).scalar()
+    if rolled:
+        for model, owner_column in OWNERS:
+            table = model.__table__
+            num_started = db.select([db.func.count(Shows.id)]).\
+                where(db.and_(owner_column == table.c.id, started)).\
+                as_scalar()
+            connection.execute(
+                table.update().
+                where(table.c.id.in_(db.select([owner_column]).where(started))).
+                values(upcoming_shows_count=table.c.upcoming_shows_count - num_started,
+                       past_shows_count=table.c.past_shows_count + num_started))
+        bump_versions(connection, [ShowCountersState.__tablename__])
+    if not connection.execute(state.update().where(state.c.id == 1).
+                              values(rolled_over_at=now)).rowcount:
+        connection.execute(state.insert().values(id=1, rolled_over_at=now))
+    db.session.commit()
+    return rolled
+
+
+def verify_show_counters(fix=False):
+    """
+    Recompute the show counters of all venues and artists from Shows
+    and compare them with the stored ones.
+
+    Parameters:
+    fix (bool): overwrite drifted counters with the recomputed values
+
+    Returns:
+    drift (list): list of (table name, id, stored (upcoming, past),
+                  actual (upcoming, past)) tuples
+    """
+    connection = db.session.connection()
+    watermark = read_watermark(connection, exclusive=fix)
+    upcoming = Shows.start_time > watermark
+
+    drift = []
+    for model, owner_column in OWNERS:
+        actual_qry = db.session.query(
+            model.id,
+            model.upcoming_shows_count,
+            model.past_shows_count,
+            db.func.count(db.case([(upcoming, Shows.id)])),
+            db.func.count(db.case([(db.not_(upcoming), Shows.id)]))).\
+            outerjoin(Shows, owner_column == model.id).\
+            group_by(model.id, model.upcoming_shows_count,
+                     model.past_shows_count)
+        for id_, stored_upcoming, stored_past, actual_upcoming, actual_past \
+                in actual_qry:
+            if (stored_upcoming, stored_past) != (actual_upcoming, actual_past):
+                drift.append((model.__tablename__, id_,
+                              (stored_upcoming, stored_past),
+                              (actual_upcoming, actual_past)))
+
+    if fix and drift:
+        for table_name, id_, stored, actual in drift:
+            table = db.metadata.tables[table_name]
+            connection.execute(table.update().where(table.c.id == id_).
+                               values(upcoming_shows_count=actual[0],
+                                      past_shows_count=actual[1]))
+        bump_versions(connection, [ShowCountersState.__tablename__])
+    if fix:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return drift
@@ -0,0 +1,204 @@
+import datetime as dt
+import json
+import logging
+import re
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from models import db
+
+#----------------------------------------------------------------------------#
+# Slow query log.
+#----------------------------------------------------------------------------#
+
+# Statements on the models.db engine running longer than
+# SLOW_QUERY_THRESHOLD_MS are written as one JSON object per line to the
+# 'fyyur.slow_queries' logger, together with their parameters, the route
+# that issued them and the query plan. Parameters carry form input, so
+# only their types are logged unless SLOW_QUERY_LOG_PARAMETERS is set,
+# and then cut to PARAMETER_MAX_LENGTH characters. At most
+# SLOW_QUERY_MAX_PER_MINUTE records are written per process and minute;
+# the number of dropped records is reported with the next written one.
+
+logger = logging.getLogger('fyyur.slow_queries')
+
+PARAMETER_MAX_LENGTH = 64
+
+# clauses and functions that make a SELECT write or lock
+WRITING_SELECT = re.compile(r'\bINTO\b|\bFOR\s+(NO\s+KEY\s+)?(UPDATE|SHARE)\b|'
+                            r'\bFOR\s+KEY\s+SHARE\b|\b(nextval|setval)\s*\(',
+                            re.IGNORECASE)
+
+
+def is_plain_select(statement):
+    """
+    Tell whether statement only reads, so that EXPLAIN ANALYZE may run it
+    a second time. Statements starting with WITH are never plain, their
+    CTEs may modify data.
+    """
+    return (statement.lstrip()[:6].upper() == 'SELECT' and
+            not WRITING_SELECT.search(statement))
+
+
+def loggable_parameters(parameters, executemany=False, with_values=False):
+    """
+    Return the parameters of a statement as they are logged: the type
+    names of the values, or with_values the values with strings cut to
+    PARAMETER_MAX_LENGTH characters; of an executemany the first row and
+    the number of rows.
+    """
+    if executemany:
+        return {'rows': len(parameters),
+                'first': loggable_parameters(parameters[0], False, with_values)
+                if parameters else None}
+
+    def loggable(value):
+        if not with_values:
+            return type(value).__name__
+        if isinstance(value, (str, bytes)) and len(value) > PARAMETER_MAX_LENGTH:
+            return f'{value[:PARAMETER_MAX_LENGTH]}... ({len(value)} long)'
+        return value
+    if isinstance(parameters, dict):
+        return {key: loggable(value) for key, value in parameters.items()}
+    return [loggable(value) for value in parameters or ()]
+
+
+class RateLimit:
+    """Allow at most limit events per period seconds."""
+
+    def __init__(self, limit, period=60.0):
+        self.limit = limit
+        self.period = period
+        self._lock = threading.Lock()
+        self._window_start = 0.0
+        self._allowed = 0
+        self._suppressed = 0
+
+    def acquire(self):
+        """
+        Return (allowed, suppressed) where suppressed is the number of
+        events dropped since the last allowed one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= self.period:
+                self._window_start = now
+                self._allowed = 0
+            if self._allowed >= self.limit:
+                self._suppressed += 1
+                return False, 0
+            self._allowed += 1
+            suppressed, self._suppressed = self._suppressed, 0
+            return True, suppressed
+
+
+def explain(conn, statement, parameters, analyze=False):
+    """
+    Return the query plan of a statement, run on the raw connection so
+    that it neither shows up in the query stats nor logs itself.
+    ANALYZE is only used for plain SELECTs, it executes the statement
+    again.
+    """
+    dbapi_conn = conn.connection
+    cursor = dbapi_conn.cursor()
+    try:
+        if conn.dialect.name == 'postgresql':
+            options = 'ANALYZE, BUFFERS, ' if analyze else ''
+            # a failing EXPLAIN must not abort the request's transaction
+            cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute(f'EXPLAIN ({options}FORMAT TEXT) ' + statement,
+                               parameters)
+                plan = [row[0] for row in cursor.fetchall()]
+            except Exception:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                raise
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return plan
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [' '.join(str(col) for col in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def instrument_engine(engine, threshold_ms, with_explain=True, analyze=False,
+                      max_per_minute=60, log_parameters=False):
+    """attach the slow query listeners to engine once"""
+    # marked on the engine itself, the id of a dropped engine can be reused
+    if getattr(engine, '_fyyur_slow_queries', False):
+        return
+    rate_limit = RateLimit(max_per_minute)
+
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start_time', []).\
+            append(time.perf_counter())
+
+    def log_slow_query(conn, cursor, statement, parameters, context,
+                       executemany):
+        duration_ms = (time.perf_counter() -
+                       conn.info['slow_query_start_time'].pop()) * 1000
+        if duration_ms < threshold_ms:
+            return
+        allowed, suppressed = rate_limit.acquire()
+        if not allowed:
+            return
+
+        record = {
+            'time': dt.datetime.utcnow().isoformat(),
+            'duration_ms': round(duration_ms, 2),
+            'statement': statement,
+            'parameters': loggable_parameters(parameters, executemany,
+                                              log_parameters),
+            'executemany': executemany,
+            'endpoint': None,
+        }
+        if has_request_context():
+            record.update(endpoint=request.endpoint, method=request.method,
+                          path=request.full_path.rstrip('?'))
+        if with_explain and not executemany:
+            try:
+                record['plan'] = explain(
+                    conn, statement, parameters,
+                    analyze=analyze and is_plain_select(statement))
+            except Exception as exc:
+                record['plan_error'] = str(exc)
+        if suppressed:
+            record['suppressed'] = suppressed
+        logger.warning(json.dumps(record, default=str))
+
+    event.listen(engine, 'before_cursor_execute', start_timer)
+    event.listen(engine, 'after_cursor_execute', log_slow_query)
+    engine._fyyur_slow_queries = True
+
+
+def init_app(app):
+    """
+    Log slow statements of the app's engine as JSON lines.
+
+    Config:
+    SLOW_QUERY_THRESHOLD_MS (float): duration from which a statement is
+                                     logged, 0 disables the log
+    SLOW_QUERY_EXPLAIN (bool): add the query plan to every record
+    SLOW_QUERY_ANALYZE (bool): use EXPLAIN ANALYZE for plain SELECTs on
+                               postgres
+    SLOW_QUERY_LOG_PARAMETERS (bool): log parameter values, cut to
+                                      PARAMETER_MAX_LENGTH characters,
+                                      rather than their types
+    SLOW_QUERY_MAX_PER_MINUTE (int): records written per minute at most
+
+    The records are written to SLOW_QUERY_LOG by logging_setup.init_app.
+    """
+    threshold_ms = app.config.get('SLOW_QUERY_THRESHOLD_MS', 0)
+    if not threshold_ms:
+        return
+
+    @app.before_request
+    def instrument_slow_queries():
+        instrument_engine(db.engine, threshold_ms,
+                          app.config.get('SLOW_QUERY_EXPLAIN', True),
+                          app.config.get('SLOW_QUERY_ANALYZE', False),
+                          app.config.get('SLOW_QUERY_MAX_PER_MINUTE', 60),
+                          app.config.get('SLOW_QUERY_LOG_PARAMETERS', False))
@@ -0,0 +1,274 @@
+import os
+import re
+import shutil
+import sqlite3
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+from models import (db, Venues, Artists, Genres, Areas, Shows, ChangeCounters,
+                    VenuesGenresJunction, ArtistsGenresJunction, BULK_LOADS,
+                    bump_versions, table_versions)
+
+#----------------------------------------------------------------------------#
+# Fast reset and snapshots of the Fyyur dataset.
+#----------------------------------------------------------------------------#
+
+# reset_tables() empties the data tables with a single TRUNCATE on
+# postgres. Snapshots save the whole database under a name and restore
+# it in seconds, for benchmark runs that have to start from a known
+# dataset:
+#   'template'  postgres, copies the database with CREATE DATABASE ...
+#               TEMPLATE; needs the CREATEDB privilege and closes all
+#               other connections to the database
+#   'dump'      postgres, COPY of every table to CSV files in
+#               SNAPSHOT_DIR from one REPEATABLE READ transaction, so
+#               writes during the dump are left out of every table
+#               alike; reloaded with COPY
+#   'file'      sqlite, copy of the database file in SNAPSHOT_DIR
+# A reset or restore bumps the change counters of every table and of
+# bulk loads past the versions they had before, even where the restored
+# counters are older, so no ETag or cached page handed out before
+# matches the new data. Other running processes see the new versions
+# with their next cache sync (see cache_sync.py) and rebuild their
+# in-memory indexes and caches.
+
+DATA_TABLES = (Shows.__table__, VenuesGenresJunction, ArtistsGenresJunction,
+               Venues.__table__, Artists.__table__, Genres.__table__,
+               Areas.__table__)
+
+
+def reset_tables():
+    """
+    Delete all venues, artists, shows, genres and areas and restart
+    their ids.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        names = ', '.join(f'"{table.name}"' for table in DATA_TABLES)
+        connection.execute(f'TRUNCATE {names} RESTART IDENTITY')
+    else:
+        # DATA_TABLES lists referencing tables first
+        for table in DATA_TABLES:
+            connection.execute(table.delete())
+    bump_versions(connection, [BULK_LOADS] + [table.name for table in DATA_TABLES])
+    db.session.commit()
+
+
+def default_method():
+    return 'template' if db.engine.dialect.name == 'postgresql' else 'file'
+
+
+def snapshot_database(name):
+    if not re.fullmatch(r'[A-Za-z0-9_-]*', name):
+        raise ValueError(f'invalid snapshot name {name!r}')
+    return f'{db.engine.url.database}__snapshot_{name}'
+
+
+def admin_engine():
+    """engine on the maintenance database, for CREATE/DROP DATABASE"""
+    url = make_url(str(db.engine.url))
+    url.database = 'postgres'
+    return create_engine(url, isolation_level='AUTOCOMMIT')
+
+
+def close_connections(conn, database):
+    db.session.remove()
+    db.engine.dispose()
+    conn.execute(db.text(
+        'SELECT pg_terminate_backend(pid) FROM pg_stat_activity '
+        'WHERE datname = :database AND pid <> pg_backend_pid()'),
+        database=database)
+
+
+def copy_database(source, target, replace=False):
+    engine = admin_engine()
+    try:
+        with engine.connect() as conn:
+            close_connections(conn, source)
+            if replace:
+                close_connections(conn, target)
+                conn.execute(f'DROP DATABASE IF EXISTS "{target}"')
+            conn.execute(f'CREATE DATABASE "{target}" TEMPLATE "{source}"')
+    finally:
+        engine.dispose()
+
+
+def sqlite_path():
+    path = db.engine.url.database
+    if not path or path == ':memory:':
+        raise ValueError('in-memory sqlite databases cannot be snapshotted')
+    return path
+
+
+def snapshot_path(snapshot_dir, name):
+    if not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+        raise ValueError(f'invalid snapshot name {name!r}')
+    return os.path.join(snapshot_dir, name)
+
+
+def dump_tables(directory):
+    os.makedirs(directory, exist_ok=True)
+    # all tables are read from the same snapshot of the database; under
+    # READ COMMITTED every COPY would see the writes committed since the
+    # one before, e.g. shows of venues missing from the venues file
+    with db.engine.connect() as connection, connection.begin():
+        connection.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ '
+                           'READ ONLY')
+        cursor = connection.connection.cursor()
+        try:
+            for table in db.metadata.sorted_tables:
+                with open(os.path.join(directory, f'{table.name}.csv'), 'w',
+                          encoding='utf-8') as f:
+                    cursor.copy_expert(f'COPY "{table.name}" TO STDOUT '
+                                       f'WITH (FORMAT csv, HEADER)', f)
+        finally:
+            cursor.close()
+
+
+def load_tables(directory):
+    connection = db.session.connection()
+    tables = db.metadata.sorted_tables
+    names = ', '.join(f'"{table.name}"' for table in tables)
+    connection.execute(f'TRUNCATE {names} RESTART IDENTITY')
+    # the dump has the search vectors already
+    connection.execute("SET LOCAL fyyur.bulk_load = 'on'")
+    cursor = connection.connection.cursor()
+    try:
+        for table in tables:
+            with open(os.path.join(directory, f'{table.name}.csv'),
+                      encoding='utf-8') as f:
+                header = f.readline().strip()
+                cursor.copy_expert(f'COPY "{table.name}" ({header}) '
+                                   f'FROM STDIN WITH (FORMAT csv)', f)
+    finally:
+        cursor.close()
+    for table in tables:
+        id_column = table.c.get('id')
+        if id_column is not None and id_column.primary_key and \
+                isinstance(id_column.type, db.Integer):
+            connection.execute(
+                f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', "
+                f"'id'), coalesce(max(id), 1), max(id) IS NOT NULL) "
+                f"FROM \"{table.name}\"")
+    db.session.commit()
+
+
+def create_snapshot(name, method=None, snapshot_dir='snapshots'):
+    """
+    Save the current database as snapshot name, replacing an older
+    snapshot of the same name.
+
+    Parameters:
+    name (String): snapshot name
+    method (String): 'template', 'dump' or 'file', see above
+    snapshot_dir (String): directory of 'dump' and 'file' snapshots
+    """
+    method = method or default_method()
+    if method == 'template':
+        copy_database(db.engine.url.database, snapshot_database(name),
+                      replace=True)
+    elif method == 'dump':
+        path = snapshot_path(snapshot_dir, name)
+        shutil.rmtree(path, ignore_errors=True)
+        dump_tables(path)
+    elif method == 'file':
+        os.makedirs(snapshot_dir, exist_ok=True)
+        db.session.remove()
+        db.engine.dispose()
+        source = sqlite3.connect(sqlite_path())
+        target = sqlite3.connect(snapshot_path(snapshot_dir, name) + '.db')
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    else:
+        raise ValueError(f'unknown snapshot method {method}')
+
+
+def restore_snapshot(name, method=None, snapshot_dir='snapshots'):
+    """
+    Replace the current database with snapshot name.
+
+    Parameters:
+    name (String): snapshot name
+    method (String): method the snapshot was created with
+    snapshot_dir (String): directory of 'dump' and 'file' snapshots
+    """
+    method = method or default_method()
+    names = [BULK_LOADS] + [table.name for table in db.metadata.sorted_tables
+                            if table.name != 'ChangeCounters']
+    previous = table_versions(names)
+    db.session.rollback()
+    if method == 'template':
+        copy_database(snapshot_database(name), db.engine.url.database,
+                      replace=True)
+    elif method == 'dump':
+        load_tables(snapshot_path(snapshot_dir, name))
+    elif method == 'file':
+        db.session.remove()
+        db.engine.dispose()
+        source = sqlite3.connect(snapshot_path(snapshot_dir, name) + '.db')
+        target = sqlite3.connect(sqlite_path())
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    else:
+        raise ValueError(f'unknown snapshot method {method}')
+    # the counters carry on from where they were rather than from the
+    # snapshot, a process that built a cache at some version never sees
+    # that version again
+    bump_versions(db.session, names)
+    counters = ChangeCounters.__table__
+    for table_name, (version, _) in previous.items():
+        db.session.execute(counters.update().
+                           where(counters.c.name == table_name).
+                           where(counters.c.version <= version).
+                           values(version=version + 1))
+    db.session.commit()
+
+
+def list_snapshots(snapshot_dir='snapshots'):
+    """
+    Return (name, method) of the existing snapshots.
+    """
+    snapshots = []
+    if db.engine.dialect.name == 'postgresql':
+        prefix = snapshot_database('')
+        engine = admin_engine()
+        try:
+            with engine.connect() as conn:
+                for database, in conn.execute(
+                        db.text('SELECT datname FROM pg_database '
+                                'WHERE left(datname, length(:prefix)) = '
+                                ':prefix ORDER BY datname'), prefix=prefix):
+                    snapshots.append((database[len(prefix):], 'template'))
+        finally:
+            engine.dispose()
+    if os.path.isdir(snapshot_dir):
+        for entry in sorted(os.listdir(snapshot_dir)):
+            if os.path.isdir(os.path.join(snapshot_dir, entry)):
+                snapshots.append((entry, 'dump'))
+            elif entry.endswith('.db'):
+                snapshots.append((entry[:-3], 'file'))
+    return snapshots
+
+
+def drop_snapshot(name, method=None, snapshot_dir='snapshots'):
+    """delete snapshot name"""
+    method = method or default_method()
+    if method == 'template':
+        engine = admin_engine()
+        try:
+            with engine.connect() as conn:
+                conn.execute(f'DROP DATABASE IF EXISTS '
+                             f'"{snapshot_database(name)}"')
+        finally:
+            engine.dispose()
+    elif method == 'dump':
+        shutil.rmtree(snapshot_path(snapshot_dir, name))
+    else:
+        os.remove(snapshot_path(snapshot_dir, name) + '.db')
@@ -2,3 +2,26 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// typeahead for the navbar search boxes, filled from /search/suggest
+document.querySelectorAll('input[data-suggest]').forEach(function (input) {
+  var list = document.getElementById(input.getAttribute('list'));
+  var kind = input.getAttribute('data-suggest');
+  var pending = null;
+  input.addEventListener('input', function () {
+    clearTimeout(pending);
+    pending = setTimeout(function () {
+      if (!input.value) { list.innerHTML = ''; return; }
+      fetch('/search/suggest?q=' + encodeURIComponent(input.value))
+        .then(function (response) { return response.json(); })
+        .then(function (suggestions) {
+          list.innerHTML = '';
+          suggestions[kind].concat(suggestions.genres).forEach(function (item) {
+            var option = document.createElement('option');
+            option.value = item.name || item;
+            list.appendChild(option);
+          });
+        });
+    }, 100);
+  });
+});
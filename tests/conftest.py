@@ -0,0 +1,48 @@
+import pytest
+
+from app import create_app
+from models import db
+
+
+@pytest.fixture
+def app():
+    app = create_app('test')
+    # never a DATABASE_URL from the environment, the tables are dropped
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def listing(app):
+    """
+    Two venues and two artists in one area; venue i has an upcoming show
+    of artist i. Returns the ids by name.
+    """
+    from datetime import datetime, timedelta
+    from models import Areas, Artists, Genres, Shows, Venues
+
+    genre = Genres(name='Jazz')
+    area = Areas(city='San Francisco', state='CA')
+    venues = [Venues(name=f'Venue {i}', area=area, genres=[genre])
+              for i in (1, 2)]
+    artists = [Artists(name=f'Artist {i}', city='San Francisco', state='CA',
+                       genres=[genre])
+               for i in (1, 2)]
+    start_time = datetime.utcnow() + timedelta(days=30)
+    shows = [Shows(venue=venue, artist=artist, start_time=start_time)
+             for venue, artist in zip(venues, artists)]
+    db.session.add_all(venues + artists + shows)
+    db.session.commit()
+    ids = {str(obj): obj.id for obj in venues + artists}
+    ids.update({f'Show {i}': show.id for i, show in enumerate(shows, 1)})
+    db.session.remove()
+    return ids
@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def benchmark(monkeypatch):
+    # the scripts of db_utils import each other as top-level modules and
+    # build the module level app on import
+    monkeypatch.setenv('FYYUR_CONFIG', 'test')
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    monkeypatch.syspath_prepend(os.path.join(os.path.dirname(__file__), '..',
+                                             'db_utils'))
+    import benchmark
+    return benchmark
+
+
+def test_benchmark_runs_on_the_bench_database_only(benchmark):
+    bench = {'FYYUR_CONFIG': 'bench'}
+    assert benchmark.wipe_refusal(environ=bench) is None
+    assert benchmark.wipe_refusal(environ={'FYYUR_CONFIG': 'dev'})
+    assert benchmark.wipe_refusal(environ={})
+
+
+def test_benchmark_refuses_a_database_url_overriding_bench(benchmark):
+    environ = {'FYYUR_CONFIG': 'bench', 'DATABASE_URL': 'sqlite:///fyyur.db'}
+    assert 'DATABASE_URL' in benchmark.wipe_refusal(environ=environ)
+    assert benchmark.wipe_refusal(yes=True, environ=environ) is None
+    assert benchmark.wipe_refusal('sqlite:///other.db', environ=environ) is None
@@ -0,0 +1,37 @@
+from bulk_import import import_file
+from models import db, Artists, Shows, Venues, BULK_LOADS, table_versions
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_source_ids_are_kept_for_shows_to_refer_to(app, tmp_path):
+    venues = write(tmp_path, 'venues.csv',
+                   'id,name,city,state,genres\n'
+                   '40,The Musical Hop,San Francisco,CA,Jazz;Swing\n'
+                   ',Park Square,Oakland,CA,\n'
+                   '40,The Dueling Pianos,New York,NY,\n')
+    artists = write(tmp_path, 'artists.ndjson',
+                    '{"id": 7, "name": "Guns N Petals", "genres": ["Rock"]}\n')
+    shows = write(tmp_path, 'shows.csv',
+                  'venue_id,artist_id,start_time\n'
+                  '40,7,2035-01-01 20:00\n')
+
+    report = import_file('venues', venues)
+    assert report.loaded == 2
+    assert report.errors == [(4, 'venue 40 already exists')]
+    assert db.session.query(Venues).get(40).name == 'The Musical Hop'
+    assert db.session.query(Venues.id).filter_by(name='Park Square').scalar() == 41
+    assert import_file('artists', artists).loaded == 1
+    assert db.session.query(Artists).get(7).name == 'Guns N Petals'
+    # new venues and artists leave the pages of the existing ones alone
+    assert BULK_LOADS not in table_versions([BULK_LOADS])
+
+    report = import_file('shows', shows)
+    assert (report.loaded, report.errors) == (1, [])
+    show = db.session.query(Shows).one()
+    assert (show.venue_id, show.artist_id) == (40, 7)
+    assert BULK_LOADS in table_versions([BULK_LOADS])
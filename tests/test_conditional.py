@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from werkzeug.http import http_date
+
+from models import db, Areas, ChangeCounters, Venues, bump_versions
+
+
+def add_venue(name):
+    db.session.add(Venues(name=name, area=Areas(city='Oakland', state='CA')))
+    db.session.commit()
+
+
+def test_matching_etag_answers_304(client, listing):
+    response = client.get('/venues')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    response = client.get('/venues', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+
+def test_writes_change_the_etag(client, listing):
+    etag = client.get('/venues').headers['ETag']
+    add_venue('The Jazz Cellar')
+    response = client.get('/venues', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert b'The Jazz Cellar' in response.data
+
+
+def test_unrelated_writes_keep_the_etag_of_a_venue_page(client, listing):
+    url = f'/venues/{listing["Venue 1"]}'
+    etag = client.get(url).headers['ETag']
+    add_venue('The Jazz Cellar')
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+
+def age_versions(seconds):
+    db.session.execute(ChangeCounters.__table__.update().values(
+        updated_at=datetime.utcnow() - timedelta(seconds=seconds)))
+    db.session.commit()
+
+
+def test_if_modified_since_answers_304(client, listing):
+    age_versions(10)
+    response = client.get('/venues')
+    last_modified = response.last_modified
+    assert last_modified is not None
+
+    since = {'If-Modified-Since': http_date(last_modified)}
+    assert client.get('/venues', headers=since).status_code == 304
+    earlier = {'If-Modified-Since': http_date(last_modified - timedelta(seconds=1))}
+    assert client.get('/venues', headers=earlier).status_code == 200
+
+    add_venue('The Jazz Cellar')
+    assert client.get('/venues', headers=since).status_code == 200
+
+
+def test_no_last_modified_within_the_second_of_a_write(client, listing):
+    # a second write within that second would not move it
+    assert client.get('/venues').last_modified is None
+
+
+def test_etag_takes_precedence_over_if_modified_since(client, listing):
+    age_versions(10)
+    response = client.get('/venues')
+    headers = {'If-None-Match': '"stale"',
+               'If-Modified-Since': http_date(response.last_modified)}
+    assert client.get('/venues', headers=headers).status_code == 200
+
+
+def test_bump_skips_a_counter_row_created_meanwhile(app):
+    # another transaction creates the row after the update missed it
+    created = []
+
+    def create_row(conn, cursor, statement, parameters, context, executemany):
+        if 'INSERT' in statement and '"ChangeCounters"' in statement \
+                and not created:
+            created.append(True)
+            cursor.execute('INSERT INTO "ChangeCounters" (name, version, '
+                           'updated_at) VALUES (?, 5, ?)',
+                           ('Venues:42', str(datetime.utcnow())))
+
+    event.listen(db.engine, 'before_cursor_execute', create_row)
+    try:
+        versions = bump_versions(db.session, ['Venues:42'])
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', create_row)
+    assert versions['Venues:42'][0] == 6
+    assert db.session.query(ChangeCounters).get('Venues:42').version == 6
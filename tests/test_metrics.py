@@ -0,0 +1,102 @@
+import pytest
+
+
+@pytest.fixture
+def token(app):
+    app.config['METRICS_TOKEN'] = 'scraper-secret'
+    return 'scraper-secret'
+
+
+def test_metrics_are_disabled_without_a_token(client):
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_need_the_token(client, token):
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={
+        'Authorization': 'Bearer wrong'}).status_code == 404
+
+    client.get('/venues')
+    response = client.get('/metrics', headers={
+        'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    assert b'fyyur_requests_total{endpoint="fyyur.venues"' in response.data
+    assert b'fyyur_pool_connection_held_seconds_count' in response.data
+    assert b'fyyur_pool_checkout_wait_seconds' in response.data
+    assert 'pool;dur=' in response.headers['Server-Timing']
+
+
+def test_checkout_waits_on_an_exhausted_pool(app):
+    import sqlite3
+    import threading
+    from flask import g
+    from metrics import POOL_WAIT, TimedQueuePool
+
+    pool = TimedQueuePool(lambda: sqlite3.connect(':memory:',
+                                                  check_same_thread=False),
+                          pool_size=1, max_overflow=0, timeout=5)
+    held = pool.connect()
+    threading.Timer(0.2, held.close).start()
+    count_before = POOL_WAIT._values.get((), [0, 0])[-2]
+    with app.test_request_context():
+        connection = pool.connect()
+        connection.close()
+        assert g.pool_wait >= 0.2
+    assert POOL_WAIT._values[()][-2] == count_before + 1
+    pool.dispose()
+
+
+def test_postgres_engines_use_the_timed_pool(app):
+    from flask import Flask
+    from metrics import TimedQueuePool, use_timed_pool
+
+    assert 'poolclass' not in app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    postgres_app = Flask(__name__)
+    postgres_app.config['SQLALCHEMY_DATABASE_URI'] = \
+        'postgresql://fyyur@localhost/fyyur'
+    use_timed_pool(postgres_app)
+    options = postgres_app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert options['poolclass'] is TimedQueuePool
+
+
+def test_dropped_log_records_are_counted(tmp_path):
+    import logging_setup
+    from app import create_app
+    from config import TestConfig
+    from models import db
+
+    class LogConfig(TestConfig):
+        ACCESS_LOG = str(tmp_path / 'access.log')
+        LOG_QUEUE_SIZE = 2
+        METRICS_TOKEN = 'scraper-secret'
+
+    app = create_app(LogConfig)
+    # nothing takes the records off the queue any more
+    logging_setup.stop_listener()
+    for i in range(5):
+        logging_setup.access_logger.info('line %d', i)
+    with app.app_context():
+        db.create_all()
+        response = app.test_client().get('/metrics', headers={
+            'Authorization': 'Bearer scraper-secret'})
+        db.session.remove()
+        db.drop_all()
+    assert b'# TYPE fyyur_log_records_dropped_total counter' in response.data
+    assert b'fyyur_log_records_dropped_total 3\n' in response.data
+
+
+def test_new_apps_take_over_the_log_handlers(tmp_path):
+    import logging_setup
+    from app import create_app
+    from config import TestConfig
+
+    class LogConfig(TestConfig):
+        ERROR_LOG = str(tmp_path / 'error.log')
+
+    for _ in range(3):
+        app = create_app(LogConfig)
+    for logger in (app.logger, logging_setup.access_logger):
+        handlers = [handler for handler in logger.handlers
+                    if isinstance(handler, logging_setup.DroppingQueueHandler)]
+        assert handlers == [app.extensions['log_queue_handler']]
+    logging_setup.stop_listener()
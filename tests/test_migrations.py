@@ -0,0 +1,40 @@
+import importlib.util
+import os
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from models import db, Areas, Venues
+
+VERSIONS = os.path.join(os.path.dirname(__file__), '..', 'migrations',
+                        'versions')
+
+
+def load_migration(revision):
+    path = os.path.join(VERSIONS, f'{revision}_.py')
+    spec = importlib.util.spec_from_file_location(revision, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_area_merge_keeps_venues_of_areas_without_a_city(app):
+    # the tables as they were before the unique indexes
+    db.session.execute('DROP INDEX "ix_Areas_lower_city_state"')
+    db.session.execute('DROP INDEX "ix_Genres_lower_name"')
+    areas = [Areas(city=None, state='CA'), Areas(city=None, state='ca'),
+             Areas(city='Oakland', state='CA'),
+             Areas(city='OAKLAND', state='CA')]
+    db.session.add_all([Venues(name=f'Venue {i}', area=area)
+                        for i, area in enumerate(areas)])
+    db.session.commit()
+
+    connection = db.session.connection()
+    with Operations.context(MigrationContext.configure(connection)):
+        load_migration('7e25c1b9d046').upgrade()
+    db.session.commit()
+
+    assert db.session.query(Areas.id).order_by(Areas.id).all() == \
+        [(areas[0].id,), (areas[2].id,)]
+    assert sorted(area_id for area_id, in db.session.query(Venues.area_id)) == \
+        [areas[0].id, areas[0].id, areas[2].id, areas[2].id]
@@ -0,0 +1,76 @@
+import pytest
+
+from instrumentation import count_queries
+from models import db, Shows
+from page_cache import page_cache
+
+
+@pytest.fixture
+def client(app):
+    app.config['PAGE_CACHE_BACKEND'] = 'lru'
+    page_cache.init_app(app)
+    return app.test_client()
+
+
+def page_is_cached(client, url):
+    # a cached page costs the version lookup of conditional() alone
+    with count_queries() as stats:
+        assert client.get(url).status_code == 200
+    return stats.count == 1
+
+
+def venue_form(name, **fields):
+    return dict({'name': name, 'address': '', 'phone': '', 'genres': 'Jazz',
+                 'city': 'San Francisco', 'state': 'CA', 'facebook_link': ''},
+                **fields)
+
+
+def artist_form(name, **fields):
+    return dict({'name': name, 'city': 'San Francisco', 'state': 'CA',
+                 'phone': '', 'genres': 'Jazz', 'facebook_link': ''},
+                **fields)
+
+
+def test_unrelated_writes_keep_pages_cached(client, listing):
+    url = f'/venues/{listing["Venue 1"]}'
+    client.get(url)
+    assert page_is_cached(client, url)
+
+    client.post(f'/venues/{listing["Venue 2"]}/edit',
+                data=venue_form('Venue 2 renamed'))
+    client.post(f'/artists/{listing["Artist 2"]}/edit',
+                data=artist_form('Artist 2 renamed'))
+    client.post('/shows/create', data={'venue_id': listing['Venue 2'],
+                                       'artist_id': listing['Artist 2'],
+                                       'start_time': '2031-01-01 20:00:00'})
+    assert page_is_cached(client, url)
+
+
+def test_writes_to_the_venue_evict_its_page(client, listing):
+    url = f'/venues/{listing["Venue 1"]}'
+    client.get(url)
+    client.post(url + '/edit', data=venue_form('Venue 1 renamed'))
+    assert not page_is_cached(client, url)
+    assert b'Venue 1 renamed' in client.get(url).data
+
+
+def test_renaming_an_artist_evicts_the_pages_of_its_venues(client, listing):
+    url = f'/venues/{listing["Venue 1"]}'
+    client.get(url)
+    client.post(f'/artists/{listing["Artist 1"]}/edit',
+                data=artist_form('Artist 1 renamed'))
+    assert not page_is_cached(client, url)
+    assert b'Artist 1 renamed' in client.get(url).data
+
+
+def test_moving_a_show_evicts_the_pages_of_both_venues(client, listing):
+    urls = [f'/venues/{listing["Venue 1"]}', f'/venues/{listing["Venue 2"]}',
+            f'/artists/{listing["Artist 1"]}']
+    for url in urls:
+        client.get(url)
+
+    show = Shows.query.get(listing['Show 1'])
+    show.venue_id = listing['Venue 2']
+    db.session.commit()
+
+    assert [page_is_cached(client, url) for url in urls] == [False, False, False]
@@ -0,0 +1,27 @@
+import pytest
+
+
+@pytest.fixture
+def profile_dir(app, tmp_path):
+    app.config['PROFILE_TOKEN'] = 'secret'
+    app.config['PROFILE_DIR'] = str(tmp_path)
+    return tmp_path
+
+
+def test_profile_token_header_writes_pstats(client, profile_dir):
+    assert client.get('/', headers={'X-Profile': 'secret'}).status_code == 200
+    files = list(profile_dir.glob('*.pstats'))
+    assert len(files) == 1
+    assert files[0].name.startswith('fyyur.index-GET-')
+
+
+@pytest.mark.parametrize('url, headers', [
+    ('/', {}),
+    ('/', {'X-Profile': 'wrong'}),
+    ('/?X-Profile=secret', {}),
+    ('/?profile=secret', {}),
+])
+def test_requests_without_profile_token_write_nothing(client, profile_dir,
+                                                      url, headers):
+    assert client.get(url, headers=headers).status_code == 200
+    assert not list(profile_dir.iterdir())
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from instrumentation import count_queries, assert_max_queries
+from models import db, Artists, Shows, Venues
+
+
+def add_shows(venue_id, artist_id, num_shows):
+    # half of them past, half upcoming
+    now = datetime.utcnow()
+    db.session.add_all([Shows(venue_id=venue_id, artist_id=artist_id,
+                              start_time=now + timedelta(days=i - num_shows // 2,
+                                                         hours=1))
+                        for i in range(num_shows)])
+    db.session.commit()
+
+
+@pytest.fixture
+def warm_client(client, listing):
+    # the first request of the app builds the search indexes
+    client.get('/')
+    return client
+
+
+def test_venue_page_query_count_does_not_grow_with_shows(client, listing):
+    venue_id = listing['Venue 1']
+    with count_queries() as stats:
+        assert client.get(f'/venues/{venue_id}').status_code == 200
+
+    add_shows(venue_id, listing['Artist 1'], 20)
+    add_shows(venue_id, listing['Artist 2'], 20)
+    with assert_max_queries(stats.count):
+        response = client.get(f'/venues/{venue_id}')
+    assert response.status_code == 200
+    assert b'Artist 2' in response.data
+
+
+def test_artist_page_query_count_does_not_grow_with_shows(client, listing):
+    artist_id = listing['Artist 1']
+    with count_queries() as stats:
+        assert client.get(f'/artists/{artist_id}').status_code == 200
+
+    add_shows(listing['Venue 1'], artist_id, 20)
+    add_shows(listing['Venue 2'], artist_id, 20)
+    with assert_max_queries(stats.count):
+        response = client.get(f'/artists/{artist_id}')
+    assert response.status_code == 200
+    assert b'Venue 2' in response.data
+
+
+def test_suggest_is_answered_from_memory(warm_client):
+    with assert_max_queries(0):
+        response = warm_client.get('/search/suggest?q=ven')
+    assert [venue['name'] for venue in response.get_json()['venues']] == \
+        ['Venue 1', 'Venue 2']
+
+
+def test_create_submissions_query_counts(warm_client, listing):
+    # the genre and area are new, the change counters take up to five
+    # statements on sqlite
+    with assert_max_queries(11):
+        warm_client.post('/venues/create', data={
+            'name': 'The Musical Hop', 'address': '1015 Folsom Street',
+            'city': 'Oakland', 'state': 'CA', 'phone': '123-123-1234',
+            'genres': 'Swing', 'facebook_link': ''})
+    with assert_max_queries(11):
+        warm_client.post('/artists/create', data={
+            'name': 'Guns N Petals', 'city': 'Oakland', 'state': 'CA',
+            'phone': '326-123-5000', 'genres': 'Rock n Roll',
+            'facebook_link': ''})
+    with assert_max_queries(6):
+        warm_client.post('/shows/create', data={
+            'venue_id': listing['Venue 1'], 'artist_id': listing['Artist 2'],
+            'start_time': '2035-01-01 20:00:00'})
+    assert Venues.query.filter_by(name='The Musical Hop').count() == 1
+    assert Artists.query.filter_by(name='Guns N Petals').count() == 1
+    assert Shows.query.count() == 3
+
+
+def test_edit_submissions_query_counts_do_not_grow_with_shows(warm_client, listing):
+    venue_id, artist_id = listing['Venue 1'], listing['Artist 1']
+    add_shows(venue_id, artist_id, 40)
+    # the renamed venue bumps the pages of its artists, found in one query
+    with assert_max_queries(12):
+        warm_client.post(f'/venues/{venue_id}/edit', data={
+            'name': 'The Jazz Cellar', 'address': '1 Jazz Alley',
+            'city': 'Oakland', 'state': 'CA', 'phone': '123-123-1234',
+            'genres': 'Blues', 'facebook_link': ''})
+    with assert_max_queries(8):
+        warm_client.post(f'/artists/{artist_id}/edit', data={
+            'name': 'The Blues Band', 'city': 'Oakland', 'state': 'CA',
+            'phone': '326-123-5000', 'genres': 'Blues'})
+    assert db.session.query(Venues.name).filter_by(id=venue_id).scalar() == \
+        'The Jazz Cellar'
+    assert db.session.query(Artists.name).filter_by(id=artist_id).scalar() == \
+        'The Blues Band'
+
+
+def test_repeated_statements_are_logged_as_n_plus_one(app, client, caplog):
+    threshold = app.config['N_PLUS_ONE_THRESHOLD']
+
+    @app.route('/test/names')
+    def names():
+        # one query per venue instead of one for all of them
+        return ' '.join(str(db.session.query(Venues.name).
+                            filter_by(id=venue_id).scalar())
+                        for venue_id in range(threshold + 1))
+
+    with caplog.at_level('WARNING', logger=app.logger.name):
+        client.get('/')
+        assert not [record for record in caplog.records
+                    if 'probable N+1' in record.getMessage()]
+        client.get('/test/names')
+    warnings = [record.getMessage() for record in caplog.records
+                if 'probable N+1' in record.getMessage()]
+    assert len(warnings) == 1
+    assert f'(GET /test/names): {threshold + 1}x SELECT' in warnings[0]
@@ -0,0 +1,19 @@
+from models import db, Genres, bump_versions
+from reference_data import reference_data
+
+
+def test_own_inserts_do_not_reload(app):
+    reference_data.warm()
+    genre = reference_data.genre('Jazz')
+    db.session.commit()
+    assert reference_data.genres(['jazz'])['jazz'] == (genre.id, 'Jazz')
+    assert not reference_data.sync()
+
+
+def test_inserts_of_other_processes_reload(app):
+    reference_data.warm()
+    db.session.execute(Genres.__table__.insert().values(name='Blues'))
+    bump_versions(db.session, ['Genres'])
+    db.session.commit()
+    assert reference_data.sync()
+    assert 'blues' in reference_data.genres(['Blues'])
@@ -0,0 +1,30 @@
+from search_index import NameIndex
+
+
+def make_index():
+    index = NameIndex()
+    index.rebuild([(1, 'The Musical Hop'),
+                   (2, 'Park Square Live Music & Coffee'),
+                   (3, 'The Dueling Pianos Bar')])
+    return index
+
+
+def test_search_finds_mid_word_substring():
+    # the term covers more of the shorter name
+    assert make_index().search('usic') == [1, 2]
+    assert make_index().search('sical ho') == [1]
+
+
+def test_search_finds_short_terms():
+    assert sorted(make_index().search('h')) == [1, 3]
+
+
+def test_search_tolerates_typos():
+    assert make_index().search('musicla hop')[0] == 1
+
+
+def test_search_follows_renames():
+    index = make_index()
+    index.add(1, 'The Jazz Cellar')
+    assert 1 not in index.search('usic')
+    assert index.search('azz') == [1]
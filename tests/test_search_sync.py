@@ -0,0 +1,79 @@
+from models import db, Areas, Venues, bump_versions, table_versions
+from search_index import (venue_names, rebuild_search_indexes,
+                          sync_search_indexes)
+
+
+def add_venue(name):
+    venue = Venues(name=name, area=Areas(city='Oakland', state='CA'))
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+
+def test_own_writes_do_not_rebuild(app):
+    rebuild_search_indexes()
+    venue_id = add_venue('The Musical Hop')
+    assert venue_names.search('musical') == [venue_id]
+
+    venue = Venues.query.get(venue_id)
+    venue.name = 'The Jazz Cellar'
+    db.session.commit()
+    assert venue_names.search('jazz') == [venue_id]
+    assert not sync_search_indexes()
+
+
+def test_writes_of_other_processes_rebuild(app):
+    rebuild_search_indexes()
+    add_venue('The Musical Hop')
+    # a write the index did not see, e.g. by a sibling worker
+    db.session.execute(Venues.__table__.update().values(name='The Jazz Cellar'))
+    bump_versions(db.session, ['Venues'])
+    db.session.commit()
+    assert sync_search_indexes()
+    assert venue_names.search('jazz')
+
+
+def test_rolled_back_writes_are_not_indexed(app):
+    rebuild_search_indexes()
+    versions = table_versions(['Venues'])
+    venue = Venues(name='The Musical Hop', area=Areas(city='Oakland', state='CA'))
+    db.session.add(venue)
+    db.session.flush()
+    db.session.rollback()
+    assert venue_names.search('musical') == []
+    assert table_versions(['Venues']) == versions
+    assert not sync_search_indexes()
+
+
+def test_commits_do_not_wait_for_a_rebuild(app, monkeypatch):
+    import threading
+    import time
+    from search_index import NameIndex
+
+    rebuild = NameIndex.rebuild
+    loaded, go = threading.Event(), threading.Event()
+
+    def slow_rebuild(index, rows):
+        rows = list(rows)
+        loaded.set()
+        go.wait(5)
+        rebuild(index, rows)
+
+    def rebuild_in_thread():
+        with app.app_context():
+            rebuild_search_indexes()
+            db.session.remove()
+
+    monkeypatch.setattr(NameIndex, 'rebuild', slow_rebuild)
+    thread = threading.Thread(target=rebuild_in_thread)
+    thread.start()
+    assert loaded.wait(5)
+    start = time.perf_counter()
+    venue_id = add_venue('The Musical Hop')
+    assert time.perf_counter() - start < 1
+    go.set()
+    thread.join()
+    # the rebuilt index read the rows before the commit, which is
+    # replayed on it
+    assert venue_names.search('musical') == [venue_id]
+    assert not sync_search_indexes()
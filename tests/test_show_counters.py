@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import db, Artists, Shows, ShowCountersState, Venues, table_versions
+from show_counters import roll_over_show_counters, verify_show_counters
+
+
+def counters(model, id_):
+    row = db.session.query(model.upcoming_shows_count,
+                           model.past_shows_count).\
+        filter(model.id == id_).one()
+    return tuple(row)
+
+
+@pytest.fixture
+def rolled_over(listing):
+    # the listing's shows start in 30 days
+    roll_over_show_counters()
+    return listing
+
+
+def test_inserted_and_deleted_shows_are_counted(app, rolled_over):
+    venue_id, artist_id = rolled_over['Venue 1'], rolled_over['Artist 1']
+    show = Shows(venue_id=venue_id, artist_id=artist_id,
+                 start_time=datetime.utcnow() - timedelta(days=1))
+    db.session.add(show)
+    db.session.commit()
+    assert counters(Venues, venue_id) == (1, 1)
+    assert counters(Artists, artist_id) == (1, 1)
+
+    db.session.delete(show)
+    db.session.commit()
+    assert counters(Venues, venue_id) == (1, 0)
+    assert verify_show_counters() == []
+
+
+def test_moving_a_show_between_venues(app, rolled_over):
+    show = Shows.query.get(rolled_over['Show 1'])
+    show.venue_id = rolled_over['Venue 2']
+    db.session.commit()
+    assert counters(Venues, rolled_over['Venue 1']) == (0, 0)
+    assert counters(Venues, rolled_over['Venue 2']) == (2, 0)
+    assert counters(Artists, rolled_over['Artist 1']) == (1, 0)
+    assert verify_show_counters() == []
+
+
+def test_moving_a_show_across_the_watermark(app, rolled_over):
+    show = Shows.query.get(rolled_over['Show 1'])
+    show.start_time = datetime.utcnow() - timedelta(days=1)
+    db.session.commit()
+    assert counters(Venues, rolled_over['Venue 1']) == (0, 1)
+    assert counters(Artists, rolled_over['Artist 1']) == (0, 1)
+
+    show.start_time = datetime.utcnow() + timedelta(days=1)
+    db.session.commit()
+    assert counters(Venues, rolled_over['Venue 1']) == (1, 0)
+    assert verify_show_counters() == []
+
+
+def test_roll_over_moves_started_shows_to_past(app, rolled_over):
+    assert roll_over_show_counters(datetime.utcnow() + timedelta(days=60)) == 2
+    for name in ('Venue 1', 'Venue 2'):
+        assert counters(Venues, rolled_over[name]) == (0, 1)
+    assert verify_show_counters() == []
+    # nothing started since
+    assert roll_over_show_counters(datetime.utcnow() + timedelta(days=60)) == 0
+
+
+def test_without_watermark_all_shows_count_as_upcoming(app, listing):
+    assert ShowCountersState.query.count() == 0
+    venue_id = listing['Venue 1']
+    db.session.add(Shows(venue_id=venue_id, artist_id=listing['Artist 1'],
+                         start_time=datetime.utcnow() - timedelta(days=1)))
+    db.session.commit()
+    assert counters(Venues, venue_id) == (2, 0)
+    assert verify_show_counters() == []
+
+    # the first roll-over creates the watermark
+    assert roll_over_show_counters() == 1
+    assert counters(Venues, venue_id) == (1, 1)
+    assert ShowCountersState.query.count() == 1
+    assert verify_show_counters() == []
+
+
+def test_verify_finds_and_fixes_drift(app, rolled_over):
+    venue_id = rolled_over['Venue 1']
+    venues = Venues.__table__
+    db.session.execute(venues.update().where(venues.c.id == venue_id).
+                       values(upcoming_shows_count=5))
+    db.session.commit()
+    assert verify_show_counters(fix=True) == [
+        ('Venues', venue_id, (5, 0), (1, 0))]
+    assert counters(Venues, venue_id) == (1, 0)
+    assert verify_show_counters() == []
+
+
+def test_roll_over_keeps_the_name_versions(app, listing):
+    versions = table_versions(['Venues', 'Artists'])
+    roll_over_show_counters(datetime.utcnow() + timedelta(days=60))
+    assert table_versions(['Venues', 'Artists']) == versions
+    assert 'ShowCountersState' in table_versions(['ShowCountersState'])
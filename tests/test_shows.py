@@ -0,0 +1,64 @@
+import html
+import re
+from datetime import datetime, timedelta
+
+from models import db, Areas, Artists, Shows, Venues
+
+
+def add_timeline(app):
+    """
+    Three past and three upcoming shows of one venue, two shows a page.
+    The artist of each show is named after its day, 'Day -3' to 'Day 3'.
+    """
+    app.config['SHOWS_PER_PAGE'] = 2
+    venue = Venues(name='Timeline Hall',
+                   area=Areas(city='San Francisco', state='CA'))
+    now = datetime.utcnow()
+    db.session.add_all([Shows(venue=venue,
+                              artist=Artists(name=f'Day {day}'),
+                              start_time=now + timedelta(days=day))
+                        for day in (-3, -2, -1, 1, 2, 3)])
+    db.session.commit()
+    db.session.remove()
+
+
+def shown_days(response):
+    return [int(day) for day in
+            re.findall(rb'>Day (-?\d)</a>', response.data)]
+
+
+def pager_link(response, label):
+    match = re.search(rf'<a href="([^"]+)">[^<]*{label}',
+                      response.get_data(as_text=True))
+    return html.unescape(match.group(1)) if match else None
+
+
+def test_shows_start_at_upcoming_shows(app, client):
+    add_timeline(app)
+    response = client.get('/shows')
+    assert response.status_code == 200
+    assert shown_days(response) == [1, 2]
+    assert pager_link(response, 'Earlier shows')
+    assert pager_link(response, 'Later shows')
+
+
+def test_shows_cursors_cross_into_past_and_back(app, client):
+    add_timeline(app)
+    upcoming = client.get('/shows')
+
+    past = client.get(pager_link(upcoming, 'Earlier shows'))
+    assert shown_days(past) == [-2, -1]
+    first = client.get(pager_link(past, 'Earlier shows'))
+    assert shown_days(first) == [-3]
+    assert pager_link(first, 'Earlier shows') is None
+
+    back = client.get(pager_link(past, 'Later shows'))
+    assert shown_days(back) == [1, 2]
+    last = client.get(pager_link(back, 'Later shows'))
+    assert shown_days(last) == [3]
+    assert pager_link(last, 'Later shows') is None
+
+
+def test_shows_reject_malformed_cursors(client):
+    assert client.get('/shows?after=garbage').status_code == 400
+    assert client.get('/shows?before=yesterday_1').status_code == 400
@@ -0,0 +1,66 @@
+from slow_queries import is_plain_select, loggable_parameters
+
+
+def test_only_plain_selects_are_analyzed():
+    assert is_plain_select('SELECT name FROM "Venues" WHERE id = %(id)s')
+    assert not is_plain_select('WITH moved AS (DELETE FROM "Shows" RETURNING *) '
+                               'SELECT count(*) FROM moved')
+    assert not is_plain_select('SELECT * FROM "ShowCountersState" FOR UPDATE')
+    assert not is_plain_select('UPDATE "Venues" SET name = %(name)s')
+
+
+def test_parameters_are_logged_as_types_by_default():
+    assert loggable_parameters({'name': 'secret', 'id': 1}) == \
+        {'name': 'str', 'id': 'int'}
+    assert loggable_parameters(('x' * 100,), with_values=True) == \
+        ['x' * 64 + '... (100 long)']
+    assert loggable_parameters([(1,), (2,)], executemany=True) == \
+        {'rows': 2, 'first': ['int']}
+
+
+def test_slow_queries_are_logged_up_to_the_rate_limit(monkeypatch):
+    import json
+    import logging
+    import time
+    from app import create_app
+    from config import TestConfig
+    from models import db
+
+    class SlowQueryConfig(TestConfig):
+        SLOW_QUERY_THRESHOLD_MS = 20
+        SLOW_QUERY_MAX_PER_MINUTE = 2
+
+    app = create_app(SlowQueryConfig)
+
+    @app.route('/test/slow')
+    def slow():
+        connection = db.session.connection()
+        connection.connection.create_function('pause', 1, time.sleep)
+        for _ in range(3):
+            connection.execute(db.text('SELECT pause(:seconds)'),
+                               seconds=0.03)
+        connection.execute(db.text('SELECT 1'))
+        return ''
+
+    logger = logging.getLogger('fyyur.slow_queries')
+    logged = []
+    handler = logging.Handler()
+    handler.emit = logged.append
+    logger.addHandler(handler)
+    monkeypatch.setattr(logger, 'propagate', False)
+    try:
+        with app.app_context():
+            db.create_all()
+            app.test_client().get('/test/slow')
+            db.session.remove()
+            db.drop_all()
+    finally:
+        logger.removeHandler(handler)
+    records = [json.loads(record.getMessage()) for record in logged]
+    assert len(records) == 2
+    for record in records:
+        assert record['statement'] == 'SELECT pause(?)'
+        assert record['endpoint'] == 'slow'
+        assert record['duration_ms'] >= 20
+        assert record['parameters'] == ['float']
+        assert 'plan' in record
@@ -0,0 +1,52 @@
+import pytest
+
+import snapshots
+from app import create_app
+from models import db, Areas, Venues, BULK_LOADS, table_versions
+from search_index import venue_names, rebuild_search_indexes, \
+    sync_search_indexes
+
+
+@pytest.fixture
+def file_app(tmp_path):
+    # file snapshots need a database file rather than an in-memory one
+    app = create_app('test')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path}/fyyur.db'
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_restore_moves_counters_past_their_versions(file_app, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    snapshots.create_snapshot('empty', 'file', snapshot_dir)
+    venue = Venues(name='The Musical Hop', area=Areas(city='Oakland', state='CA'))
+    db.session.add(venue)
+    db.session.commit()
+    # a process that indexed the venue before the restore
+    rebuild_search_indexes()
+    assert venue_names.search('musical')
+    names = [BULK_LOADS, 'Venues', 'Areas']
+    before = table_versions(names)
+    db.session.remove()
+
+    snapshots.restore_snapshot('empty', 'file', snapshot_dir)
+
+    after = table_versions(names)
+    assert all(after[name][0] > before.get(name, (0,))[0] for name in names)
+    assert Venues.query.count() == 0
+    assert sync_search_indexes()
+    assert venue_names.search('musical') == []
+
+
+def test_reset_bumps_counters(file_app):
+    db.session.add(Venues(name='The Musical Hop',
+                          area=Areas(city='Oakland', state='CA')))
+    db.session.commit()
+    before = table_versions([BULK_LOADS, 'Venues'])
+    snapshots.reset_tables()
+    after = table_versions([BULK_LOADS, 'Venues'])
+    assert after[BULK_LOADS][0] > before.get(BULK_LOADS, (0,))[0]
+    assert after['Venues'][0] > before['Venues'][0]
@@ -0,0 +1,86 @@
+from instrumentation import count_queries, assert_max_queries
+from models import db, Areas, Venues
+
+
+def add_areas(num_areas, venues_per_area=2):
+    start = db.session.query(Areas).count()
+    for i in range(start, start + num_areas):
+        area = Areas(city=f'City {i}', state=f'S{i % 50}')
+        db.session.add(area)
+        db.session.add_all([Venues(name=f'Venue {i}-{j}', area=area,
+                                   image_link='image_link')
+                            for j in range(venues_per_area)])
+    db.session.commit()
+
+
+def test_venues_query_count_does_not_grow_with_areas(client):
+    add_areas(5)
+    # the first request also builds the search indexes
+    assert client.get('/venues').status_code == 200
+    # both counted requests follow a write, which drops the letter index
+    add_areas(1)
+    with count_queries() as stats:
+        assert client.get('/venues').status_code == 200
+
+    add_areas(44)
+    with assert_max_queries(stats.count):
+        response = client.get('/venues')
+    assert response.status_code == 200
+    # a full page of venues
+    assert response.data.count(b'href="/venues/') == 50
+
+
+def test_venues_shows_upcoming_show_counts(client, listing):
+    response = client.get('/venues')
+    assert response.data.count(b'1 Upcoming Show<') == 2
+
+
+def test_letter_index_is_kept_until_venues_change(client):
+    add_areas(1)
+    client.get('/venues')
+    with count_queries() as stats:
+        client.get('/venues')
+    assert not [statement for statement in stats.statements
+                if 'GROUP BY' in statement]
+
+    add_areas(1)
+    with count_queries() as stats:
+        response = client.get('/venues')
+    assert [statement for statement in stats.statements
+            if 'GROUP BY' in statement]
+    assert b'title="4">V<' in response.data
+
+
+def test_listing_pages_and_letters_ignore_case(app, client):
+    import re
+    area = Areas(city='Oakland', state='CA')
+    db.session.add_all([Venues(name=name, area=area)
+                        for name in ('apple Hall', 'Banana Club', 'Zebra Bar',
+                                     None)])
+    db.session.commit()
+    app.config['VENUES_PER_PAGE'] = 2
+
+    def page(url):
+        response = client.get(url)
+        after = re.search(rb'href="/venues\?after=([^"]+)"', response.data)
+        return response.data, after and after.group(1).decode()
+
+    data, _ = page('/venues?letter=a')
+    assert b'apple Hall' in data and b'Banana Club' in data
+    data, _ = page('/venues?letter=Z')
+    assert b'Zebra Bar' in data and b'Banana Club' not in data
+
+    # a cursor built like the benchmark builds them
+    from app import name_cursor
+    banana_id = db.session.query(Venues.id).filter_by(name='Banana Club').scalar()
+    data, _ = page(f'/venues?after={name_cursor("Banana Club", banana_id)}')
+    assert b'Zebra Bar' in data and b'Banana Club' not in data
+
+    # every venue, the unnamed one first, on some page
+    seen = []
+    data, after = page('/venues')
+    seen += re.findall(rb'href="/venues/(\d+)"', data)
+    while after:
+        data, after = page(f'/venues?after={after}')
+        seen += re.findall(rb'href="/venues/(\d+)"', data)
+    assert len(seen) == 4
@@ -0,0 +1,8 @@
+import os
+
+from app import create_app
+
+# Entry point of production servers, see gunicorn.conf.py:
+#   $ gunicorn -c gunicorn.conf.py wsgi:app
+
+app = create_app(os.environ.get('FYYUR_CONFIG', 'prod'))